@@ -0,0 +1,259 @@
+"""Микробенчмарк хранения VZP бота на синтетическом состоянии продового масштаба.
+
+Состояние: 10 активных VZP по 100 участников (с заменами и голосовыми интервалами),
+50 распределений позиций по 100 мест и 10k-100k закрытых VZP с составами, индексом
+статистики игроков и таблицами лидеров. Для каждого размера истории замеряются
+save_data и load_data (медиана из --repeat запусков), размер каждого файла данных
+и пиковая память процесса. Каждый замер идёт в отдельном процессе, чтобы пики
+памяти сохранения и загрузки не смешивались.
+
+Результат пишется в JSON (--output), его можно передать как --baseline при
+следующем прогоне, чтобы сравнить движки хранения.
+    
+    python bench_persistence.py --closed 10000 100000 --output bench_persistence.json
+    python bench_persistence.py --closed 10000 --baseline bench_persistence.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+def max_rss_kb() -> int:
+    # На Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# ===================== СИНТЕТИЧЕСКОЕ СОСТОЯНИЕ =====================
+GUILD_ID = 1_000_000_000_000_000_000  # Всё состояние бенчмарка принадлежит одному серверу
+
+class SyntheticMember:
+    """Вместо discord.Member в позициях - save_data нужен только id"""
+    def __init__(self, member_id: int):
+        self.id = member_id
+
+def build_state(core, args: argparse.Namespace, closed: int):
+    rng = random.Random(args.seed)
+    players = [1_100_000_000_000_000_000 + i for i in range(args.players)]
+    now = datetime.now()
+    
+    for i in range(args.active):
+        vzp_id = f"a{i:07x}"
+        roster = rng.sample(players, args.participants)
+        core.active_vzp[vzp_id] = core.VZPData({
+            'time': "20:00",
+            'members': args.participants,
+            'enemy': "",
+            'attack_def': "ATT",
+            'attack_def_name': " АТАКА",
+            'conditions': ["armor", "medkits"],
+            'conditions_display': ["Броня", "Аптечки"],
+            'calibers': ["5.56", "7.62", "9"],
+            'caliber_names': ["5.56 mm", "7.62 mm", "9 mm"],
+            'message_id': 1_200_000_000_000_000_000 + i,
+            'channel_id': 1_210_000_000_000_000_000,
+            'category_id': 1_220_000_000_000_000_000 + i,
+            'plus_users': {user_id: rng.randint(1, 3) for user_id in roster},
+            'status': 'VZP IN PROCESS',
+            'created_at': now.isoformat(),
+            'guild_id': GUILD_ID
+        })
+        core.swap_history[vzp_id] = {roster[j]: rng.choice(players) for j in range(5)}
+        started = time.time() - 3600
+        core.voice_sessions[vzp_id] = {
+            user_id: [[started, started + 600], [started + 900, None]] for user_id in roster
+        }
+    
+    for i in range(args.boards):
+        pos_id = f"POS_{i:08x}"
+        channel_id = 1_230_000_000_000_000_000 + i
+        core.position_assignments[pos_id] = {
+            pos: SyntheticMember(rng.choice(players)) if rng.random() < 0.8 else None
+            for pos in range(1, args.seats + 1)
+        }
+        core.position_messages[pos_id] = {"message_id": 1_240_000_000_000_000_000 + i, "channel_id": channel_id, "guild_id": GUILD_ID}
+        core.active_position_calls[channel_id] = {
+            "pos_id": pos_id, "vzp_id": None, "created_by": players[0], "created_at": now.isoformat(), "guild_id": GUILD_ID
+        }
+    
+    closed_at = now - timedelta(days=730)
+    step = timedelta(days=730) / max(closed, 1)
+    for i in range(closed):
+        roster = rng.sample(players, rng.randint(args.roster_min, args.roster_max))
+        swaps = {str(roster[j]): rng.choice(players) for j in range(rng.randint(0, 3))}
+        record = {
+            'time': "20:00",
+            'enemy': f"enemy{rng.randint(1, 50)}",
+            'members': len(roster),
+            'result': rng.choice(['win', 'lose']),
+            'amount': rng.randint(0, 10),
+            'participants': len(roster),
+            'all_participants': len(roster) + len(swaps),
+            'closed_at': (closed_at + step * i).isoformat(),
+            'roster': {str(user_id): rng.randint(1, 3) for user_id in roster},
+            'swaps': swaps
+        }
+        if args.voice:
+            record['voice_seconds'] = {str(user_id): rng.randint(0, 7200) for user_id in roster}
+        core.closed_vzp.setdefault(GUILD_ID, {})[f"c{i:07x}"] = record
+        core.index_closed_vzp(GUILD_ID, record)
+        core.update_leaderboards(GUILD_ID, record)
+
+# ===================== ЗАМЕРЫ =====================
+def timed(func, repeat: int) -> Dict:
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        runs.append((time.perf_counter() - started) * 1000)
+    return {
+        "median_ms": statistics.median(runs),
+        "min_ms": min(runs),
+        "max_ms": max(runs),
+        "runs_ms": runs
+    }
+
+def run_worker(args: argparse.Namespace) -> Dict:
+    """Один замер в отдельном процессе: save строит состояние и сохраняет, load читает готовые файлы"""
+    os.chdir(args.workdir)
+    import stealzbot2 as core
+    logging.getLogger("vzp").setLevel(logging.ERROR)
+    
+    if args.worker == 'save':
+        build_state(core, args, args.worker_closed)
+        rss_before = max_rss_kb()
+        result = {"timing": timed(core.save_data, args.repeat)}
+        paths = [core.guild_file(GUILD_ID, name) for name in core.DATA_FILES]
+        result["files"] = {os.path.basename(path): os.path.getsize(path) for path in paths if os.path.exists(path)}
+    else:
+        rss_before = max_rss_kb()
+        result = {"timing": timed(core.load_data, args.repeat)}
+        loaded = len(core.closed_vzp.get(GUILD_ID, {}))
+        if loaded != args.worker_closed:
+            raise RuntimeError(f"load_data прочитал {loaded} закрытых VZP вместо {args.worker_closed}")
+    
+    rss_after = max_rss_kb()
+    result["peak_rss_kb"] = rss_after
+    result["rss_growth_kb"] = rss_after - rss_before
+    return result
+
+def spawn_worker(mode: str, closed: int, workdir: str, argv: List[str]) -> Dict:
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *argv, "--worker", mode,
+         "--worker-closed", str(closed), "--workdir", workdir],
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Замер {mode} для {closed} закрытых VZP упал:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def bench_size(closed: int, argv: List[str]) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="vzp_bench_")
+    try:
+        saved = spawn_worker('save', closed, workdir, argv)
+        loaded = spawn_worker('load', closed, workdir, argv)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "closed": closed,
+        "save": saved["timing"],
+        "load": loaded["timing"],
+        "files": saved["files"],
+        "total_bytes": sum(saved["files"].values()),
+        "peak_rss_kb": {"save": saved["peak_rss_kb"], "load": loaded["peak_rss_kb"]},
+        "rss_growth_kb": {"save": saved["rss_growth_kb"], "load": loaded["rss_growth_kb"]}
+    }
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+# ===================== ОТЧЁТ =====================
+def format_delta(old: float, new: float) -> str:
+    return f"{(new - old) * 100 / old:+.0f}%" if old else "-"
+
+def print_result(result: Dict, baseline: Dict = None):
+    print(f"\n=== {result['closed']} закрытых VZP ===")
+    rows = [
+        ("save_data, мс", result["save"]["median_ms"], baseline and baseline["save"]["median_ms"]),
+        ("load_data, мс", result["load"]["median_ms"], baseline and baseline["load"]["median_ms"]),
+        ("файлы, КБ", result["total_bytes"] / 1024, baseline and baseline["total_bytes"] / 1024),
+        ("пик памяти save, МБ", result["peak_rss_kb"]["save"] / 1024, baseline and baseline["peak_rss_kb"]["save"] / 1024),
+        ("пик памяти load, МБ", result["peak_rss_kb"]["load"] / 1024, baseline and baseline["peak_rss_kb"]["load"] / 1024),
+    ]
+    for name, value, old in rows:
+        line = f"  {name:<22}{value:>12.1f}"
+        if old is not None:
+            line += f"   было {old:>10.1f}  {format_delta(old, value):>6}"
+        print(line)
+    for path, size in sorted(result["files"].items(), key=lambda item: item[1], reverse=True):
+        print(f"    {path:<28}{size / 1024:>12.1f} КБ")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Микробенчмарк save_data/load_data VZP бота")
+    parser.add_argument("--closed", type=int, nargs="+", default=[10000, 100000], help="Размеры истории закрытых VZP")
+    parser.add_argument("--active", type=int, default=10, help="Активных VZP")
+    parser.add_argument("--participants", type=int, default=100, help="Участников в активной VZP")
+    parser.add_argument("--boards", type=int, default=50, help="Распределений позиций")
+    parser.add_argument("--seats", type=int, default=100, help="Мест в распределении")
+    parser.add_argument("--players", type=int, default=3000, help="Всего игроков, из которых набираются составы")
+    parser.add_argument("--roster-min", type=int, default=20, help="Минимальный состав закрытой VZP")
+    parser.add_argument("--roster-max", type=int, default=60, help="Максимальный состав закрытой VZP")
+    parser.add_argument("--no-voice", dest="voice", action="store_false", help="Без голосовой посещаемости в истории")
+    parser.add_argument("--repeat", type=int, default=3, help="Запусков save/load на замер")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно генератора")
+    parser.add_argument("--output", default="bench_persistence.json", help="Файл результатов JSON")
+    parser.add_argument("--baseline", help="Результаты прошлого прогона для сравнения")
+    parser.add_argument("--worker", choices=["save", "load"], help=argparse.SUPPRESS)
+    parser.add_argument("--worker-closed", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    return parser
+
+def main(argv: List[str]) -> int:
+    args = build_parser().parse_args(argv)
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return 0
+    
+    # Параметры состояния передаются рабочим процессам как есть
+    state_argv = list(argv)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {entry["closed"]: entry for entry in json.load(f)["results"]}
+    
+    results = []
+    for closed in args.closed:
+        result = bench_size(closed, state_argv)
+        print_result(result, baseline.get(closed))
+        results.append(result)
+    
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if not key.startswith('worker') and key != 'workdir'}
+        },
+        "results": results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Результаты записаны в {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,238 @@
+"""Лаунчер VZP бота в режиме "один шард на процесс".
+
+Запускает N процессов stealzbot2.py с VZP_SHARD_MODE=process, перезапускает упавшие
+(с нарастающей паузой, если процесс падает сразу после старта) и зависшие - те, кто
+дольше --stale-after секунд не обновлял свой отчёт в shards/shard-<id>.json.
+Процессы делят только папку guilds/: каждый сервер принадлежит ровно одному шарду,
+поэтому его файлы пишет один процесс.
+
+Сводка по шардам печатается раз в --status-interval секунд, с --health-port она же
+доступна как JSON на http://127.0.0.1:<port>/health (503, если какой-то шард не в порядке).
+    
+    python launcher.py --shards 4
+    python launcher.py --shards auto --health-port 9300
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from typing import List, Optional
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stealzbot2.py")
+HEALTH_DIR = "shards"  # Совпадает с SHARD_HEALTH_DIR бота
+STABLE_UPTIME = 300  # Процесс, проживший столько секунд, снова перезапускается без паузы
+KILL_TIMEOUT = 15
+
+def log(message: str):
+    print(f"[launcher {time.strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+# ===================== ПРОЦЕСС ШАРДА =====================
+class ShardProcess:
+    def __init__(self, shard_id: int, shard_count: int, args: argparse.Namespace):
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.args = args
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.failures = 0  # Падения подряд - от них зависит пауза перед перезапуском
+        self.state = "starting"
+        self.last_exit: Optional[int] = None
+        self.stopping = False
+    
+    @property
+    def health_path(self) -> str:
+        return os.path.join(HEALTH_DIR, f"shard-{self.shard_id}.json")
+    
+    def read_health(self) -> Optional[dict]:
+        try:
+            with open(self.health_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    async def start(self):
+        # Старый отчёт прошлого процесса не должен засчитаться новому
+        if os.path.exists(self.health_path):
+            os.remove(self.health_path)
+        env = dict(os.environ, VZP_SHARD_MODE="process", VZP_SHARD_ID=str(self.shard_id),
+                   VZP_SHARD_COUNT=str(self.shard_count))
+        self.process = await asyncio.create_subprocess_exec(self.args.python, BOT_SCRIPT, env=env)
+        self.started_at = time.time()
+        self.state = "starting"
+        log(f"▶️ Шард {self.shard_id}/{self.shard_count} запущен, pid {self.process.pid}")
+    
+    async def supervise(self):
+        while not self.stopping:
+            await self.start()
+            self.last_exit = await self.process.wait()
+            if self.stopping:
+                break
+            
+            uptime = time.time() - self.started_at
+            self.failures = 0 if uptime >= STABLE_UPTIME else self.failures + 1
+            delay = min(self.args.max_backoff, 2 ** self.failures - 1)
+            self.restarts += 1
+            self.state = "restarting"
+            log(f"💥 Шард {self.shard_id} завершился с кодом {self.last_exit} через {uptime:.0f} с, "
+                f"перезапуск через {delay} с")
+            await asyncio.sleep(delay)
+    
+    def heartbeat_age(self, health: Optional[dict]) -> Optional[float]:
+        if health is None or health.get("pid") != (self.process and self.process.pid):
+            return None
+        return time.time() - health["updated_at"]
+    
+    async def check_hung(self):
+        """Процесс жив, но давно не обновлял отчёт - цикл событий завис, перезапускаем"""
+        if not self.process or self.process.returncode is not None:
+            return
+        age = self.heartbeat_age(self.read_health())
+        since_start = time.time() - self.started_at
+        if (age is None and since_start > self.args.stale_after) or (age is not None and age > self.args.stale_after):
+            self.state = "hung"
+            log(f"🧊 Шард {self.shard_id} не отвечает {age or since_start:.0f} с, перезапуск")
+            await self.terminate()
+    
+    async def terminate(self):
+        if not self.process or self.process.returncode is not None:
+            return
+        self.process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(self.process.wait(), KILL_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+    
+    def status(self) -> dict:
+        running = self.process is not None and self.process.returncode is None
+        health = self.read_health() if running else None
+        age = self.heartbeat_age(health)
+        if age is not None:
+            self.state = "ready" if health.get("ready") else "connecting"
+        shards = (health or {}).get("shards", {}) if age is not None else {}
+        shard = shards.get(str(self.shard_id), {})
+        return {
+            "shard": self.shard_id,
+            "pid": self.process.pid if running else None,
+            "state": self.state,
+            "healthy": self.state == "ready" and shard.get("connected", False),
+            "restarts": self.restarts,
+            "last_exit": self.last_exit,
+            "uptime_s": round(time.time() - self.started_at) if running else 0,
+            "heartbeat_age_s": round(age, 1) if age is not None else None,
+            "latency_ms": shard.get("latency_ms"),
+            "guilds": shard.get("guilds"),
+            "active_vzp": shard.get("active_vzp"),
+            "disconnects": shard.get("disconnects"),
+            "loop_lag_p99_ms": (health or {}).get("loop_lag_p99_ms") if age is not None else None
+        }
+
+# ===================== СВОДКА =====================
+def format_status(statuses: List[dict]) -> str:
+    lines = [f"{'шард':>4} {'pid':>8} {'состояние':<11} {'пинг':>7} {'серв.':>6} {'VZP':>4} {'p99':>7} {'рест.':>5} {'пульс':>6}"]
+    for s in statuses:
+        show = lambda value, fmt="{}": fmt.format(value) if value is not None else "—"
+        lines.append(
+            f"{s['shard']:>4} {show(s['pid']):>8} {s['state']:<11} {show(s['latency_ms'], '{:.0f}'):>7} "
+            f"{show(s['guilds']):>6} {show(s['active_vzp']):>4} {show(s['loop_lag_p99_ms'], '{:.0f}'):>7} "
+            f"{s['restarts']:>5} {show(s['heartbeat_age_s'], '{:.0f}s'):>6}"
+        )
+    return "\n".join(lines)
+
+async def start_health_server(shards: List[ShardProcess], port: int):
+    async def health_handler(request: web.Request) -> web.Response:
+        statuses = [shard.status() for shard in shards]
+        healthy = all(s["healthy"] for s in statuses)
+        return web.json_response({"healthy": healthy, "shards": statuses}, status=200 if healthy else 503)
+    
+    app = web.Application()
+    app.router.add_get("/health", health_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    log(f"🩺 Состояние шардов: http://127.0.0.1:{port}/health")
+
+async def recommended_shards() -> int:
+    """Сколько шардов рекомендует Discord для этого бота"""
+    token = os.getenv('DISCORD_TOKEN')
+    if not token:
+        raise SystemExit("❌ Для --shards auto нужен DISCORD_TOKEN")
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot",
+                               headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+# ===================== ЗАПУСК =====================
+async def run(args: argparse.Namespace) -> int:
+    shard_count = await recommended_shards() if args.shards == "auto" else int(args.shards)
+    if shard_count < 1:
+        raise SystemExit("❌ --shards должно быть не меньше 1")
+    log(f"🧩 Шардов: {shard_count}")
+    
+    shards = [ShardProcess(shard_id, shard_count, args) for shard_id in range(shard_count)]
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    if args.health_port:
+        await start_health_server(shards, args.health_port)
+    
+    supervisors = []
+    for shard in shards:
+        supervisors.append(asyncio.create_task(shard.supervise()))
+        # Discord разрешает подключать шарды по одному раз в ~5 секунд (max_concurrency = 1)
+        if shard is not shards[-1]:
+            try:
+                await asyncio.wait_for(stop.wait(), args.start_delay)
+            except asyncio.TimeoutError:
+                pass
+        if stop.is_set():
+            break
+    
+    next_status = time.time() + args.status_interval
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), min(5, args.status_interval))
+        except asyncio.TimeoutError:
+            pass
+        for shard in shards:
+            await shard.check_hung()
+        if time.time() >= next_status:
+            next_status = time.time() + args.status_interval
+            print(format_status([shard.status() for shard in shards]), file=sys.stderr, flush=True)
+    
+    log("🛑 Остановка шардов...")
+    for shard in shards:
+        shard.stopping = True
+    await asyncio.gather(*(shard.terminate() for shard in shards))
+    for task in supervisors:
+        task.cancel()
+    await asyncio.gather(*supervisors, return_exceptions=True)
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Запуск VZP бота по процессу на шард с перезапуском упавших")
+    parser.add_argument("--shards", default=os.getenv('VZP_SHARD_COUNT') or "auto",
+                        help="Количество шардов или auto - сколько рекомендует Discord")
+    parser.add_argument("--python", default=sys.executable, help="Интерпретатор для процессов шардов")
+    parser.add_argument("--start-delay", type=float, default=5.0, help="Пауза между запусками шардов, с")
+    parser.add_argument("--stale-after", type=float, default=60.0,
+                        help="Через сколько секунд без отчёта процесс считается зависшим")
+    parser.add_argument("--max-backoff", type=int, default=60, help="Максимальная пауза перед перезапуском, с")
+    parser.add_argument("--status-interval", type=float, default=30.0, help="Как часто печатать сводку, с")
+    parser.add_argument("--health-port", type=int, default=0, help="Порт JSON-эндпоинта /health, 0 - выключен")
+    return parser
+
+if __name__ == "__main__":
+    load_dotenv()
+    sys.exit(asyncio.run(run(build_parser().parse_args())))
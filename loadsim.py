@@ -0,0 +1,905 @@
+"""Офлайн-нагрузочный стенд VZP бота.
+
+Ядро бота (stealzbot2) запускается на подменном слое Discord: гильдия, каналы, сообщения,
+участники и REST API живут в памяти, сеть не нужна. Сценарий одновременно гоняет:
+  - N игроков, которые жмут кнопку VZP (handle_vzp_button через VZPPlusButton);
+  - M игроков, которые спамят номерами позиций в распределение (on_message);
+  - админские команды (list_vzp, stats, leaderboard, bot_stats) и запуск второй VZP (start_vzp).
+Команды идут через VZPCommandTree.interaction_check, как в проде.
+
+REST стенда имеет настраиваемую задержку, лимиты по маршрутам и случайные ответы 429.
+В конце печатается p50/p99 задержки ответа, число REST-запросов на действие и проверки
+итогового состояния. Код выхода 1, если какая-то проверка не прошла.
+    
+    python loadsim.py --clickers 150 --spammers 40 --rest-latency 80 --json report.json
+
+С VZP_TRACE_FILE трафик прогона (после подготовки) записывается для replay.py.
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import discord
+from discord import app_commands
+
+import stealzbot2 as core
+
+INTERACTION_DEADLINE = 3.0  # Discord ждёт ответа на взаимодействие не дольше 3 секунд
+
+snowflakes = itertools.count(1_300_000_000_000_000_000)
+
+def next_id() -> int:
+    return next(snowflakes)
+
+# ===================== УЧЁТ ДЕЙСТВИЙ =====================
+class Action:
+    """Одно действие пользователя: нажатие, сообщение или команда. REST-запросы,
+    сделанные во время действия (и в порождённых им фоновых задачах), записываются сюда"""
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.acked: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.rest_calls = 0
+        self.error: Optional[str] = None
+    
+    def ack(self):
+        if self.acked is None:
+            self.acked = time.perf_counter()
+    
+    @property
+    def ack_latency(self) -> Optional[float]:
+        return self.acked - self.started if self.acked is not None else None
+    
+    @property
+    def total_latency(self) -> float:
+        return self.finished - self.started
+
+current_action: contextvars.ContextVar[Optional[Action]] = contextvars.ContextVar('current_action', default=None)
+
+async def run_action(actions: List[Action], kind: str, factory: Callable) -> Action:
+    action = Action(kind)
+    token = current_action.set(action)
+    try:
+        await factory()
+    except Exception as e:
+        action.error = repr(e)
+        core.log.exception(f"Действие {kind} упало: {e}")
+    finally:
+        action.finished = time.perf_counter()
+        current_action.reset(token)
+        actions.append(action)
+    return action
+
+# ===================== ПОДМЕННЫЙ REST =====================
+class FakeHTTPResponse:
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+def not_found() -> discord.NotFound:
+    return discord.NotFound(FakeHTTPResponse(404, 'Not Found'), {'code': 10008, 'message': 'Unknown Message'})
+
+class FakeREST:
+    """Имитация REST API: задержка на каждый запрос, скользящее окно лимита на маршрут+канал
+    (как bucket в discord.py - клиент ждёт сам, без 429) и случайные 429 с повтором после retry_after"""
+    def __init__(self, latency: float, jitter: float, bucket_limit: int, bucket_window: float,
+                 error_rate: float, retry_after: float, rng: random.Random):
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = rng
+        self.calls: Dict[str, int] = {}
+        self.rate_limited = 0
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self.buckets: Dict[tuple, deque] = {}
+    
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+    
+    async def wait_bucket(self, bucket: tuple):
+        window = self.buckets.setdefault(bucket, deque())
+        waited_since = None
+        while True:
+            now = time.monotonic()
+            while window and now - window[0] >= self.bucket_window:
+                window.popleft()
+            if len(window) < self.bucket_limit:
+                window.append(now)
+                if waited_since is not None:
+                    self.throttled += 1
+                    self.throttle_seconds += now - waited_since
+                return
+            if waited_since is None:
+                waited_since = now
+            await asyncio.sleep(self.bucket_window - (now - window[0]))
+    
+    async def request(self, method: str, route: str, major=None, limited: bool = True, ack: bool = False):
+        key = f"{method} {route}"
+        action = current_action.get()
+        while True:
+            if limited and self.bucket_limit:
+                await self.wait_bucket((key, major))
+            self.calls[key] = self.calls.get(key, 0) + 1
+            if action:
+                action.rest_calls += 1
+            await asyncio.sleep(max(0.0, self.rng.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+            if limited and self.rng.random() < self.error_rate:
+                # discord.py сам ждёт retry_after и повторяет запрос
+                self.rate_limited += 1
+                await asyncio.sleep(self.retry_after)
+                continue
+            break
+        if ack and action:
+            action.ack()
+
+# ===================== ПОДМЕННЫЕ ОБЪЕКТЫ DISCORD =====================
+class FakeRole:
+    def __init__(self, guild: 'FakeGuild', role_id: int, name: str):
+        self.guild = guild
+        self.id = role_id
+        self.name = name
+    
+    @property
+    def mention(self) -> str:
+        return f"<@&{self.id}>"
+    
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and other.id == self.id
+    
+    def __hash__(self):
+        return hash(self.id)
+    
+    async def delete(self, reason: str = None):
+        await self.guild.rest.request('DELETE', '/guilds/{guild_id}/roles/{role_id}', self.guild.id)
+        self.guild.roles.pop(self.id, None)
+        for member in self.guild.members:
+            if self in member.roles:
+                member.roles.remove(self)
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+class FakeMember:
+    def __init__(self, guild: 'FakeGuild', member_id: int, name: str, roles: List[FakeRole], bot: bool = False):
+        self.guild = guild
+        self.id = member_id
+        self.name = name
+        self.display_name = name
+        self.roles = list(roles)
+        self.bot = bot
+        self.voice: Optional[FakeVoiceState] = None
+        self.dms: List[dict] = []
+    
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+    
+    def __eq__(self, other):
+        return isinstance(other, FakeMember) and other.id == self.id
+    
+    def __hash__(self):
+        return hash(self.id)
+    
+    async def send(self, content: str = None, **kwargs):
+        await self.guild.rest.request('POST', '/channels/{channel_id}/messages', ('dm', self.id))
+        self.dms.append({'content': content, **kwargs})
+    
+    async def add_roles(self, *roles, reason: str = None):
+        for role in roles:
+            await self.guild.rest.request('PUT', '/guilds/{guild_id}/members/{user_id}/roles/{role_id}', self.guild.id)
+            if role not in self.roles:
+                self.roles.append(role)
+    
+    async def remove_roles(self, *roles, reason: str = None):
+        for role in roles:
+            await self.guild.rest.request('DELETE', '/guilds/{guild_id}/members/{user_id}/roles/{role_id}', self.guild.id)
+            if role in self.roles:
+                self.roles.remove(role)
+    
+    async def move_to(self, channel, reason: str = None):
+        await self.guild.rest.request('PATCH', '/guilds/{guild_id}/members/{user_id}', self.guild.id)
+        self.voice = FakeVoiceState(channel) if channel else None
+
+class FakeMessage:
+    def __init__(self, channel: 'FakeTextChannel', message_id: int, author: Optional[FakeMember],
+                 content: str = None, embed: discord.Embed = None, view=None):
+        self.channel = channel
+        self.id = message_id
+        self.author = author
+        self.content = content
+        self.embed = embed
+        self.view = view
+        self.edits = 0
+        self.pinned = False
+    
+    @property
+    def guild(self) -> 'FakeGuild':
+        return self.channel.guild
+    
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.com/channels/{self.channel.guild.id}/{self.channel.id}/{self.id}"
+    
+    def stored(self) -> 'FakeMessage':
+        message = self.channel.messages.get(self.id)
+        if message is None:
+            raise not_found()
+        return message
+    
+    async def edit(self, **fields):
+        await self.channel.guild.rest.request('PATCH', '/channels/{channel_id}/messages/{message_id}', self.channel.id)
+        # Состояние меняется в момент завершения запроса - как у настоящего API при гонке правок
+        message = self.stored()
+        for name in ('content', 'embed', 'view'):
+            if name in fields:
+                setattr(message, name, fields[name])
+        message.edits += 1
+        return message
+    
+    async def delete(self, delay: float = None):
+        await self.channel.guild.rest.request('DELETE', '/channels/{channel_id}/messages/{message_id}', self.channel.id)
+        self.stored()
+        del self.channel.messages[self.id]
+    
+    async def pin(self, reason: str = None):
+        await self.channel.guild.rest.request('PUT', '/channels/{channel_id}/pins/{message_id}', self.channel.id)
+        self.stored().pinned = True
+
+class FakeChannelMixin:
+    """Общее для подменных каналов. Классы наследуют настоящие классы discord.py,
+    чтобы проверки isinstance в боте работали как в проде"""
+    def setup(self, guild: 'FakeGuild', channel_id: int, name: str, category_id: Optional[int]):
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.category_id = category_id
+        self.position = 0
+        self.fake_overwrites: Dict = {}
+        guild.channels[channel_id] = self
+    
+    @property
+    def overwrites(self) -> Dict:
+        return dict(self.fake_overwrites)
+    
+    async def edit(self, name: str = None, overwrites: Dict = None, **kwargs):
+        await self.guild.rest.request('PATCH', '/channels/{channel_id}', self.id)
+        if name is not None:
+            self.name = name
+        if overwrites is not None:
+            self.fake_overwrites = dict(overwrites)
+        return self
+    
+    async def set_permissions(self, target, *, overwrite: discord.PermissionOverwrite = None, reason: str = None, **permissions):
+        await self.guild.rest.request('PUT', '/channels/{channel_id}/permissions/{overwrite_id}', self.id)
+        if overwrite is None and not permissions:
+            self.fake_overwrites.pop(target, None)
+        else:
+            self.fake_overwrites[target] = overwrite or discord.PermissionOverwrite(**permissions)
+    
+    async def delete(self, reason: str = None):
+        await self.guild.rest.request('DELETE', '/channels/{channel_id}', self.id)
+        if self.guild.channels.pop(self.id, None) is None:
+            raise not_found()
+
+class FakeTextChannel(FakeChannelMixin, discord.TextChannel):
+    def __init__(self, guild: 'FakeGuild', channel_id: int, name: str, category_id: Optional[int] = None):
+        self.setup(guild, channel_id, name, category_id)
+        self.messages: Dict[int, FakeMessage] = {}
+    
+    def post(self, author: Optional[FakeMember], **fields) -> FakeMessage:
+        message = FakeMessage(self, next_id(), author, **fields)
+        self.messages[message.id] = message
+        return message
+    
+    async def send(self, content: str = None, *, embed: discord.Embed = None, view=None, **kwargs) -> FakeMessage:
+        await self.guild.rest.request('POST', '/channels/{channel_id}/messages', self.id, ack=True)
+        return self.post(self.guild.me, content=content, embed=embed, view=view)
+    
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self.guild.rest.request('GET', '/channels/{channel_id}/messages/{message_id}', self.id)
+        message = self.messages.get(message_id)
+        if message is None:
+            raise not_found()
+        return message
+    
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self, message_id, None)
+    
+    async def purge(self, limit: int = None, **kwargs) -> List[FakeMessage]:
+        await self.guild.rest.request('POST', '/channels/{channel_id}/messages/bulk-delete', self.id)
+        purged = list(self.messages.values())
+        self.messages.clear()
+        return purged
+
+class FakeVoiceChannel(FakeChannelMixin, discord.VoiceChannel):
+    def __init__(self, guild: 'FakeGuild', channel_id: int, name: str, category_id: Optional[int] = None):
+        self.setup(guild, channel_id, name, category_id)
+    
+    @property
+    def members(self) -> List[FakeMember]:
+        return [member for member in self.guild.members if member.voice and member.voice.channel is self]
+
+class FakeCategory(FakeChannelMixin, discord.CategoryChannel):
+    def __init__(self, guild: 'FakeGuild', channel_id: int, name: str):
+        self.setup(guild, channel_id, name, None)
+    
+    @property
+    def channels(self) -> List:
+        return sorted((ch for ch in self.guild.channels.values() if ch.category_id == self.id), key=lambda ch: ch.id)
+    
+    @property
+    def text_channels(self) -> List[FakeTextChannel]:
+        return [ch for ch in self.channels if isinstance(ch, FakeTextChannel)]
+    
+    @property
+    def voice_channels(self) -> List[FakeVoiceChannel]:
+        return [ch for ch in self.channels if isinstance(ch, FakeVoiceChannel)]
+    
+    async def create_text_channel(self, name: str, **kwargs) -> FakeTextChannel:
+        await self.guild.rest.request('POST', '/guilds/{guild_id}/channels', self.guild.id)
+        channel = FakeTextChannel(self.guild, next_id(), name, self.id)
+        channel.fake_overwrites = dict(self.fake_overwrites)
+        return channel
+    
+    async def create_voice_channel(self, name: str, **kwargs) -> FakeVoiceChannel:
+        await self.guild.rest.request('POST', '/guilds/{guild_id}/channels', self.guild.id)
+        channel = FakeVoiceChannel(self.guild, next_id(), name, self.id)
+        channel.fake_overwrites = dict(self.fake_overwrites)
+        return channel
+
+class FakeGuild:
+    def __init__(self, rest: FakeREST, guild_id: Optional[int] = None):
+        self.rest = rest
+        self.id = guild_id or next_id()
+        self.name = "Offline Guild"
+        self.channels: Dict[int, FakeChannelMixin] = {}
+        self.members_by_id: Dict[int, FakeMember] = {}
+        self.roles: Dict[int, FakeRole] = {}
+        self.default_role = self.add_role(self.id, "@everyone")
+        self.me = self.add_member("VZP Bot", [], bot=True)
+    
+    @property
+    def members(self) -> List[FakeMember]:
+        return list(self.members_by_id.values())
+    
+    @property
+    def categories(self) -> List[FakeCategory]:
+        return [ch for ch in self.channels.values() if isinstance(ch, FakeCategory)]
+    
+    def add_role(self, role_id: int, name: str) -> FakeRole:
+        role = self.roles[role_id] = FakeRole(self, role_id, name)
+        return role
+    
+    def add_member(self, name: str, roles: List[FakeRole], bot: bool = False, member_id: int = None) -> FakeMember:
+        member = FakeMember(self, member_id or next_id(), name, roles, bot=bot)
+        self.members_by_id[member.id] = member
+        return member
+    
+    def get_member(self, member_id: int) -> Optional[FakeMember]:
+        return self.members_by_id.get(member_id)
+    
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+    
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return self.roles.get(role_id)
+    
+    async def query_members(self, user_ids: List[int] = None, cache: bool = True, **kwargs) -> List[FakeMember]:
+        # Запрос через шлюз, а не REST - лимитов и счётчика REST нет
+        return [self.members_by_id[user_id] for user_id in user_ids or () if user_id in self.members_by_id]
+    
+    async def create_role(self, name: str, reason: str = None, **kwargs) -> FakeRole:
+        await self.rest.request('POST', '/guilds/{guild_id}/roles', self.id)
+        return self.add_role(next_id(), name)
+    
+    async def create_category_channel(self, name: str, overwrites: Dict = None, **kwargs) -> FakeCategory:
+        await self.rest.request('POST', '/guilds/{guild_id}/channels', self.id)
+        category = FakeCategory(self, next_id(), name)
+        category.fake_overwrites = dict(overwrites or {})
+        return category
+    
+    create_category = create_category_channel
+
+class FakeInteractionResponse:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self.interaction = interaction
+        self.done = False
+    
+    def is_done(self) -> bool:
+        return self.done
+    
+    async def callback(self):
+        if self.done:
+            raise RuntimeError("На взаимодействие уже ответили")
+        self.done = True
+        await self.interaction.guild.rest.request('POST', '/interactions/{interaction_id}/{token}/callback',
+                                                  limited=False, ack=True)
+    
+    async def send_message(self, content: str = None, *, embed: discord.Embed = None, view=None,
+                           ephemeral: bool = False, **kwargs):
+        await self.callback()
+        self.interaction.replies.append(content)
+        message = FakeMessage(self.interaction.channel, next_id(), self.interaction.guild.me,
+                              content=content, embed=embed, view=view)
+        if not ephemeral:
+            self.interaction.channel.messages[message.id] = message
+        self.interaction.original = message
+    
+    async def defer(self, thinking: bool = False, ephemeral: bool = False):
+        await self.callback()
+
+class FakeFollowup:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self.interaction = interaction
+    
+    async def send(self, content: str = None, *, embed: discord.Embed = None, ephemeral: bool = False, **kwargs) -> FakeMessage:
+        await self.interaction.guild.rest.request('POST', '/webhooks/{application_id}/{token}', limited=False)
+        self.interaction.replies.append(content)
+        return FakeMessage(self.interaction.channel, next_id(), self.interaction.guild.me, content=content, embed=embed)
+
+class FakeNamespace:
+    def __init__(self, options: Dict):
+        self.options = {name: getattr(value, 'value', value) for name, value in options.items()}
+    
+    def __iter__(self):
+        return iter(self.options.items())
+
+class FakeInteraction:
+    def __init__(self, guild: FakeGuild, channel: FakeTextChannel, user: FakeMember):
+        self.id = next_id()
+        self.type = discord.InteractionType.application_command
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.channel_id = channel.id
+        self.user = user
+        self.command = None
+        self.namespace = FakeNamespace({})
+        self.message = None
+        self.created_at = discord.utils.utcnow()
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+        self.original: Optional[FakeMessage] = None
+        self.replies: List[Optional[str]] = []
+    
+    async def original_response(self) -> FakeMessage:
+        await self.guild.rest.request('GET', '/webhooks/{application_id}/{token}/messages/@original', limited=False)
+        return self.original
+    
+    async def edit_original_response(self, **fields) -> FakeMessage:
+        await self.guild.rest.request('PATCH', '/webhooks/{application_id}/{token}/messages/@original', limited=False)
+        return self.original
+
+# replay.py --bot-dir прогоняет этот слой на ядре другой сборки, поэтому API ядра, которого
+# в старых сборках ещё нет, берётся через getattr с их поведением по умолчанию
+
+async def drain_background(timeout: float, keep: asyncio.Task):
+    """Ждёт фоновые задачи бота (пул, панели) и задачи планировщика (удаление уведомлений),
+    наступающие до конца ожидания. Таймер планировщика и долгоживущая keep не ждутся"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        scheduler_task = getattr(core, 'scheduler_task', None)
+        pending = [task for task in core.background_tasks if task is not keep and task is not scheduler_task]
+        delay = core.next_job_delay() if hasattr(core, 'next_job_delay') else None
+        if pending:
+            await asyncio.wait(pending, timeout=max(0.0, deadline - time.monotonic()))
+        elif delay is not None and delay < deadline - time.monotonic():
+            await asyncio.sleep(delay + 0.05)
+        else:
+            break
+
+async def click_vzp_button(interaction: FakeInteraction, vzp_id: str):
+    """Нажатие кнопки записи VZP: динамическая кнопка, в сборках до неё - VZPView"""
+    if hasattr(core, 'VZPPlusButton'):
+        await core.VZPPlusButton(vzp_id).callback(interaction)
+    else:
+        await core.VZPView(vzp_id).button_callback(interaction)
+
+async def invoke_command(interaction: FakeInteraction, command: app_commands.Command, **options):
+    """Вызов слеш-команды по пути дерева команд: interaction_check, затем обработчик"""
+    interaction.command = command
+    interaction.namespace = FakeNamespace(options)
+    if await core.bot.tree.interaction_check(interaction):
+        await command.callback(interaction, **options)
+
+def wire_bot(guild: FakeGuild):
+    """Переключает глобальный бот ядра на подменную гильдию вместо кэша шлюза"""
+    core.bot.get_channel = guild.get_channel
+    core.bot.get_guild = lambda guild_id: guild if guild_id == guild.id else None
+    if hasattr(core, "cache_member"):
+        for member in guild.members:
+            core.cache_member(member)
+
+# ===================== СЦЕНАРИЙ =====================
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class LoadScenario:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.rest = make_rest(args, self.rng)
+        self.guild = FakeGuild(self.rest)
+        self.actions: List[Action] = []
+        self.checks: List[tuple] = []
+        self.click_replies: Dict[int, List[str]] = {}
+        self.member_tiers: Dict[int, int] = {}
+        
+        guild = self.guild
+        self.tier_roles = {tier: guild.add_role(role_id, f"TIER {tier}") for tier, role_id in core.TIER_ROLES.items()}
+        high_role = guild.add_role(core.HIGH_ROLES[0], "HIGH")
+        
+        self.vzp_channel = FakeTextChannel(guild, core.ALLOWED_CHANNEL, "vzp")
+        FakeTextChannel(guild, core.STATS_CHANNEL, "vzp-stats")
+        self.board_channel = FakeTextChannel(guild, next_id(), "vzp-call")
+        self.lobby = FakeVoiceChannel(guild, next_id(), "lobby")
+        
+        self.admins = [guild.add_member(f"admin{i}", [high_role, self.tier_roles[1]]) for i in range(args.admins)]
+        self.clickers = [self.add_player(f"clicker{i}", args.no_role_share) for i in range(args.clickers)]
+        self.spammers = [self.add_player(f"spammer{i}") for i in range(args.spammers)]
+        self.roster = [self.add_player(f"roster{i}") for i in range(args.roster)]
+        for member in self.roster:
+            if self.rng.random() < args.voice_share:
+                member.voice = FakeVoiceState(self.lobby)
+    
+    def add_player(self, name: str, no_role_share: float = 0.0) -> FakeMember:
+        if self.rng.random() < no_role_share:
+            return self.guild.add_member(name, [])
+        tier = self.rng.choice(list(self.tier_roles))
+        member = self.guild.add_member(name, [self.tier_roles[tier]])
+        self.member_tiers[member.id] = tier
+        return member
+    
+    def interaction(self, channel: FakeTextChannel, user: FakeMember) -> FakeInteraction:
+        return FakeInteraction(self.guild, channel, user)
+    
+    def act(self, kind: str, factory: Callable):
+        return run_action(self.actions, kind, factory)
+    
+    def check(self, name: str, ok: bool, detail: str = ""):
+        self.checks.append((name, bool(ok), detail))
+    
+    # ----- шаги сценария -----
+    async def create_vzp(self, admin: FakeMember) -> str:
+        before = set(core.active_vzp)
+        choice = app_commands.Choice
+        interaction = self.interaction(self.vzp_channel, admin)
+        await self.act("command:vzp_start", lambda: invoke_command(
+            interaction, core.vzp_start, time="20:00", members=core.MAX_PARTICIPANTS_PER_VZP,
+            attack_def=choice(name=" АТАКА", value="ATT"),
+            condition1=choice(name="Броня", value="armor"),
+            caliber1=choice(name="5.56 mm", value="5.56"),
+            caliber2=choice(name="7.62 mm", value="7.62"),
+            caliber3=choice(name="9 mm", value="9")
+        ))
+        (vzp_id,) = set(core.active_vzp) - before
+        return vzp_id
+    
+    async def click(self, member: FakeMember, vzp_id: str):
+        interaction = self.interaction(self.vzp_channel, member)
+        await self.act("button:vzp_plus", lambda: click_vzp_button(interaction, vzp_id))
+        self.click_replies.setdefault(member.id, []).extend(interaction.replies)
+    
+    async def spam(self, member: FakeMember):
+        if self.rng.random() < self.args.cancel_share:
+            content = "отмена"
+        else:
+            content = str(self.rng.randint(1, self.args.positions + 2))
+        message = self.board_channel.post(member, content=content)
+        await self.act("message:position", lambda: core.on_message(message))
+    
+    async def admin_command(self, admin: FakeMember):
+        choice = app_commands.Choice
+        interaction = self.interaction(self.vzp_channel, admin)
+        name, factory = self.rng.choice([
+            ("list_vzp", lambda: invoke_command(interaction, core.list_vzp)),
+            ("stats", lambda: invoke_command(interaction, core.stats)),
+            ("leaderboard", lambda: invoke_command(interaction, core.leaderboard, metric=choice(name="Победы", value="wins"))),
+            ("bot_stats", lambda: invoke_command(interaction, core.bot_stats)),
+        ])
+        await self.act(f"command:{name}", factory)
+    
+    async def start_vzp(self, admin: FakeMember, vzp_id: str):
+        interaction = self.interaction(self.vzp_channel, admin)
+        await self.act("command:start_vzp", lambda: invoke_command(interaction, core.start_vzp, vzp_id=vzp_id))
+    
+    async def at(self, delay: float, coro):
+        await asyncio.sleep(delay)
+        await coro
+    
+    async def run(self) -> float:
+        args = self.args
+        self.watchdog_task = core.run_in_background(core.loop_watchdog.run())
+        
+        # Подготовка: VZP для кнопок, VZP с готовым составом для запуска и распределение позиций
+        admin = self.admins[0]
+        self.click_vzp = await self.create_vzp(admin)
+        self.start_vzp_id = await self.create_vzp(admin)
+        roster = core.active_vzp[self.start_vzp_id].plus_users
+        for member in self.roster:
+            roster[member.id] = self.member_tiers[member.id]
+        core.save_data()
+        
+        interaction = self.interaction(self.board_channel, admin)
+        await self.act("command:call_vzp", lambda: invoke_command(
+            interaction, core.call_vzp, positions=args.positions, vzp_id=self.click_vzp))
+        self.board_id = core.active_position_calls[self.board_channel.id]["pos_id"]
+        core.open_trace()
+        
+        # Нагрузка
+        started = time.perf_counter()
+        jobs = []
+        for member in self.clickers:
+            for _ in range(args.clicks):
+                jobs.append(self.at(self.rng.uniform(0, args.duration), self.click(member, self.click_vzp)))
+        for member in self.spammers:
+            for _ in range(args.messages):
+                jobs.append(self.at(self.rng.uniform(0, args.duration), self.spam(member)))
+        commands_count = int(args.duration / args.admin_interval) if args.admin_interval > 0 else 0
+        for i in range(commands_count):
+            jobs.append(self.at(self.rng.uniform(0, args.duration), self.admin_command(self.rng.choice(self.admins))))
+        jobs.append(self.at(args.duration / 2, self.start_vzp(self.admins[-1], self.start_vzp_id)))
+        
+        await asyncio.gather(*jobs)
+        await drain_background(args.drain_timeout, self.watchdog_task)
+        elapsed = time.perf_counter() - started
+        self.watchdog_task.cancel()
+        return elapsed
+    
+    # ----- проверки итогового состояния -----
+    def verify(self):
+        self.verify_clicks()
+        self.verify_board()
+        self.verify_started_vzp()
+        self.verify_persistence()
+        errors = [action for action in self.actions if action.error]
+        self.check("действия без исключений", not errors, "; ".join(sorted({a.error for a in errors}))[:300])
+    
+    def verify_clicks(self):
+        vzp_data = core.active_vzp[self.click_vzp]
+        expected = {}
+        for user_id, replies in self.click_replies.items():
+            for reply in replies:
+                if "успешно записались" in (reply or ""):
+                    expected[user_id] = self.member_tiers[user_id]
+                elif "удалились" in (reply or ""):
+                    expected.pop(user_id, None)
+        self.check("состав VZP совпадает с ответами игрокам", vzp_data.plus_users == expected,
+                   f"в боте {len(vzp_data.plus_users)}, по ответам {len(expected)}")
+        self.check("лимит участников соблюдён", len(vzp_data.plus_users) <= core.MAX_PARTICIPANTS_PER_VZP,
+                   f"{len(vzp_data.plus_users)}/{core.MAX_PARTICIPANTS_PER_VZP}")
+        
+        message = self.vzp_channel.messages.get(vzp_data.message_id)
+        counts = {tier: 0 for tier in (1, 2, 3)}
+        for tier in vzp_data.plus_users.values():
+            counts[tier] += 1
+        shown = [field.name for field in message.embed.fields[:3]] if message and message.embed else []
+        wanted = [f"**TIER {tier}** ({counts[tier]})" for tier in (1, 2, 3)]
+        self.check("сообщение VZP показывает итоговый состав", shown == wanted, f"{shown} != {wanted}")
+        if message and message.embed:
+            longest = max((len(field.value) for field in message.embed.fields), default=0)
+            self.check("сообщение VZP укладывается в лимиты Discord",
+                       len(message.embed) <= 6000 and longest <= core.EMBED_FIELD_LIMIT,
+                       f"{len(message.embed)} символов, самое длинное поле {longest}")
+    
+    def verify_board(self):
+        positions = core.position_assignments[self.board_id]
+        holders = [member.id for member in positions.values() if member]
+        spammer_ids = {member.id for member in self.spammers}
+        self.check("игрок занимает не больше одной позиции", len(holders) == len(set(holders)))
+        self.check("позиции заняты только спамерами", set(holders) <= spammer_ids)
+        
+        board = self.board_channel.messages.get(core.position_messages[self.board_id]["message_id"])
+        lines = [f"{pos} - {positions[pos].mention if positions[pos] else '...'}" for pos in sorted(positions)]
+        description = board.embed.description if board and board.embed else None
+        self.check("сообщение распределения совпадает с позициями", description == "\n".join(lines))
+        
+        leftovers = [m for m in self.board_channel.messages.values() if m is not board]
+        self.check("сообщения игроков и уведомления удалены", not leftovers, f"осталось {len(leftovers)}")
+        self.check("нет висящих записей уведомлений", not core.user_notification_messages,
+                   f"{sum(len(v) for v in core.user_notification_messages.values())} записей")
+    
+    def verify_started_vzp(self):
+        vzp_data = core.active_vzp[self.start_vzp_id]
+        self.check("VZP запущена", vzp_data.status == 'VZP IN PROCESS', vzp_data.status)
+        category = self.guild.get_channel(vzp_data.category_id) if vzp_data.category_id else None
+        channels = core.find_vzp_channels(category) if isinstance(category, FakeCategory) else None
+        self.check("категория VZP с тремя каналами", channels is not None)
+        if category:
+            if vzp_data.role_id:
+                role = self.guild.get_role(vzp_data.role_id)
+                missing = [m for m in self.roster if role not in m.roles]
+            else:
+                missing = [m for m in self.roster if m not in category.overwrites]
+            self.check("у всего состава есть доступ к категории", not missing, f"без доступа {len(missing)}")
+        
+        notified = sum(1 for member in self.roster if member.dms)
+        self.check("ЛС получил весь состав", notified == len(self.roster), f"{notified}/{len(self.roster)}")
+        
+        if channels:
+            voice_channel = channels[0]
+            expected = sum(1 for member in self.roster if member.voice)
+            self.check("игроки из голосовых перемещены", len(voice_channel.members) == expected,
+                       f"{len(voice_channel.members)}/{expected}")
+        self.check("панель голосовой активности опубликована", bool(vzp_data.voice_board_message_id))
+    
+    def verify_persistence(self):
+        with open(core.guild_file(self.guild.id, core.DATA_FILE), encoding='utf-8') as f:
+            saved = json.load(f)['active']
+        ok = all(
+            {int(user_id) for user_id in saved.get(vzp_id, {}).get('plus_users', {})} == set(vzp_data.plus_users)
+            for vzp_id, vzp_data in core.active_vzp.items()
+        )
+        self.check("файл данных совпадает с памятью", ok)
+    
+    # ----- отчёт -----
+    def report(self, elapsed: float) -> dict:
+        return {
+            "config": vars(self.args),
+            "elapsed": elapsed,
+            **run_summary(self.actions, self.rest),
+            "checks": [{"name": name, "ok": ok, "detail": detail} for name, ok, detail in self.checks]
+        }
+
+def summarize_actions(actions: List[Action]) -> Dict[str, dict]:
+    kinds: Dict[str, List[Action]] = {}
+    for action in actions:
+        kinds.setdefault(action.kind, []).append(action)
+    
+    summary = {}
+    for kind, items in sorted(kinds.items()):
+        acks = [a.ack_latency for a in items if a.ack_latency is not None]
+        totals = [a.total_latency for a in items]
+        summary[kind] = {
+            "count": len(items),
+            "ack_p50": percentile(acks, 0.5),
+            "ack_p99": percentile(acks, 0.99),
+            "total_p50": percentile(totals, 0.5),
+            "total_p99": percentile(totals, 0.99),
+            "rest_per_action": sum(a.rest_calls for a in items) / len(items),
+            "late": sum(1 for latency in acks if latency > INTERACTION_DEADLINE) if kind.split(':')[0] != 'message' else None,
+            "errors": sum(1 for a in items if a.error)
+        }
+    return summary
+
+def run_summary(actions: List[Action], rest: FakeREST) -> dict:
+    """Общая часть отчёта loadsim.py и replay.py"""
+    return {
+        "actions": summarize_actions(actions),
+        "rest": {
+            "total": rest.total,
+            "rate_limited": rest.rate_limited,
+            "throttled": rest.throttled,
+            "throttle_seconds": rest.throttle_seconds,
+            "routes": dict(sorted(rest.calls.items(), key=lambda item: item[1], reverse=True))
+        },
+        "loop_lag": core.loop_watchdog.percentiles(),
+        "loop_stalls": core.loop_watchdog.stalls
+    }
+
+def format_ms(value: Optional[float]) -> str:
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+def print_report(report: dict):
+    config = report["config"]
+    print(f"\n=== Прогон: {config['clickers']} кнопок x{config['clicks']}, {config['spammers']} спамеров x{config['messages']}, "
+          f"REST {config['rest_latency']:.0f}±{config['rest_jitter']:.0f} мс, {report['elapsed']:.1f} с ===")
+    print_summary(report)
+    
+    print("\nПроверки:")
+    for check in report["checks"]:
+        detail = f" ({check['detail']})" if check['detail'] and not check['ok'] else ""
+        print(f"  {'✅' if check['ok'] else '❌'} {check['name']}{detail}")
+
+def print_summary(report: dict):
+    print(f"{'действие':<22}{'кол-во':>7}{'ответ p50':>11}{'ответ p99':>11}{'всё p50':>9}{'всё p99':>9}{'REST/шт':>9}{'>3с':>5}{'ошибок':>8}")
+    for kind, row in report["actions"].items():
+        print(f"{kind:<22}{row['count']:>7}{format_ms(row['ack_p50']):>11}{format_ms(row['ack_p99']):>11}"
+              f"{format_ms(row['total_p50']):>9}{format_ms(row['total_p99']):>9}{row['rest_per_action']:>9.1f}"
+              f"{'-' if row['late'] is None else row['late']:>5}{row['errors']:>8}")
+    
+    rest = report["rest"]
+    print(f"\nREST: {rest['total']} запросов, 429: {rest['rate_limited']}, "
+          f"ожиданий лимита: {rest['throttled']} ({rest['throttle_seconds']:.1f} с)")
+    for route, count in list(rest["routes"].items())[:8]:
+        print(f"  {count:>6}  {route}")
+    
+    lag = report["loop_lag"]
+    if lag:
+        print(f"\nЦикл событий: p50 {format_ms(lag['0.5'])} мс, p99 {format_ms(lag['0.99'])} мс, "
+              f"max {format_ms(lag['1'])} мс, зависаний {report['loop_stalls']}")
+
+def add_rest_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--rest-latency", type=float, default=80.0, help="Средняя задержка REST, мс")
+    parser.add_argument("--rest-jitter", type=float, default=40.0, help="Разброс задержки REST, мс")
+    parser.add_argument("--bucket-limit", type=int, default=5, help="Запросов на маршрут+канал за окно, 0 - без лимита")
+    parser.add_argument("--bucket-window", type=float, default=1.0, help="Окно лимита, с (у Discord на отправку в канал - 5)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Вероятность случайного 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry_after для случайного 429, с")
+    parser.add_argument("--role-mode", action="store_true", help="Запускать VZP в режиме временной роли")
+    parser.add_argument("--pool-size", type=int, default=core.CATEGORY_POOL_SIZE, help="Размер пула категорий")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="Сколько ждать фоновые задачи после нагрузки, с")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно генератора случайных чисел")
+    parser.add_argument("--log-level", default="ERROR", help="Уровень логов бота")
+    parser.add_argument("--json", help="Записать отчёт в JSON-файл")
+
+def make_rest(args: argparse.Namespace, rng: random.Random) -> FakeREST:
+    return FakeREST(args.rest_latency / 1000, args.rest_jitter / 1000, args.bucket_limit,
+                    args.bucket_window, args.error_rate, args.retry_after, rng)
+
+def configure_core(args: argparse.Namespace):
+    core.setup_logging()
+    logging.getLogger().setLevel(args.log_level)
+    core.VZP_ROLE_MODE = args.role_mode
+    core.CATEGORY_POOL_SIZE = args.pool_size
+    if getattr(args, "max_participants", None):
+        core.MAX_PARTICIPANTS_PER_VZP = min(args.max_participants, core.MAX_PARTICIPANTS_LIMIT)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Офлайн-нагрузочный прогон VZP бота на подменном Discord")
+    parser.add_argument("--clickers", type=int, default=120, help="Игроков, жмущих кнопку VZP")
+    parser.add_argument("--clicks", type=int, default=1, help="Нажатий на игрока (чётное число - запись и отмена)")
+    parser.add_argument("--no-role-share", type=float, default=0.05, help="Доля нажимающих без тир-роли")
+    parser.add_argument("--spammers", type=int, default=30, help="Игроков, спамящих номерами позиций")
+    parser.add_argument("--messages", type=int, default=3, help="Сообщений на спамера")
+    parser.add_argument("--cancel-share", type=float, default=0.15, help="Доля сообщений 'отмена'")
+    parser.add_argument("--positions", type=int, default=20, help="Позиций в распределении")
+    parser.add_argument("--admins", type=int, default=3, help="Админов, выполняющих команды")
+    parser.add_argument("--admin-interval", type=float, default=0.5, help="Средний интервал между админскими командами, с")
+    parser.add_argument("--roster", type=int, default=40, help="Размер состава VZP, которую запускают во время нагрузки")
+    parser.add_argument("--voice-share", type=float, default=0.5, help="Доля состава, сидящая в голосовом")
+    parser.add_argument("--duration", type=float, default=5.0, help="За сколько секунд распределяются действия")
+    parser.add_argument("--max-participants", type=int, default=None,
+                        help="Лимит участников сервера (по умолчанию как у бота, большой состав - до MAX_PARTICIPANTS_LIMIT)")
+    add_rest_arguments(parser)
+    return parser
+
+def main(argv: List[str]) -> int:
+    args = build_parser().parse_args(argv)
+    configure_core(args)
+    
+    output = os.path.abspath(args.json) if args.json else None
+    if core.TRACE_FILE:
+        core.TRACE_FILE = os.path.abspath(core.TRACE_FILE)
+    workdir = tempfile.mkdtemp(prefix="vzp_loadsim_")
+    os.chdir(workdir)  # Файлы данных бота пишутся во временный каталог
+    
+    try:
+        scenario = LoadScenario(args)
+        wire_bot(scenario.guild)
+        elapsed = asyncio.run(scenario.run())
+        scenario.verify()
+    finally:
+        os.chdir(os.path.dirname(output) if output else tempfile.gettempdir())
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    report = scenario.report(elapsed)
+    print_report(report)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if all(check["ok"] for check in report["checks"]) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,335 @@
+"""Воспроизведение записанного трафика VZP бота на подменном Discord.
+
+Бот пишет трафик, если задана переменная VZP_TRACE_FILE: снимок состояния при старте,
+затем нажатия кнопок, команды и сообщения в распределения позиций - время, ID, тиры,
+номера позиций и значения из списков выбора, без текста сообщений.
+
+replay.py прогоняет такую запись через ядро бота (stealzbot2) на подменном слое из
+loadsim.py в реальном темпе или ускоренно и печатает задержки и число REST-запросов.
+Сравнение сборок: отчёт одной сборки передаётся как --baseline при прогоне другой,
+если REST-запросов стало больше, чем на --threshold, код выхода 1.
+Задержки в сравнении только для справки: на одной записи они слишком шумные для порога.
+    
+    python replay.py friday.jsonl --speed 10 --json new.json
+    python replay.py friday.jsonl --speed 10 --bot-dir ../vzp-old --json old.json
+    python replay.py friday.jsonl --speed 10 --baseline old.json
+
+Встроенные паузы бота (автопинг, удаление уведомлений) не ускоряются.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+def import_core(argv: List[str]):
+    """stealzbot2 берётся из --bot-dir (другая сборка), подменный слой - всегда из этой"""
+    pre = argparse.ArgumentParser(add_help=False)
+    pre.add_argument("--bot-dir")
+    known, _ = pre.parse_known_args(argv)
+    if known.bot_dir:
+        sys.path.insert(0, os.path.abspath(known.bot_dir))
+    import stealzbot2
+    if known.bot_dir:
+        sys.path.pop(0)
+    return stealzbot2
+
+core = import_core(sys.argv[1:])
+
+import discord
+from discord import app_commands
+
+import loadsim
+from loadsim import FakeGuild, FakeInteraction, FakeMessage, FakeTextChannel, format_ms
+
+class Replay:
+    def __init__(self, snapshot: dict, events: List[dict], args: argparse.Namespace):
+        self.snapshot = snapshot
+        self.events = events
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.rest = loadsim.make_rest(args, self.rng)
+        # Весь трафик воспроизводится на одном сервере. Если в записи он один, сохраняем его ID
+        guild_ids = {entry.get("guild_id") for entry in list(snapshot.get("vzp", {}).values()) + list(snapshot.get("boards", {}).values())}
+        self.guild = FakeGuild(self.rest, guild_ids.pop() if len(guild_ids) == 1 else None)
+        self.actions: List[loadsim.Action] = []
+        self.skipped: Dict[str, int] = {}
+        
+        self.tier_roles = {tier: self.guild.add_role(role_id, f"TIER {tier}") for tier, role_id in core.TIER_ROLES.items()}
+        self.high_role = self.guild.add_role(core.HIGH_ROLES[0], "HIGH")
+        
+        # ID VZP в записи -> ID VZP, созданной при воспроизведении той же командой
+        self.created_by = {event["vzp_id"]: event["interaction"] for event in events if event["type"] == "vzp_created"}
+        self.interactions: Dict[int, FakeInteraction] = {}
+        self.vzp_ids: Dict[str, str] = {}
+    
+    # ----- объекты гильдии по ID из записи -----
+    def member(self, user_id: int, tier: Optional[int] = None, admin: bool = False):
+        member = self.guild.get_member(user_id)
+        if member is None:
+            roles = [self.tier_roles[tier]] if tier in self.tier_roles else []
+            if admin:
+                roles.append(self.high_role)
+            member = self.guild.add_member(f"user{user_id}", roles, member_id=user_id)
+        return member
+    
+    def channel(self, channel_id: int) -> FakeTextChannel:
+        channel = self.guild.get_channel(channel_id)
+        if channel is None:
+            channel = FakeTextChannel(self.guild, channel_id, f"channel{channel_id}")
+        return channel
+    
+    def resolve_vzp(self, vzp_id: str) -> str:
+        if vzp_id in self.vzp_ids:
+            return self.vzp_ids[vzp_id]
+        interaction = self.interactions.get(self.created_by.get(vzp_id))
+        if interaction and interaction.original:
+            for new_id, vzp_data in core.active_vzp.items():
+                if vzp_data.message_id == interaction.original.id:
+                    self.vzp_ids[vzp_id] = new_id
+                    return new_id
+        return vzp_id
+    
+    def seed(self):
+        """Восстанавливает состояние бота на момент начала записи"""
+        for vzp_id, entry in self.snapshot.get("vzp", {}).items():
+            channel = self.channel(entry["channel_id"])
+            channel.messages[entry["message_id"]] = FakeMessage(channel, entry["message_id"], self.guild.me)
+            plus_users = {int(user_id): tier for user_id, tier in entry["plus_users"].items()}
+            for user_id, tier in plus_users.items():
+                self.member(user_id, tier)
+            core.active_vzp[vzp_id] = core.VZPData({
+                'time': "20:00",
+                'members': entry["members"],
+                'attack_def_name': entry["attack_def_name"],
+                'conditions_display': entry["conditions_display"],
+                'caliber_names': entry["caliber_names"],
+                'message_id': entry["message_id"],
+                'channel_id': entry["channel_id"],
+                'plus_users': plus_users,
+                'status': entry["status"],
+                'created_at': core.datetime.now().isoformat(),
+                'guild_id': self.guild.id
+            })
+            core.swap_history[vzp_id] = {int(old): new for old, new in entry["swaps"].items()}
+        
+        for channel_id, board in self.snapshot.get("boards", {}).items():
+            channel = self.channel(int(channel_id))
+            channel.messages[board["message_id"]] = FakeMessage(channel, board["message_id"], self.guild.me)
+            taken = {int(pos): self.member(user_id) for pos, user_id in board["taken"].items()}
+            core.position_assignments[board["pos_id"]] = {pos: taken.get(pos) for pos in range(1, board["positions"] + 1)}
+            core.position_messages[board["pos_id"]] = {"message_id": board["message_id"], "channel_id": channel.id,
+                                                       "guild_id": self.guild.id}
+            core.active_position_calls[channel.id] = {"pos_id": board["pos_id"], "vzp_id": board["vzp_id"],
+                                                      "created_by": None, "created_at": None, "guild_id": self.guild.id}
+    
+    # ----- события -----
+    def skip(self, reason: str):
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+    
+    def convert(self, parameter, value):
+        if parameter.name == 'vzp_id':
+            return self.resolve_vzp(value)
+        if parameter.choices:
+            choice = next((c for c in parameter.choices if c.value == value), None)
+            return choice or app_commands.Choice(name=str(value), value=value)
+        if isinstance(value, dict):
+            return self.member(value["id"])
+        return value
+    
+    def placeholder(self, parameter):
+        # Свободный текст в запись не попадает - подставляем нейтральные значения
+        if parameter.type == discord.AppCommandOptionType.string:
+            return "20:00" if parameter.name == 'time' else "replay"
+        return None
+    
+    async def dispatch(self, event: dict):
+        kind = event["type"]
+        if kind == "vzp_created":
+            return
+        user = self.member(event["user"], event.get("tier"), event.get("admin", False))
+        channel = self.channel(event["channel"])
+        
+        if kind == "message":
+            content = {"cancel": "отмена", "claim": str(event.get("position"))}.get(event["action"], "?")
+            message = channel.post(user, content=content)
+            await loadsim.run_action(self.actions, "message:position", lambda: core.on_message(message))
+            return
+        
+        interaction = FakeInteraction(self.guild, channel, user)
+        self.interactions[event["interaction"]] = interaction
+        
+        if kind == "button":
+            vzp_id = self.resolve_vzp(event["options"]["vzp_id"])
+            await loadsim.run_action(self.actions, f"button:{event['name']}",
+                                     lambda: loadsim.click_vzp_button(interaction, vzp_id))
+            return
+        
+        command = core.bot.tree.get_command(event["name"])
+        if command is None:
+            self.skip(f"нет команды {event['name']}")
+            return
+        kwargs = {}
+        for parameter in command.parameters:
+            value = event["options"].get(parameter.name)
+            if value is None:
+                if not parameter.required:
+                    continue
+                value = self.placeholder(parameter)
+                if value is None:
+                    self.skip(f"{event['name']}: нет параметра {parameter.name}")
+                    return
+            kwargs[parameter.name] = self.convert(parameter, value)
+        await loadsim.run_action(self.actions, f"command:{event['name']}",
+                                 lambda: loadsim.invoke_command(interaction, command, **kwargs))
+    
+    async def run(self) -> float:
+        watchdog_task = core.run_in_background(core.loop_watchdog.run())
+        self.seed()
+        
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        tasks = []
+        for event in self.events:
+            if self.args.speed > 0:
+                delay = event["t"] / self.args.speed - (loop.time() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.dispatch(event)))
+            await asyncio.sleep(0)
+        
+        await asyncio.gather(*tasks)
+        await loadsim.drain_background(self.args.drain_timeout, watchdog_task)
+        watchdog_task.cancel()
+        return loop.time() - started
+    
+    def report(self, elapsed: float) -> dict:
+        return {
+            "config": vars(self.args),
+            "bot": os.path.abspath(core.__file__),
+            "events": len(self.events),
+            "elapsed": elapsed,
+            "skipped": self.skipped,
+            **loadsim.run_summary(self.actions, self.rest)
+        }
+
+def max_snowflake(value) -> int:
+    if isinstance(value, dict):
+        return max([max_snowflake(v) for v in value.values()] + [max_snowflake(k) for k in value.keys()], default=0)
+    if isinstance(value, list):
+        return max((max_snowflake(v) for v in value), default=0)
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return value if isinstance(value, int) and not isinstance(value, bool) else 0
+
+def reserve_ids(snapshot: dict, events: List[dict]):
+    """Новые ID подменного слоя начинаются выше всех ID из записи, чтобы не совпасть с ними"""
+    loadsim.snowflakes = itertools.count(max_snowflake([snapshot, events]) + 1)
+
+def load_trace(path: str):
+    """Возвращает (снимок, события). Если в файле несколько запусков бота - берётся последний"""
+    snapshot, events = {}, []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event["type"] == "snapshot":
+                snapshot, events = event, []
+            else:
+                events.append(event)
+    return snapshot, events
+
+# ===================== СРАВНЕНИЕ СБОРОК =====================
+def compare(baseline: dict, report: dict, threshold: float) -> List[str]:
+    """Печатает таблицу старое -> новое и возвращает список регрессий.
+    Регрессией считается только рост числа REST-запросов: на одной записи оно почти не меняется
+    от прогона к прогону, а p99 по паре десятков ответов одной сборки гуляет в разы - его только показываем"""
+    def delta(old, new) -> str:
+        if old is None or new is None:
+            return "-"
+        if not old:
+            return "+∞" if new else "0%"
+        return f"{(new - old) * 100 / old:+.0f}%"
+    
+    regressions = []
+    print(f"\n=== Сравнение с {baseline.get('bot', 'baseline')} ===")
+    print(f"{'действие':<22}{'ответ p99':>22}{'':>7}{'REST/шт':>16}{'':>7}")
+    for kind, new in report["actions"].items():
+        old = baseline["actions"].get(kind)
+        if old is None:
+            print(f"{kind:<22}{'новое действие':>22}")
+            continue
+        print(f"{kind:<22}{format_ms(old['ack_p99']):>10} -> {format_ms(new['ack_p99']):<8}{delta(old['ack_p99'], new['ack_p99']):>7}"
+              f"{old['rest_per_action']:>7.1f} -> {new['rest_per_action']:<6.1f}{delta(old['rest_per_action'], new['rest_per_action']):>7}")
+        if new['rest_per_action'] > old['rest_per_action'] * (1 + threshold):
+            regressions.append(f"{kind}: REST/шт {old['rest_per_action']:.1f} -> {new['rest_per_action']:.1f}")
+    
+    old_total, new_total = baseline["rest"]["total"], report["rest"]["total"]
+    print(f"{'REST всего':<22}{old_total:>10} -> {new_total:<8}{delta(old_total, new_total):>7}")
+    if new_total > old_total * (1 + threshold):
+        regressions.append(f"REST всего {old_total} -> {new_total}")
+    return regressions
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика VZP бота на подменном Discord")
+    parser.add_argument("trace", help="Файл записи (VZP_TRACE_FILE)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Ускорение: 1 - реальный темп, 10 - в 10 раз быстрее, 0 - без пауз")
+    parser.add_argument("--bot-dir", help="Каталог с stealzbot2.py другой сборки")
+    parser.add_argument("--baseline", help="JSON-отчёт другой сборки для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимый рост числа REST-запросов, доля")
+    loadsim.add_rest_arguments(parser)
+    return parser
+
+def main(argv: List[str]) -> int:
+    args = build_parser().parse_args(argv)
+    loadsim.configure_core(args)
+    snapshot, events = load_trace(args.trace)
+    if not events:
+        print("❌ В записи нет событий")
+        return 1
+    
+    output = os.path.abspath(args.json) if args.json else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    
+    workdir = tempfile.mkdtemp(prefix="vzp_replay_")
+    os.chdir(workdir)
+    try:
+        reserve_ids(snapshot, events)
+        replay = Replay(snapshot, events, args)
+        loadsim.wire_bot(replay.guild)
+        elapsed = asyncio.run(replay.run())
+    finally:
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    report = replay.report(elapsed)
+    print(f"\n=== Воспроизведение: {len(events)} событий, x{args.speed:g}, {elapsed:.1f} с, сборка {report['bot']} ===")
+    loadsim.print_summary(report)
+    for reason, count in report["skipped"].items():
+        print(f"  пропущено {count}: {reason}")
+    
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    if baseline:
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print("\n❌ Регрессии:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n✅ Регрессий нет")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -3,21 +3,41 @@ from discord.ext import commands
 from discord import app_commands, ui, ButtonStyle
 import asyncio
 import uuid
+import time as time_module
 import os
 import json
+import csv
+import gzip
+import shutil
+import sys
+import argparse
+import tempfile
+import logging
+import contextvars
+import cProfile
+import pstats
+import signal
+import math
+import hashlib
+import heapq
+import bisect
+import re
+import threading
+import traceback
+from contextlib import contextmanager
+from collections import deque
+from aiohttp import web
 from dotenv import load_dotenv
-from typing import Optional, Dict, List, Set
-from datetime import datetime
+from typing import Callable, Optional, Dict, List, Set, Tuple
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
 # ===================== ЗАГРУЗКА ТОКЕНА ИЗ .env =====================
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
-if not TOKEN:
-    print("❌ ОШИБКА: DISCORD_TOKEN не найден в .env файле!")
-    exit(1)
-
 # ===================== НАСТРОЙКИ =====================
+# Значения по умолчанию для серверов без своего config.json (исходный сервер семьи)
 HIGH_ROLES = [1174860973522288780, 1089620679021842605, 1174878142259793962, 1245089436723581042]  # Роли админов
 TIER_ROLES = {
     1: 1458095828722909224,  # Тир 1
@@ -26,27 +46,461 @@ TIER_ROLES = {
 }
 ALLOWED_CHANNEL = 1451552947300204594  # Канал для команд
 STATS_CHANNEL = 1174883465066451016  # Канал для статистики
-MAX_PARTICIPANTS_PER_VZP = 100
+MAX_PARTICIPANTS_PER_VZP = 100  # Лимит участников по умолчанию
+MAX_PARTICIPANTS_LIMIT = 1000  # Верхняя граница лимита в /vzp_config
+ROSTER_PREVIEW = 10  # Сколько первых игроков каждого тира видно прямо в сообщении VZP
+ROSTER_PAGE_SIZE = 40  # Строк на странице просмотра полного состава
 MAX_ACTIVE_VZP = 10
 MIN_PARTICIPANTS_PER_VZP = 1
+GUILDS_DIR = "guilds"  # Данные и настройки каждого сервера лежат в guilds/<guild_id>/
+CATEGORY_POOL_SIZE = int(os.getenv('VZP_POOL_SIZE', '2'))  # Сколько заготовленных категорий держать наготове
+CATEGORY_POOL_TTL_HOURS = 24  # Запасная категория старше этого срока пересоздаётся
+POOL_CATEGORY_NAME = "VZP ID - резерв"
+TEARDOWN_RETRIES = 3  # Попыток удалить канал при закрытии VZP
+VZP_ROLE_MODE = os.getenv('VZP_ROLE_MODE', '0') == '1'  # Доступ к категории через временную роль вместо прав на каждого игрока
+ROLE_BATCH_DELAY = 1.0  # Секунды, за которые изменения состава копятся в одну пачку выдачи/снятия роли
+VOICE_BOARD_DEBOUNCE = 3.0  # Секунды, за которые голосовые события собираются в одно редактирование панели
+VOICE_SAVE_DELAY = 5.0  # Секунды, за которые голосовые события копятся в одну запись журнала на диск
+METRICS_HOST = os.getenv('VZP_METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('VZP_METRICS_PORT', '0'))  # Порт эндпоинта метрик Prometheus, 0 - выключен
+LOOP_LAG_INTERVAL = 0.25  # Как часто замерять задержку цикла событий, секунды
+LOOP_LAG_WINDOW = 2400  # Сколько последних замеров держать для перцентилей (~10 минут)
+LOOP_BLOCK_THRESHOLD = float(os.getenv('VZP_LOOP_BLOCK_MS', '250')) / 1000  # Зависание цикла дольше порога логируется со стеком
+LOG_LEVEL = os.getenv('VZP_LOG_LEVEL', 'INFO')
+SLOW_SPAN_MS = float(os.getenv('VZP_SLOW_SPAN_MS', '500'))  # Шаги дольше этого порога пишутся в лог как WARNING
+PROFILE_DIR = "profiles"
+PROFILE_SAMPLE_INTERVAL = 0.005  # Период выборки стека в режиме sampling, секунды
+PROFILE_TOP = 15
+TRACE_FILE = os.getenv('VZP_TRACE_FILE', '')  # Запись входящего трафика для replay.py, пусто - выключена
+SHARD_MODE = os.getenv('VZP_SHARD_MODE', 'single')  # single, auto - все шарды в одном процессе, process - один шард на процесс (launcher.py)
+SHARD_ID = int(os.getenv('VZP_SHARD_ID', '0'))
+SHARD_COUNT = int(os.getenv('VZP_SHARD_COUNT', '0'))  # 0 в режиме auto - сколько рекомендует Discord
+SHARD_HEALTH_DIR = "shards"
+SHARD_HEALTH_INTERVAL = 10  # Как часто процесс пишет отчёт о своих шардах, секунды
+COMMAND_SYNC_FILE = "command_sync.json"  # Хэш последнего синхронизированного дерева команд
+SYNC_FORCE = os.getenv('VZP_SYNC_FORCE', '0') == '1'  # Синхронизировать команды даже без изменений (или --force-sync)
+SWEEP_INTERVAL = 15 * 60  # Как часто очищать устаревшее состояние, секунды
+SWEEP_MESSAGE_CHECK_INTERVAL = 24 * 3600  # Как часто очистка сама запрашивает сообщения VZP (удаления ловятся по событиям)
+CLOSED_BOARD_TTL_HOURS = 6  # Сколько хранится распределение позиций после /close_positions
+NOTIFICATION_TTL = 60  # Уведомление о позиции живёт 5 секунд, запись старше этого срока - след упавшей задачи
+VZP_TIMEZONE = os.getenv('VZP_TIMEZONE', '')  # Часовой пояс времени VZP ("Europe/Moscow"), пусто - время сервера бота
+REMINDER_MINUTES = 15  # За сколько минут до VZP составу приходит напоминание в ЛС
+AUTO_STOP_LEAD_MINUTES = 5  # За сколько минут до VZP закрывается приём заявок при auto_stop
+AUTO_START_GRACE_MINUTES = 30  # Автозапуск, пропущенный дольше этого (бот был выключен), не выполняется
+POSITION_NOTICE_SECONDS = 5  # Сколько живёт уведомление о занятой позиции
+AUTOPING_COUNT = 5
+CLEANUP_RETRY_MINUTES = 10  # Через сколько повторить неудавшееся удаление категории
+CLEANUP_MAX_ATTEMPTS = 6  # Дальше категория ждёт следующего запуска бота
+DEV_GUILD = int(os.getenv('VZP_DEV_GUILD', '0'))  # Синхронизировать команды только на этот сервер - обновляются сразу, для разработки
+if SHARD_MODE == 'process':
+    # Процессы шардов на одной машине: у каждого свой порт метрик и свой файл записи трафика
+    METRICS_PORT = METRICS_PORT + SHARD_ID if METRICS_PORT else 0
+    TRACE_FILE = f"{TRACE_FILE}.shard{SHARD_ID}" if TRACE_FILE else ''
+CANCEL_WORDS = ["отмена", "cancel", "удалить", "delete", "освободить"]
 
 # ===================== PERSISTENT VIEWS =====================
-class VZPView(ui.View):
+# Кнопки сообщений VZP - динамические элементы: один шаблон custom_id на все VZP регистрируется
+# один раз в setup_hook, vzp_id берётся из custom_id нажатой кнопки. Хранилище view не растёт с числом VZP
+class VZPPlusButton(ui.DynamicItem[ui.Button], template=r"vzp_button_(?P<vzp_id>.+)"):
     def __init__(self, vzp_id: str):
-        super().__init__(timeout=None)
-        self.vzp_id = vzp_id
-        
-        self.button = ui.Button(
+        super().__init__(ui.Button(
             style=ButtonStyle.green,
             label="ПОДАТЬ ПЛЮС",
             custom_id=f"vzp_button_{vzp_id}",
             emoji="➕"
-        )
-        self.button.callback = self.button_callback
-        self.add_item(self.button)
+        ))
+        self.vzp_id = vzp_id
+    
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: ui.Button, match):
+        return cls(match["vzp_id"])
+    
+    async def callback(self, interaction: discord.Interaction):
+        start_trace(interaction, "button", "vzp_plus")
+        trace_interaction(interaction, "button", "vzp_plus", {"vzp_id": self.vzp_id})
+        started = time_module.perf_counter()
+        try:
+            await handle_vzp_button(interaction, self.vzp_id)
+        finally:
+            BUTTON_LATENCY.observe(time_module.perf_counter() - started, "vzp_plus")
+
+class VZPRosterButton(ui.DynamicItem[ui.Button], template=r"vzp_roster_(?P<vzp_id>.+)"):
+    def __init__(self, vzp_id: str):
+        super().__init__(ui.Button(
+            style=ButtonStyle.gray,
+            label="СОСТАВ",
+            custom_id=f"vzp_roster_{vzp_id}",
+            emoji="📋"
+        ))
+        self.vzp_id = vzp_id
+    
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: ui.Button, match):
+        return cls(match["vzp_id"])
+    
+    async def callback(self, interaction: discord.Interaction):
+        start_trace(interaction, "button", "vzp_roster")
+        started = time_module.perf_counter()
+        try:
+            await handle_roster_button(interaction, self.vzp_id)
+        finally:
+            BUTTON_LATENCY.observe(time_module.perf_counter() - started, "vzp_roster")
+
+def vzp_buttons(status: str) -> str:
+    """Набор кнопок сообщения VZP для статуса: запись открыта, только состав или без кнопок"""
+    return {'OPEN': 'plus', 'CLOSED': 'none'}.get(status, 'roster')
+
+def vzp_view(vzp_id: str, buttons: str) -> Optional[ui.View]:
+    if buttons == 'none':
+        return None
+    view = ui.View(timeout=None)
+    if buttons == 'plus':
+        view.add_item(VZPPlusButton(vzp_id))
+    view.add_item(VZPRosterButton(vzp_id))
+    return view
+
+# ===================== ЛОГИРОВАНИЕ =====================
+log = logging.getLogger("vzp")
+
+# trace_id взаимодействия и имя текущего шага; contextvars переживают await внутри задачи
+trace_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+span_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span", default=None)
+
+class TraceFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get()
+        if not hasattr(record, 'span'):
+            # Шаг, внутри которого записан лог (у записей record_span поле своё)
+            record.span = span_var.get()
+        if SHARD_MODE == 'process' and not hasattr(record, 'shard'):
+            # Логи всех процессов идут в один вывод лаунчера
+            record.shard = SHARD_ID
+        return True
+
+class JsonFormatter(logging.Formatter):
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(TraceFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+
+def start_trace(interaction: discord.Interaction, kind: str, name: str):
+    trace_id_var.set(uuid.uuid4().hex[:12])
+    log.info(f"{kind} {name}", extra={"kind": kind, "action": name, "user_id": interaction.user.id,
+                                      "guild_id": interaction.guild_id, "channel_id": interaction.channel_id})
+
+def record_span(name: str, duration_ms: float, failed: bool = False, **fields):
+    level = logging.WARNING if failed or duration_ms >= SLOW_SPAN_MS else logging.DEBUG
+    if log.isEnabledFor(level):
+        log.log(level, f"span {name} {duration_ms:.1f}ms", extra={
+            "span": name, "parent_span": span_var.get(), "duration_ms": round(duration_ms, 1), "failed": failed, **fields
+        })
+
+@contextmanager
+def span(name: str, **fields):
+    """Замеряет шаг обработчика. Медленные и упавшие шаги попадают в лог вместе с trace_id"""
+    token = span_var.set(name)
+    started = time_module.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        span_var.reset(token)
+        record_span(name, (time_module.perf_counter() - started) * 1000, failed, **fields)
+
+# ===================== МЕТРИКИ =====================
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values: Dict[tuple, float] = {}
+        METRICS.append(self)
+    
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Gauge(Counter):
+    def set(self, value: float, *label_values):
+        self.values[label_values] = value
+    
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values: Dict[tuple, List[float]] = {}  # labels -> [счётчики корзин..., сумма, количество]
+        METRICS.append(self)
+    
+    def observe(self, value: float, *label_values):
+        data = self.values.get(label_values)
+        if data is None:
+            data = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+        data[-2] += value
+        data[-1] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, data in self.values.items():
+            for bound, count in zip(self.buckets + ('+Inf',), data[:len(self.buckets)] + [data[-1]]):
+                labels = format_labels(self.labels + ('le',), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {data[-2]}")
+            lines.append(f"{self.name}_count{labels} {data[-1]}")
+        return lines
+
+METRICS: List = []
+
+COMMAND_LATENCY = Histogram("vzp_command_seconds", "Время обработки слеш-команды", ("command", "status"))
+BUTTON_LATENCY = Histogram("vzp_button_seconds", "Время обработки нажатия кнопки", ("button",))
+REST_REQUESTS = Counter("vzp_discord_rest_requests_total", "Запросы к REST API Discord", ("method", "route"))
+REST_RATE_LIMITED = Counter("vzp_discord_rate_limited_total", "Ответы 429 от REST API Discord", ("method",))
+LOOP_LAG = Gauge("vzp_event_loop_lag_seconds", "Последняя задержка цикла событий")
+LOOP_LAG_HIST = Histogram("vzp_event_loop_lag_hist_seconds", "Распределение задержки цикла событий",
+                          buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+LOOP_LAG_QUANTILE = Gauge("vzp_event_loop_lag_quantile_seconds", "Перцентили задержки цикла за окно замеров", ("quantile",))
+LOOP_STALLS = Counter("vzp_event_loop_stalls_total", "Зависания цикла событий дольше порога")
+SAVE_DURATION = Histogram("vzp_save_seconds", "Длительность save_data", buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+SAVE_SIZE = Gauge("vzp_save_bytes", "Суммарный размер файлов данных сервера после сохранения", ("guild",))
+ACTIVE_VZP_GAUGE = Gauge("vzp_active", "Активные VZP")
+POSITION_BOARDS_GAUGE = Gauge("vzp_position_boards", "Активные распределения позиций")
+ROSTER_SIZE_GAUGE = Gauge("vzp_roster_size", "Размер состава активной VZP", ("vzp_id",))
+DM_TOTAL = Counter("vzp_dm_total", "Личные сообщения игрокам", ("status",))
+SHARD_LATENCY = Gauge("vzp_shard_latency_seconds", "Задержка шлюза по шардам", ("shard",))
+SHARD_GUILDS = Gauge("vzp_shard_guilds", "Серверов на шарде", ("shard",))
+SHARD_EVENTS = Counter("vzp_shard_events_total", "Подключения и отключения шардов", ("shard", "event"))
+SCHEDULED_JOBS = Counter("vzp_scheduled_jobs_total", "Выполненные задачи планировщика", ("kind", "status"))
+SCHEDULE_QUEUE = Gauge("vzp_schedule_queue", "Задачи в очереди планировщика")
+SWEEP_EVICTED = Counter("vzp_sweep_evicted_total", "Записи, удалённые очисткой состояния", ("kind",))
+AUTOCOMPLETE_LATENCY = Histogram("vzp_autocomplete_seconds", "Время ответа автодополнения", ("parameter",),
+                                 buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 3))
+
+def collect_state_metrics():
+    ACTIVE_VZP_GAUGE.set(len(active_vzp))
+    POSITION_BOARDS_GAUGE.set(len(active_position_calls))
+    SCHEDULE_QUEUE.set(len(scheduled_jobs))
+    ROSTER_SIZE_GAUGE.values.clear()
+    for vzp_id, vzp_data in active_vzp.items():
+        ROSTER_SIZE_GAUGE.set(len(vzp_data.plus_users) + len(swap_history.get(vzp_id, {})), vzp_id)
+    for quantile, value in loop_watchdog.percentiles().items():
+        LOOP_LAG_QUANTILE.set(value, quantile)
+    for shard_id, health in shard_health().items():
+        if health["latency_ms"] is not None:
+            SHARD_LATENCY.set(health["latency_ms"] / 1000, shard_id)
+        SHARD_GUILDS.set(health["guilds"], shard_id)
+
+def render_metrics() -> str:
+    collect_state_metrics()
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server():
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    log.info(f"📈 Метрики доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+class RateLimitCounter(logging.Handler):
+    """discord.py обрабатывает 429 сам и только пишет предупреждение в лог - считаем их по логу"""
+    def emit(self, record: logging.LogRecord):
+        if isinstance(record.msg, str) and record.msg.startswith('We are being rate limited') and record.args:
+            REST_RATE_LIMITED.inc(record.args[0])
+
+def instrument_http(http):
+    original_request = http.request
+    
+    async def counted_request(route, **kwargs):
+        REST_REQUESTS.inc(route.method, route.path)
+        with span("discord_rest", method=route.method, route=route.path):
+            return await original_request(route, **kwargs)
     
-    async def button_callback(self, interaction: discord.Interaction):
-        await handle_vzp_button(interaction, self.vzp_id)
+    http.request = counted_request
+    logging.getLogger('discord.http').addHandler(RateLimitCounter(logging.WARNING))
+
+def observe_interaction(interaction: discord.Interaction, status: str):
+    command = interaction.command.qualified_name if interaction.command else "unknown"
+    latency = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    COMMAND_LATENCY.observe(latency, command, status)
+
+class LoopWatchdog:
+    """Корутина замеряет, насколько позже срока просыпается sleep, а отдельный поток
+    следит за её пульсом и снимает стек цикла, если тот не отвечает дольше порога"""
+    def __init__(self):
+        self.samples = deque(maxlen=LOOP_LAG_WINDOW)
+        self.heartbeat = time_module.monotonic()
+        self.reported_beat = None
+        self.loop = None
+        self.thread_id = None
+        self.stalls = 0
+        self.last_stall: Optional[dict] = None
+    
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        threading.Thread(target=self.watch, daemon=True, name="vzp-loop-watchdog").start()
+        while True:
+            started = self.loop.time()
+            self.heartbeat = time_module.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(0.0, self.loop.time() - started - LOOP_LAG_INTERVAL)
+            self.samples.append(lag)
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HIST.observe(lag)
+    
+    def watch(self):
+        while True:
+            time_module.sleep(LOOP_BLOCK_THRESHOLD / 2)
+            beat = self.heartbeat
+            blocked = time_module.monotonic() - beat - LOOP_LAG_INTERVAL
+            if blocked < LOOP_BLOCK_THRESHOLD or beat == self.reported_beat:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            # Одно зависание - одна запись, пока цикл не отметится снова
+            self.reported_beat = beat
+            stack = traceback.extract_stack(frame)
+            task = asyncio.current_task(self.loop)
+            self.stalls += 1
+            LOOP_STALLS.inc()
+            self.last_stall = {
+                "at": datetime.now(),
+                "blocked_ms": round(blocked * 1000),
+                "task": task.get_name() if task else None,
+                "where": [f"{os.path.basename(entry.filename)}:{entry.lineno} {entry.name}" for entry in stack[-3:]]
+            }
+            log.warning(f"Цикл событий заблокирован дольше {blocked * 1000:.0f} мс",
+                        extra={"blocked_ms": self.last_stall["blocked_ms"], "task": self.last_stall["task"],
+                               "stack": "".join(traceback.format_list(stack))})
+    
+    def percentiles(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {}
+        pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return {"0.5": pick(0.5), "0.95": pick(0.95), "0.99": pick(0.99), "1": ordered[-1]}
+
+loop_watchdog = LoopWatchdog()
+
+class VZPCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.type is discord.InteractionType.autocomplete:
+            return True  # Запрос на каждое нажатие клавиши - не логируем и не пишем в трафик
+        start_trace(interaction, "command", interaction.command.qualified_name if interaction.command else "unknown")
+        if interaction.command:
+            trace_interaction(interaction, "command", interaction.command.qualified_name, trace_options(interaction))
+        return True
+    
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        observe_interaction(interaction, "error")
+        await super().on_error(interaction, error)
+
+# ===================== НАСТРОЙКИ СЕРВЕРОВ =====================
+class GuildConfig:
+    def __init__(self, data: dict):
+        self.high_roles: List[int] = data.get('high_roles', list(HIGH_ROLES))
+        self.tier_roles: Dict[int, int] = {int(tier): role_id for tier, role_id in data.get('tier_roles', TIER_ROLES).items()}
+        self.allowed_channel: int = data.get('allowed_channel', ALLOWED_CHANNEL)
+        self.stats_channel: int = data.get('stats_channel', STATS_CHANNEL)
+        self.max_active_vzp: int = data.get('max_active_vzp', MAX_ACTIVE_VZP)
+        self.max_participants: int = data.get('max_participants', MAX_PARTICIPANTS_PER_VZP)
+        self.min_participants: int = data.get('min_participants', MIN_PARTICIPANTS_PER_VZP)
+        self.reindex()
+    
+    def reindex(self):
+        # Индекс ролей: role_id -> тир и множество админских ролей для проверок за O(1)
+        self.role_to_tier: Dict[int, int] = {role_id: tier_num for tier_num, role_id in self.tier_roles.items()}
+        self.high_role_set = frozenset(self.high_roles)
+    
+    def to_dict(self) -> dict:
+        return {
+            'high_roles': self.high_roles,
+            'tier_roles': self.tier_roles,
+            'allowed_channel': self.allowed_channel,
+            'stats_channel': self.stats_channel,
+            'max_active_vzp': self.max_active_vzp,
+            'max_participants': self.max_participants,
+            'min_participants': self.min_participants
+        }
+
+guild_configs: Dict[int, GuildConfig] = {}
+GUILD_CONFIG_FILE = "config.json"
+
+def guild_dir(guild_id: int) -> str:
+    return os.path.join(GUILDS_DIR, str(guild_id))
+
+def guild_file(guild_id: int, name: str) -> str:
+    return os.path.join(guild_dir(guild_id), name)
+
+def get_guild_config(guild_id: Optional[int]) -> GuildConfig:
+    config = guild_configs.get(guild_id)
+    if config is None:
+        config = guild_configs[guild_id] = GuildConfig({})
+    return config
+
+def save_guild_config(guild_id: int):
+    os.makedirs(guild_dir(guild_id), exist_ok=True)
+    with open(guild_file(guild_id, GUILD_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump(get_guild_config(guild_id).to_dict(), f, ensure_ascii=False, indent=2)
+
+def is_configured_guild(guild: discord.Guild) -> bool:
+    """Сервер считается настроенным, если канал команд из его настроек принадлежит ему"""
+    return guild.get_channel(get_guild_config(guild.id).allowed_channel) is not None
 
 # ===================== ХРАНИЛИЩА ДАННЫХ =====================
 class VZPData:
@@ -63,192 +517,936 @@ class VZPData:
         self.message_id: int = data.get('message_id', 0)
         self.channel_id: int = data.get('channel_id', 0)
         self.category_id: Optional[int] = data.get('category_id')
+        self.role_id: Optional[int] = data.get('role_id')
+        self.call_channel_id: Optional[int] = data.get('call_channel_id')
+        self.voice_board_message_id: Optional[int] = data.get('voice_board_message_id')
         self.plus_users: Dict[int, int] = data.get('plus_users', {})
         self.status: str = data.get('status', 'OPEN')
         self.created_at: str = data.get('created_at', datetime.now().isoformat())
         self.result: Optional[str] = data.get('result')
         self.amount: Optional[int] = data.get('amount')
+        self.guild_id: Optional[int] = data.get('guild_id')
+        self.buttons: Optional[str] = None  # Кнопки, уже стоящие на сообщении (не сохраняется, после перезапуска ставятся заново)
 
+# Активные VZP, позиции и уведомления ищутся по уникальным ID, поэтому лежат в общих словарях
+# с пометкой guild_id. Растущие хранилища (история, статистика, лидеры) разбиты по серверам
 active_vzp: Dict[str, VZPData] = {}
-closed_vzp: Dict[str, dict] = {}
+closed_vzp: Dict[int, Dict[str, dict]] = {}
 swap_history: Dict[str, Dict[int, int]] = {}
-vzp_views: Dict[str, VZPView] = {}
 position_assignments: Dict[str, Dict[int, Optional[discord.Member]]] = {}
 position_messages: Dict[str, Dict[str, int]] = {}
 active_position_calls: Dict[int, Dict] = {}
 user_notification_messages: Dict[str, Dict[int, int]] = {}
+category_pool: Dict[int, Dict] = {}
+pending_category_cleanup: Dict[int, Dict] = {}
+player_stats: Dict[int, Dict[int, Dict[str, int]]] = {}
+leaderboards: Dict[int, Dict[str, Dict]] = {}
+leaderboard_message: Dict[int, Dict[str, int]] = {}
+voice_sessions: Dict[str, Dict[int, List[List[Optional[float]]]]] = {}
+# job_id -> {"kind", "at" (unix time), "guild_id", "args"}; в куче (at, job_id), отменённые задачи выбрасываются при извлечении
+scheduled_jobs: Dict[str, dict] = {}
+schedule_heap: List[Tuple[float, str]] = []
 
 DATA_FILE = "vzp_data.json"
 SWAP_FILE = "swap_data.json"
 POSITIONS_FILE = "positions_data.json"
 POSITIONS_CALLS_FILE = "positions_calls.json"
 NOTIFICATION_FILE = "notification_data.json"
+POOL_FILE = "category_pool.json"
+CLEANUP_FILE = "pending_cleanup.json"
+STATS_FILE = "player_stats.json"
+LEADERBOARD_FILE = "leaderboards.json"
+VOICE_FILE = "voice_sessions.json"
+SCHEDULE_FILE = "schedule.json"
+LEGACY_GUILD = 0  # Данные из файлов в корне (до разделения по серверам), пока не известен их сервер
+
+LEADERBOARD_SIZE = 10
+LEADERBOARD_METRICS = {'played': 'ПОСЕЩАЕМОСТЬ', 'wins': 'ПОБЕДЫ', 'points': 'ТОЧКИ'}
+LEADERBOARD_WINDOWS = {'all': 'ЗА ВСЁ ВРЕМЯ', 'week': 'ЗА НЕДЕЛЮ', 'month': 'ЗА МЕСЯЦ'}
+
+EXPORT_FIELDS = ['vzp_id', 'closed_at', 'time', 'enemy', 'result', 'amount', 'members',
+                 'participants', 'all_participants', 'roster', 'swaps']
+EXPORT_COMPRESS_BYTES = 8 * 1024 * 1024  # Больше этого размера файл выгрузки сжимается (лимит вложений Discord)
+
+def guild_active_vzp(guild_id: Optional[int]) -> Dict[str, VZPData]:
+    return {vzp_id: vzp_data for vzp_id, vzp_data in active_vzp.items() if vzp_data.guild_id == guild_id}
+
+def vzp_in_guild(vzp_id: str, guild_id: Optional[int]) -> bool:
+    vzp_data = active_vzp.get(vzp_id)
+    return vzp_data is not None and vzp_data.guild_id == guild_id
+
+def index_closed_vzp(guild_id: int, record: dict):
+    """Добавляет закрытую VZP в индекс статистики игроков. Записи без состава (до появления индекса) пропускаются"""
+    roster = record.get('roster')
+    if roster is None:
+        return
+    
+    swaps = record.get('swaps', {})
+    result = record.get('result')
+    amount = record.get('amount') or 0
+    
+    guild_stats = player_stats.setdefault(guild_id, {})
+    players = {int(user_id) for user_id in roster} | {int(new_id) for new_id in swaps.values()}
+    for user_id in players:
+        stats = guild_stats.setdefault(user_id, {'played': 0, 'wins': 0, 'losses': 0, 'points': 0, 'swapped_out': 0})
+        stats['played'] += 1
+        if result == 'win':
+            stats['wins'] += 1
+        elif result == 'lose':
+            stats['losses'] += 1
+        stats['points'] += amount
+    
+    for old_id in swaps:
+        stats = guild_stats.setdefault(int(old_id), {'played': 0, 'wins': 0, 'losses': 0, 'points': 0, 'swapped_out': 0})
+        stats['swapped_out'] += 1
+
+def leaderboard_window_key(window: str, moment: datetime) -> str:
+    if window == 'week':
+        year, week, _ = moment.isocalendar()
+        return f"{year}-W{week:02d}"
+    if window == 'month':
+        return moment.strftime('%Y-%m')
+    return 'all'
+
+def new_leaderboard(key: str) -> dict:
+    return {
+        'key': key,
+        'counters': {metric: {} for metric in LEADERBOARD_METRICS},
+        'top': {metric: [] for metric in LEADERBOARD_METRICS}
+    }
 
-def save_data():
+def update_top(top: List[List[int]], user_id: int, value: int) -> bool:
+    """Обновляет топ-K. Значения в окне только растут, поэтому хватает проверки одного игрока"""
+    if len(top) >= LEADERBOARD_SIZE and value <= top[-1][1] and all(uid != user_id for uid, _ in top):
+        return False
+    
+    top[:] = [entry for entry in top if entry[0] != user_id]
+    position = 0
+    while position < len(top) and top[position][1] >= value:
+        position += 1
+    top.insert(position, [user_id, value])
+    del top[LEADERBOARD_SIZE:]
+    return True
+
+def update_leaderboards(guild_id: int, record: dict) -> bool:
+    """Добавляет закрытую VZP в таблицы лидеров всех окон. Возвращает True, если изменился чей-то топ"""
+    roster = record.get('roster')
+    if roster is None:
+        return False
+    
+    swaps = record.get('swaps', {})
+    players = {int(user_id) for user_id in roster} | {int(new_id) for new_id in swaps.values()}
+    deltas = {
+        'played': 1,
+        'wins': 1 if record.get('result') == 'win' else 0,
+        'points': record.get('amount') or 0
+    }
+    closed_at = datetime.fromisoformat(record['closed_at'])
+    guild_boards = leaderboards.setdefault(guild_id, {})
+    changed = False
+    
+    for window in LEADERBOARD_WINDOWS:
+        key = leaderboard_window_key(window, closed_at)
+        board = guild_boards.get(window)
+        if board is None or key > board['key']:
+            board = guild_boards[window] = new_leaderboard(key)
+        elif key < board['key']:
+            continue
+        
+        for metric, delta in deltas.items():
+            if not delta:
+                continue
+            counters = board['counters'][metric]
+            for user_id in players:
+                counters[user_id] = counters.get(user_id, 0) + delta
+                changed |= update_top(board['top'][metric], user_id, counters[user_id])
+    
+    return changed
+
+def get_leaderboard_top(guild_id: int, window: str, metric: str) -> List[List[int]]:
+    board = leaderboards.get(guild_id, {}).get(window)
+    if board is None or board['key'] != leaderboard_window_key(window, datetime.now()):
+        return []
+    return board['top'][metric]
+
+def vzp_to_dict(vzp: VZPData) -> dict:
+    return {
+        'time': vzp.time,
+        'members': vzp.members,
+        'enemy': vzp.enemy,
+        'attack_def': vzp.attack_def,
+        'attack_def_name': vzp.attack_def_name,
+        'conditions': vzp.conditions,
+        'conditions_display': vzp.conditions_display,
+        'calibers': vzp.calibers,
+        'caliber_names': vzp.caliber_names,
+        'message_id': vzp.message_id,
+        'channel_id': vzp.channel_id,
+        'category_id': vzp.category_id,
+        'role_id': vzp.role_id,
+        'call_channel_id': vzp.call_channel_id,
+        'voice_board_message_id': vzp.voice_board_message_id,
+        'plus_users': vzp.plus_users,
+        'status': vzp.status,
+        'created_at': vzp.created_at,
+        'result': vzp.result,
+        'amount': vzp.amount,
+        'guild_id': vzp.guild_id
+    }
+
+def known_guild_ids() -> Set[int]:
+    """Серверы, у которых есть хоть какие-то данные в памяти"""
+    guild_ids = set(guild_configs) | set(closed_vzp) | set(player_stats) | set(leaderboards)
+    guild_ids |= {vzp.guild_id for vzp in active_vzp.values()}
+    guild_ids |= {info.get("guild_id") for info in position_messages.values()}
+    guild_ids |= {entry.get("guild_id") for entry in category_pool.values()}
+    guild_ids |= {entry.get("guild_id") for entry in pending_category_cleanup.values()}
+    guild_ids -= {None, LEGACY_GUILD}
+    return guild_ids
+
+def save_voice_sessions(guild_id: Optional[int] = None):
+    # Отдельно от save_data: голосовые события частые, остальные файлы при них не меняются
+    if guild_id is None:
+        for known_id in known_guild_ids():
+            save_voice_sessions(known_id)
+        return
+    if guild_id == LEGACY_GUILD:
+        return
+    
+    voice_save_pending.discard(guild_id)
+    os.makedirs(guild_dir(guild_id), exist_ok=True)
+    sessions = {vzp_id: users for vzp_id, users in voice_sessions.items() if vzp_in_guild(vzp_id, guild_id)}
+    with open(guild_file(guild_id, VOICE_FILE), 'w', encoding='utf-8') as f:
+        json.dump(sessions, f, ensure_ascii=False)
+
+DATA_FILES = [DATA_FILE, SWAP_FILE, POSITIONS_FILE, POSITIONS_CALLS_FILE, NOTIFICATION_FILE,
+              POOL_FILE, CLEANUP_FILE, STATS_FILE, LEADERBOARD_FILE, VOICE_FILE, SCHEDULE_FILE]
+
+def save_schedule(guild_id: int):
+    # Отдельно от save_data: выполненная задача должна исчезнуть из файла сразу, иначе после
+    # перезапуска в пределах grace она выполнится второй раз (повторные ЛС). Задачи persist=False не пишутся
+    if guild_id == LEGACY_GUILD:
+        return
+    
+    os.makedirs(guild_dir(guild_id), exist_ok=True)
+    with open(guild_file(guild_id, SCHEDULE_FILE), 'w', encoding='utf-8') as f:
+        json.dump({job_id: job for job_id, job in scheduled_jobs.items()
+                   if job["guild_id"] == guild_id and job.get("persist", True)},
+                  f, ensure_ascii=False, indent=2)
+
+def save_data(guild_id: Optional[int] = None):
+    """Сохраняет файлы одного сервера, остальные серверы не трогаются. Без guild_id - все серверы"""
+    if guild_id is None:
+        for known_id in known_guild_ids():
+            save_data(known_id)
+        return
+    if guild_id == LEGACY_GUILD:
+        # Сервер ещё не известен - данные остаются в старых файлах до adopt_legacy_data
+        return
+    
+    started = time_module.perf_counter()
     try:
-        vzp_data = {}
-        for vzp_id, vzp in active_vzp.items():
-            vzp_data[vzp_id] = {
-                'time': vzp.time,
-                'members': vzp.members,
-                'enemy': vzp.enemy,
-                'attack_def': vzp.attack_def,
-                'attack_def_name': vzp.attack_def_name,
-                'conditions': vzp.conditions,
-                'conditions_display': vzp.conditions_display,
-                'calibers': vzp.calibers,
-                'caliber_names': vzp.caliber_names,
-                'message_id': vzp.message_id,
-                'channel_id': vzp.channel_id,
-                'category_id': vzp.category_id,
-                'plus_users': vzp.plus_users,
-                'status': vzp.status,
-                'created_at': vzp.created_at,
-                'result': vzp.result,
-                'amount': vzp.amount
-            }
+        os.makedirs(guild_dir(guild_id), exist_ok=True)
+        vzp_data = {vzp_id: vzp_to_dict(vzp) for vzp_id, vzp in active_vzp.items() if vzp.guild_id == guild_id}
         
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
+        with open(guild_file(guild_id, DATA_FILE), 'w', encoding='utf-8') as f:
             json.dump({
                 'active': vzp_data,
-                'closed': closed_vzp
+                'closed': closed_vzp.get(guild_id, {})
             }, f, ensure_ascii=False, indent=2)
         
-        with open(SWAP_FILE, 'w', encoding='utf-8') as f:
-            json.dump(swap_history, f, ensure_ascii=False, indent=2)
+        with open(guild_file(guild_id, SWAP_FILE), 'w', encoding='utf-8') as f:
+            json.dump({vzp_id: swap_history[vzp_id] for vzp_id in vzp_data if vzp_id in swap_history},
+                      f, ensure_ascii=False, indent=2)
         
+        pos_ids = [pos_id for pos_id, info in position_messages.items() if info.get("guild_id") == guild_id]
         positions_to_save = {}
-        for vzp_id, positions in position_assignments.items():
-            positions_to_save[vzp_id] = {
+        for pos_id in pos_ids:
+            positions_to_save[pos_id] = {
                 pos: member.id if member else None 
-                for pos, member in positions.items()
+                for pos, member in position_assignments.get(pos_id, {}).items()
             }
         
-        with open(POSITIONS_FILE, 'w', encoding='utf-8') as f:
+        with open(guild_file(guild_id, POSITIONS_FILE), 'w', encoding='utf-8') as f:
             json.dump({
                 'assignments': positions_to_save,
-                'messages': position_messages
+                'messages': {pos_id: position_messages[pos_id] for pos_id in pos_ids}
             }, f, ensure_ascii=False, indent=2)
         
         calls_to_save = {}
         for channel_id, call_data in active_position_calls.items():
+            if call_data.get("guild_id") != guild_id:
+                continue
             calls_to_save[channel_id] = {
                 "pos_id": call_data.get("pos_id"),
                 "vzp_id": call_data.get("vzp_id"),
                 "created_by": call_data.get("created_by"),
-                "created_at": call_data.get("created_at")
+                "created_at": call_data.get("created_at"),
+                "guild_id": guild_id
             }
         
-        with open(POSITIONS_CALLS_FILE, 'w', encoding='utf-8') as f:
+        with open(guild_file(guild_id, POSITIONS_CALLS_FILE), 'w', encoding='utf-8') as f:
             json.dump(calls_to_save, f, ensure_ascii=False, indent=2)
         
-        with open(NOTIFICATION_FILE, 'w', encoding='utf-8') as f:
-            json.dump(user_notification_messages, f, ensure_ascii=False, indent=2)
+        board_messages = {str(position_messages[pos_id]["message_id"]) for pos_id in pos_ids}
+        with open(guild_file(guild_id, NOTIFICATION_FILE), 'w', encoding='utf-8') as f:
+            json.dump({message_id: users for message_id, users in user_notification_messages.items() if message_id in board_messages},
+                      f, ensure_ascii=False, indent=2)
+        
+        with open(guild_file(guild_id, POOL_FILE), 'w', encoding='utf-8') as f:
+            json.dump({cat_id: entry for cat_id, entry in category_pool.items() if entry.get("guild_id") == guild_id},
+                      f, ensure_ascii=False, indent=2)
+        
+        with open(guild_file(guild_id, CLEANUP_FILE), 'w', encoding='utf-8') as f:
+            json.dump({cat_id: entry for cat_id, entry in pending_category_cleanup.items() if entry.get("guild_id") == guild_id},
+                      f, ensure_ascii=False, indent=2)
+        
+        with open(guild_file(guild_id, STATS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(player_stats.get(guild_id, {}), f, ensure_ascii=False, indent=2)
         
-        print(f"💾 Данные сохранены: {len(active_vzp)} активных VZP, {len(active_position_calls)} активных распределений")
+        with open(guild_file(guild_id, LEADERBOARD_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'boards': leaderboards.get(guild_id, {}),
+                'message': leaderboard_message.get(guild_id, {})
+            }, f, ensure_ascii=False, indent=2)
+        
+        save_schedule(guild_id)
+        save_voice_sessions(guild_id)
+        
+        elapsed = time_module.perf_counter() - started
+        size = sum(os.path.getsize(path) for path in (guild_file(guild_id, name) for name in DATA_FILES) if os.path.exists(path))
+        SAVE_DURATION.observe(elapsed)
+        SAVE_SIZE.set(size, guild_id)
+        record_span("save_data", elapsed * 1000, bytes=size, guild_id=guild_id)
+        log.debug(f"💾 Данные сервера {guild_id} сохранены: {len(vzp_data)} активных VZP, {len(calls_to_save)} активных распределений")
     except Exception as e:
-        print(f"❌ Ошибка сохранения данных: {e}")
+        log.exception(f"❌ Ошибка сохранения данных сервера {guild_id}: {e}")
+
+def load_guild_data(guild_id: int, directory: str):
+    """Дочитывает в общие словари файлы одного сервера. Записи без guild_id получают guild_id папки"""
+    def path(name: str) -> str:
+        return os.path.join(directory, name)
+    
+    if os.path.exists(path(GUILD_CONFIG_FILE)):
+        with open(path(GUILD_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            guild_configs[guild_id] = GuildConfig(json.load(f))
+    
+    closed = {}
+    if os.path.exists(path(DATA_FILE)):
+        with open(path(DATA_FILE), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            
+            active_data = data.get('active', {})
+            for vzp_id, vzp_data in active_data.items():
+                if 'plus_users' in vzp_data:
+                    vzp_data['plus_users'] = {int(k): int(v) for k, v in vzp_data['plus_users'].items()}
+                vzp_data['guild_id'] = vzp_data.get('guild_id') or guild_id
+                
+                active_vzp[vzp_id] = VZPData(vzp_data)
+            
+            closed = data.get('closed', {})
+    if closed:
+        closed_vzp[guild_id] = closed
+    
+    if os.path.exists(path(SWAP_FILE)):
+        with open(path(SWAP_FILE), 'r', encoding='utf-8') as f:
+            swap_data = json.load(f)
+            swap_history.update({k: {int(k2): int(v2) for k2, v2 in v.items()} for k, v in swap_data.items()})
+    
+    if os.path.exists(path(POSITIONS_FILE)):
+        with open(path(POSITIONS_FILE), 'r', encoding='utf-8') as f:
+            positions_data = json.load(f)
+            
+            assignments_data = positions_data.get('assignments', {})
+            for vzp_id, positions in assignments_data.items():
+                position_assignments[vzp_id] = {}
+                for pos_str, member_id in positions.items():
+                    pos = int(pos_str)
+                    if member_id:
+                        member = None
+                        for guild in bot.guilds:
+                            member = guild.get_member(member_id)
+                            if member:
+                                break
+                        position_assignments[vzp_id][pos] = member
+                    else:
+                        position_assignments[vzp_id][pos] = None
+            
+            for pos_id, info in positions_data.get('messages', {}).items():
+                info.setdefault("guild_id", guild_id)
+                position_messages[pos_id] = info
+    
+    if os.path.exists(path(POSITIONS_CALLS_FILE)):
+        with open(path(POSITIONS_CALLS_FILE), 'r', encoding='utf-8') as f:
+            calls_data = json.load(f)
+            for channel_id, call_data in calls_data.items():
+                call_data.setdefault("guild_id", guild_id)
+                active_position_calls[int(channel_id)] = call_data
+    
+    if os.path.exists(path(NOTIFICATION_FILE)):
+        with open(path(NOTIFICATION_FILE), 'r', encoding='utf-8') as f:
+            notification_data = json.load(f)
+            user_notification_messages.update({
+                message_id: {int(user_id): notice_id for user_id, notice_id in users.items()}
+                for message_id, users in notification_data.items()
+            })
+    
+    if os.path.exists(path(POOL_FILE)):
+        with open(path(POOL_FILE), 'r', encoding='utf-8') as f:
+            pool_data = json.load(f)
+            category_pool.update({int(k): v for k, v in pool_data.items()})
+    
+    if os.path.exists(path(CLEANUP_FILE)):
+        with open(path(CLEANUP_FILE), 'r', encoding='utf-8') as f:
+            cleanup_data = json.load(f)
+            pending_category_cleanup.update({int(k): v for k, v in cleanup_data.items()})
+    
+    if os.path.exists(path(STATS_FILE)):
+        with open(path(STATS_FILE), 'r', encoding='utf-8') as f:
+            stats_data = json.load(f)
+            player_stats[guild_id] = {int(k): v for k, v in stats_data.items()}
+    else:
+        # Индекса ещё нет - строим его один раз по уже закрытым VZP
+        for record in closed.values():
+            index_closed_vzp(guild_id, record)
+    
+    if os.path.exists(path(LEADERBOARD_FILE)):
+        with open(path(LEADERBOARD_FILE), 'r', encoding='utf-8') as f:
+            leaderboard_data = json.load(f)
+            boards = leaderboard_data.get('boards', {})
+            for board in boards.values():
+                board['counters'] = {
+                    metric: {int(k): v for k, v in counters.items()}
+                    for metric, counters in board['counters'].items()
+                }
+            leaderboards[guild_id] = boards
+            leaderboard_message[guild_id] = leaderboard_data.get('message', {})
+    else:
+        for record in sorted(closed.values(), key=lambda r: r.get('closed_at', '')):
+            update_leaderboards(guild_id, record)
+    
+    if os.path.exists(path(VOICE_FILE)):
+        with open(path(VOICE_FILE), 'r', encoding='utf-8') as f:
+            voice_data = json.load(f)
+            voice_sessions.update({
+                vzp_id: {int(user_id): intervals for user_id, intervals in users.items()}
+                for vzp_id, users in voice_data.items()
+            })
+    
+    if os.path.exists(path(SCHEDULE_FILE)):
+        with open(path(SCHEDULE_FILE), 'r', encoding='utf-8') as f:
+            for job_id, job in json.load(f).items():
+                job.setdefault("guild_id", guild_id)
+                restore_job(job_id, job)
+
+def owns_guild(guild_id: int) -> bool:
+    """В режиме process каждый процесс читает и пишет только папки серверов своего шарда"""
+    return SHARD_MODE != 'process' or (guild_id >> 22) % SHARD_COUNT == SHARD_ID
 
 def load_data():
-    global active_vzp, closed_vzp, swap_history, position_assignments, position_messages, active_position_calls, user_notification_messages
+    global legacy_data_loaded
     
+    invalidate_vzp_index()
     try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-                active_data = data.get('active', {})
-                for vzp_id, vzp_data in active_data.items():
-                    if 'plus_users' in vzp_data:
-                        vzp_data['plus_users'] = {int(k): int(v) for k, v in vzp_data['plus_users'].items()}
-                    
-                    active_vzp[vzp_id] = VZPData(vzp_data)
-                
-                closed_vzp = data.get('closed', {})
-        
-        if os.path.exists(SWAP_FILE):
-            with open(SWAP_FILE, 'r', encoding='utf-8') as f:
-                swap_data = json.load(f)
-                swap_history = {k: {int(k2): int(v2) for k2, v2 in v.items()} for k, v in swap_data.items()}
+        if os.path.isdir(GUILDS_DIR):
+            for name in os.listdir(GUILDS_DIR):
+                if name.isdigit() and owns_guild(int(name)):
+                    load_guild_data(int(name), guild_dir(int(name)))
+        if os.path.exists(DATA_FILE) and SHARD_MODE == 'process':
+            log.warning("⚠️ Данные старого формата не переносятся в режиме process: запустите бота один раз без шардов")
+        elif os.path.exists(DATA_FILE):
+            # Старый формат: файлы в корне. Сервер станет известен после подключения, см. adopt_legacy_data
+            load_guild_data(LEGACY_GUILD, "")
+            legacy_data_loaded = True
         
-        if os.path.exists(POSITIONS_FILE):
-            with open(POSITIONS_FILE, 'r', encoding='utf-8') as f:
-                positions_data = json.load(f)
-                
-                assignments_data = positions_data.get('assignments', {})
-                for vzp_id, positions in assignments_data.items():
-                    position_assignments[vzp_id] = {}
-                    for pos_str, member_id in positions.items():
-                        pos = int(pos_str)
-                        if member_id:
-                            member = None
-                            for guild in bot.guilds:
-                                member = guild.get_member(member_id)
-                                if member:
-                                    break
-                            position_assignments[vzp_id][pos] = member
-                        else:
-                            position_assignments[vzp_id][pos] = None
-                
-                position_messages = positions_data.get('messages', {})
-        
-        if os.path.exists(POSITIONS_CALLS_FILE):
-            with open(POSITIONS_CALLS_FILE, 'r', encoding='utf-8') as f:
-                calls_data = json.load(f)
-                active_position_calls = {int(k): v for k, v in calls_data.items()}
-        
-        if os.path.exists(NOTIFICATION_FILE):
-            with open(NOTIFICATION_FILE, 'r', encoding='utf-8') as f:
-                user_notification_messages = json.load(f)
-        
-        print(f"📂 Данные загружены: {len(active_vzp)} активных VZP, {len(active_position_calls)} активных распределений")
+        log.info(f"📂 Данные загружены: {len(known_guild_ids())} серверов, {len(active_vzp)} активных VZP, {len(active_position_calls)} активных распределений")
     except Exception as e:
-        print(f"❌ Ошибка загрузки данных: {e}")
-        active_vzp = {}
-        closed_vzp = {}
-        swap_history = {}
-        position_assignments = {}
-        position_messages = {}
-        active_position_calls = {}
-        user_notification_messages = {}
+        log.exception(f"❌ Ошибка загрузки данных: {e}")
+        for store in (active_vzp, closed_vzp, swap_history, position_assignments, position_messages, active_position_calls,
+                      user_notification_messages, category_pool, pending_category_cleanup, player_stats, leaderboards,
+                      leaderboard_message, voice_sessions, guild_configs, scheduled_jobs, schedule_heap):
+            store.clear()
+
+legacy_data_loaded = False
+
+def adopt_legacy_data():
+    """Переносит данные старого формата на сервер канала ALLOWED_CHANNEL и пишет их в папку сервера"""
+    global legacy_data_loaded
+    if not legacy_data_loaded:
+        return
+    
+    channel = bot.get_channel(ALLOWED_CHANNEL)
+    if channel is None:
+        log.warning(f"⚠️ Канал {ALLOWED_CHANNEL} не найден, данные старого формата не перенесены")
+        return
+    guild_id = channel.guild.id
+    
+    for vzp_data in active_vzp.values():
+        if vzp_data.guild_id == LEGACY_GUILD:
+            vzp_data.guild_id = guild_id
+    invalidate_vzp_index()
+    for info in list(position_messages.values()) + list(active_position_calls.values()):
+        if info.get("guild_id") == LEGACY_GUILD:
+            info["guild_id"] = guild_id
+    for store in (closed_vzp, player_stats, leaderboards, leaderboard_message):
+        if LEGACY_GUILD in store:
+            store[guild_id] = store.pop(LEGACY_GUILD)
+    
+    save_data(guild_id)
+    for name in DATA_FILES:
+        if os.path.exists(name):
+            os.replace(name, name + ".migrated")
+    legacy_data_loaded = False
+    log.info(f"📦 Данные старого формата перенесены в {guild_dir(guild_id)}")
 
 # ===================== НАСТРОЙКА БОТА =====================
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-class VZPBot(commands.Bot):
+def shard_options() -> dict:
+    if SHARD_MODE == 'process':
+        if SHARD_COUNT <= SHARD_ID:
+            raise SystemExit(f"❌ VZP_SHARD_ID={SHARD_ID} вне VZP_SHARD_COUNT={SHARD_COUNT}")
+        return {"shard_id": SHARD_ID, "shard_count": SHARD_COUNT}
+    if SHARD_MODE == 'auto' and SHARD_COUNT:
+        return {"shard_count": SHARD_COUNT}
+    return {}
+
+class VZPBot(commands.AutoShardedBot if SHARD_MODE == 'auto' else commands.Bot):
     def __init__(self):
-        super().__init__(command_prefix='!', intents=intents)
+        super().__init__(command_prefix='!', intents=intents, tree_cls=VZPCommandTree, **shard_options())
     
     async def setup_hook(self):
         load_data()
+        open_trace()
+        
+        instrument_http(self.http)
+        run_in_background(loop_watchdog.run())
+        if SHARD_MODE != 'single':
+            run_in_background(report_shard_health())
+        run_in_background(lifecycle_sweeper())
+        if METRICS_PORT:
+            try:
+                await start_metrics_server()
+            except OSError as e:
+                log.error(f"❌ Не удалось запустить сервер метрик: {e}")
         
-        for vzp_id, vzp_data in active_vzp.items():
-            if vzp_data.status == 'OPEN':
-                view = VZPView(vzp_id)
-                self.add_view(view)
+        self.add_dynamic_items(VZPPlusButton, VZPRosterButton)
         
+        if SHARD_MODE == 'process' and SHARD_ID != 0:
+            # Команды глобальные: синхронизирует только шард 0, остальные не тратят лимит
+            return
         try:
-            synced = await self.tree.sync()
-            print(f"✅ Синхронизировано {len(synced)} команд")
+            await sync_command_tree(self.tree)
         except Exception as e:
-            print(f"❌ Ошибка синхронизации: {e}")
+            log.error(f"❌ Ошибка синхронизации: {e}")
+    
+    async def close(self):
+        # Отложенная запись голосового журнала не должна потеряться при остановке
+        flush_voice_saves()
+        await super().close()
 
 bot = VZPBot()
 
+# ===================== СИНХРОНИЗАЦИЯ КОМАНД =====================
+def command_tree_hash(tree: app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None) -> str:
+    """Стабильный хэш команд в том виде, в каком tree.sync отправляет их в Discord"""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+                     key=lambda command: (command.get('type', 1), command['name']))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def load_sync_state() -> Dict[str, dict]:
+    try:
+        with open(COMMAND_SYNC_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_sync_state(state: Dict[str, dict]):
+    with open(COMMAND_SYNC_FILE + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(COMMAND_SYNC_FILE + ".tmp", COMMAND_SYNC_FILE)
+
+async def sync_command_tree(tree: app_commands.CommandTree):
+    """Синхронизирует команды только если их хэш отличается от последней успешной синхронизации.
+    tree.sync - медленный глобальный запрос с жёстким лимитом, а при обычном перезапуске команды не меняются"""
+    guild = discord.Object(DEV_GUILD) if DEV_GUILD else None
+    if guild:
+        tree.copy_global_to(guild=guild)
+    target = f"{tree.client.application_id}:" + (f"guild:{DEV_GUILD}" if guild else "global")
+    digest = command_tree_hash(tree, guild)
+    
+    state = load_sync_state()
+    if not SYNC_FORCE and state.get(target, {}).get("hash") == digest:
+        log.info(f"⏭️ Команды не изменились ({digest[:12]}), синхронизация пропущена")
+        return
+    
+    with span("command_sync", target=target):
+        synced = await tree.sync(guild=guild)
+    state[target] = {"hash": digest, "commands": len(synced), "synced_at": datetime.now().isoformat(timespec='seconds')}
+    save_sync_state(state)
+    log.info(f"✅ Синхронизировано {len(synced)} команд" + (f" на сервер {DEV_GUILD}" if guild else ""))
+
+# ===================== ШАРДЫ =====================
+shard_events: Dict[int, Dict[str, object]] = {}
+process_started = time_module.time()
+
+def shard_of(guild_id: int) -> int:
+    return (guild_id >> 22) % (bot.shard_count or 1)
+
+def note_shard_event(shard_id: int, event: str):
+    SHARD_EVENTS.inc(shard_id, event)
+    state = shard_events.setdefault(shard_id, {"disconnects": 0})
+    state["last_event"] = event
+    state["last_event_at"] = time_module.time()
+    if event == 'disconnect':
+        state["disconnects"] += 1
+        log.warning(f"🔌 Шард {shard_id} отключился от шлюза", extra={"shard": shard_id})
+    else:
+        log.info(f"🔌 Шард {shard_id}: {event}", extra={"shard": shard_id})
+
+def finite_ms(seconds: float) -> Optional[float]:
+    # До первого heartbeat задержка шлюза равна inf/nan
+    return round(seconds * 1000, 1) if math.isfinite(seconds) else None
+
+def shard_health() -> Dict[int, dict]:
+    """Состояние шардов этого процесса: задержка шлюза, подключение, серверы и активные VZP"""
+    if isinstance(bot, commands.AutoShardedBot):
+        shards = {shard_id: (info.latency, info.is_closed()) for shard_id, info in bot.shards.items()}
+    else:
+        shards = {bot.shard_id or 0: (bot.latency, bot.is_closed())}
+    
+    health = {}
+    for shard_id, (latency, closed) in shards.items():
+        health[shard_id] = {
+            "latency_ms": finite_ms(latency),
+            "connected": not closed and math.isfinite(latency),
+            "guilds": 0,
+            "active_vzp": 0,
+            **shard_events.get(shard_id, {"disconnects": 0})
+        }
+    for guild in bot.guilds:
+        if guild.shard_id in health:
+            health[guild.shard_id]["guilds"] += 1
+    for vzp_data in active_vzp.values():
+        entry = health.get(shard_of(vzp_data.guild_id or 0))
+        if entry:
+            entry["active_vzp"] += 1
+    return health
+
+def shard_health_path() -> str:
+    name = f"shard-{SHARD_ID}.json" if SHARD_MODE == 'process' else f"{SHARD_MODE}.json"
+    return os.path.join(SHARD_HEALTH_DIR, name)
+
+def write_shard_health():
+    lag = loop_watchdog.percentiles()
+    report = {
+        "pid": os.getpid(),
+        "mode": SHARD_MODE,
+        "started_at": process_started,
+        "updated_at": time_module.time(),
+        "ready": bot.is_ready(),
+        "loop_lag_p99_ms": round(lag["0.99"] * 1000, 1) if lag else None,
+        "stalls": loop_watchdog.stalls,
+        "shards": shard_health()
+    }
+    os.makedirs(SHARD_HEALTH_DIR, exist_ok=True)
+    # Через временный файл: лаунчер не должен прочитать наполовину записанный отчёт
+    path = shard_health_path()
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+async def report_shard_health():
+    """Пульс процесса для launcher.py: по устаревшему файлу лаунчер считает процесс зависшим"""
+    while True:
+        try:
+            write_shard_health()
+        except OSError as e:
+            log.warning(f"⚠️ Не удалось записать состояние шардов: {e}")
+        await asyncio.sleep(SHARD_HEALTH_INTERVAL)
+
+@bot.event
+async def on_shard_ready(shard_id: int):
+    note_shard_event(shard_id, 'ready')
+
+@bot.event
+async def on_shard_disconnect(shard_id: int):
+    note_shard_event(shard_id, 'disconnect')
+
+@bot.event
+async def on_shard_resumed(shard_id: int):
+    note_shard_event(shard_id, 'resumed')
+
+@bot.event
+async def on_disconnect():
+    # AutoShardedBot присылает ещё и on_shard_disconnect с номером шарда
+    if not isinstance(bot, commands.AutoShardedBot):
+        note_shard_event(bot.shard_id or 0, 'disconnect')
+
+@bot.event
+async def on_resumed():
+    if not isinstance(bot, commands.AutoShardedBot):
+        note_shard_event(bot.shard_id or 0, 'resumed')
+
+# ===================== КЭШ УЧАСТНИКОВ =====================
+# (guild_id, user_id) -> display_name: ник у каждого сервера свой. Упоминания строятся по ID, поэтому хранится только имя
+member_cache: Dict[Tuple[int, int], str] = {}
+
+def cache_member(member: discord.Member):
+    member_cache[(member.guild.id, member.id)] = member.display_name
+
+def fill_member_cache():
+    for guild in bot.guilds:
+        for member in guild.members:
+            cache_member(member)
+
+def member_mention(guild_id: int, user_id: int) -> str:
+    # Упоминание ушедшего с сервера игрока Discord рисует как неизвестного - для него оставляем ID
+    if (guild_id, user_id) in member_cache:
+        return f"<@{user_id}>"
+    return member_name(guild_id, user_id)
+
+def member_name(guild_id: int, user_id: int) -> str:
+    return member_cache.get((guild_id, user_id), f"ID:{user_id}")
+
+async def resolve_members(guild: discord.Guild, user_ids) -> Dict[int, discord.Member]:
+    """Участники по ID: из кэша шлюза, отсутствующие догружаются пачками через query_members"""
+    resolved: Dict[int, discord.Member] = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        member = guild.get_member(user_id)
+        if member:
+            resolved[user_id] = member
+            if (guild.id, user_id) not in member_cache:
+                cache_member(member)
+        else:
+            missing.append(user_id)
+    
+    for i in range(0, len(missing), 100):
+        try:
+            members = await guild.query_members(user_ids=missing[i:i + 100], cache=True)
+        except Exception as e:
+            log.warning(f"⚠️ Не удалось загрузить участников: {e}")
+            break
+        for member in members:
+            cache_member(member)
+            resolved[member.id] = member
+    return resolved
+
+# (guild_id, user_id) -> (тир или None, есть ли админская роль). Сбрасывается при смене ролей и настроек сервера
+member_eligibility: Dict[Tuple[int, int], Tuple[Optional[int], bool]] = {}
+
+def get_member_eligibility(member: discord.Member) -> Tuple[Optional[int], bool]:
+    guild = getattr(member, 'guild', None)
+    if guild is None:
+        return None, False
+    
+    cached = member_eligibility.get((guild.id, member.id))
+    if cached is None:
+        config = get_guild_config(guild.id)
+        role_ids = {role.id for role in getattr(member, 'roles', [])}
+        tiers = [config.role_to_tier[role_id] for role_id in role_ids & config.role_to_tier.keys()]
+        cached = (min(tiers) if tiers else None, not config.high_role_set.isdisjoint(role_ids))
+        member_eligibility[(guild.id, member.id)] = cached
+    return cached
+
+def forget_guild_eligibility(guild_id: int):
+    for key in [key for key in member_eligibility if key[0] == guild_id]:
+        del member_eligibility[key]
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    cache_member(member)
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.display_name != after.display_name:
+        cache_member(after)
+    if before.roles != after.roles:
+        member_eligibility.pop((after.guild.id, after.id), None)
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    member_cache.pop((member.guild.id, member.id), None)
+    member_eligibility.pop((member.guild.id, member.id), None)
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    for key in [key for key in member_cache if key[0] == guild.id]:
+        del member_cache[key]
+    forget_guild_eligibility(guild.id)
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    observe_interaction(interaction, "ok")
+
 # ===================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====================
+background_tasks: Set[asyncio.Task] = set()
+
+def run_in_background(coro) -> asyncio.Task:
+    # Держим ссылку на задачу, иначе сборщик мусора может прервать её на середине
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def send_dm(member: discord.abc.User, **kwargs) -> bool:
+    try:
+        with span("send_dm"):
+            await member.send(**kwargs)
+    except discord.HTTPException as e:
+        DM_TOTAL.inc("failed")
+        log.warning(f"Не удалось отправить ЛС: {e}", extra={"user_id": member.id, "status": e.status})
+        return False
+    DM_TOTAL.inc("ok")
+    return True
+
+async def send_pings(channel: discord.abc.Messageable, count: int = AUTOPING_COUNT):
+    """Серия @everyone для /ping и автопинга. Темп задают лимиты канала в REST-слое discord.py, своих пауз нет"""
+    with span("send_pings", count=count):
+        for _ in range(count):
+            await channel.send("@everyone")
+
+async def delete_message_quietly(message: discord.Message):
+    """Удаляет сообщение игрока. Уже удалённое - не ошибка, остальные ошибки в лог"""
+    try:
+        with span("delete_message"):
+            await message.delete()
+    except discord.NotFound:
+        pass
+    except discord.HTTPException:
+        log.warning(f"⚠️ Не удалось удалить сообщение {message.id}", extra={"channel_id": message.channel.id}, exc_info=True)
+
+async def disconnect_from_voice(member: discord.Member):
+    try:
+        with span("move_to_none"):
+            await member.move_to(None)
+    except discord.HTTPException:
+        log.warning(f"⚠️ Не удалось отключить {member.id} от голосового канала", extra={"user_id": member.id}, exc_info=True)
+
 async def is_allowed_channel(interaction: discord.Interaction) -> bool:
-    return interaction.channel_id == ALLOWED_CHANNEL
+    return interaction.channel_id == get_guild_config(interaction.guild_id).allowed_channel
 
 async def has_high_role(interaction: discord.Interaction) -> bool:
-    return any(role.id in HIGH_ROLES for role in interaction.user.roles)
+    return get_member_eligibility(interaction.user)[1]
 
 async def get_user_tier(user: discord.Member) -> Optional[int]:
-    for tier_num, role_id in TIER_ROLES.items():
-        if any(role.id == role_id for role in user.roles):
-            return tier_num
-    return None
+    return get_member_eligibility(user)[0]
+
+# ===================== СОСТАВ VZP =====================
+EMBED_FIELD_LIMIT = 1024
+EMBED_MAX_FIELDS = 25
+EMBED_TOTAL_BUDGET = 5500  # Лимит Discord 6000 символов на сообщение, запас под подвал
+
+# vzp_id -> игроки по тирам в порядке записи и замены. Страницы состава рисуются из индекса по запросу,
+# сбрасывается он при каждом изменении состава (все они заканчиваются update_vzp_message)
+roster_index: Dict[str, Dict] = {}
+
+def get_roster_index(vzp_id: str) -> Dict:
+    index = roster_index.get(vzp_id)
+    if index is None:
+        vzp_data = active_vzp[vzp_id]
+        tiers = {1: [], 2: [], 3: []}
+        for user_id, tier in vzp_data.plus_users.items():
+            tiers[tier].append(user_id)
+        index = roster_index[vzp_id] = {
+            "tiers": tiers,
+            "entries": [(tier, user_id) for tier in (1, 2, 3) for user_id in tiers[tier]],
+            "swaps": list(swap_history.get(vzp_id, {}).items())
+        }
+    return index
+
+def invalidate_roster(vzp_id: str):
+    roster_index.pop(vzp_id, None)
+
+def render_roster_page(vzp_id: str, page: int) -> Tuple[discord.Embed, int, int]:
+    """Страница полного состава: (embed, номер страницы после ограничения, всего страниц)"""
+    vzp_data = active_vzp[vzp_id]
+    index = get_roster_index(vzp_id)
+    entries, swaps = index["entries"], index["swaps"]
+    total = len(entries) + len(swaps)
+    pages = max(1, math.ceil(total / ROSTER_PAGE_SIZE))
+    page = max(0, min(page, pages - 1))
+    
+    lines = []
+    for number in range(page * ROSTER_PAGE_SIZE, min((page + 1) * ROSTER_PAGE_SIZE, total)):
+        if number < len(entries):
+            tier, user_id = entries[number]
+            lines.append(f"`{number + 1}.` {member_mention(vzp_data.guild_id, user_id)} — TIER {tier}")
+        else:
+            old_user_id, new_user_id = swaps[number - len(entries)]
+            lines.append(f"🔄 {member_mention(vzp_data.guild_id, new_user_id)} → {member_mention(vzp_data.guild_id, old_user_id)}")
+    
+    counts = " | ".join(f"T{tier}: {len(index['tiers'][tier])}" for tier in (1, 2, 3))
+    embed = discord.Embed(
+        title=f"СОСТАВ VZP {vzp_id}",
+        description="\n".join(lines) if lines else "—",
+        color=discord.Color.blue()
+    )
+    embed.set_footer(text=f"Страница {page + 1}/{pages} • {len(vzp_data.plus_users)}/{vzp_data.members} • {counts} • Замен: {len(swaps)}")
+    return embed, page, pages
+
+class RosterPageView(ui.View):
+    def __init__(self, vzp_id: str):
+        super().__init__(timeout=300)
+        self.vzp_id = vzp_id
+        self.page = 0
+        
+        self.previous_button = ui.Button(style=ButtonStyle.gray, emoji="◀️")
+        self.previous_button.callback = lambda interaction: self.turn(interaction, -1)
+        self.add_item(self.previous_button)
+        
+        self.next_button = ui.Button(style=ButtonStyle.gray, emoji="▶️")
+        self.next_button.callback = lambda interaction: self.turn(interaction, 1)
+        self.add_item(self.next_button)
+    
+    def render(self) -> discord.Embed:
+        embed, self.page, pages = render_roster_page(self.vzp_id, self.page)
+        self.previous_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= pages - 1
+        return embed
+    
+    async def turn(self, interaction: discord.Interaction, step: int):
+        start_trace(interaction, "button", "vzp_roster_page")
+        if self.vzp_id not in active_vzp:
+            await interaction.response.edit_message(content="Эта VZP больше не активна!", embed=None, view=None)
+            return
+        self.page += step
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+async def handle_roster_button(interaction: discord.Interaction, vzp_id: str):
+    if vzp_id not in active_vzp:
+        await interaction.response.send_message(
+            "Эта VZP больше не активна!",
+            ephemeral=True
+        )
+        return
+    
+    view = RosterPageView(vzp_id)
+    await interaction.response.send_message(embed=view.render(), view=view, ephemeral=True)
+
+def chunk_lines(lines: List[str], limit: int = EMBED_FIELD_LIMIT) -> List[str]:
+    """Склеивает строки в куски не длиннее limit символов, не разрывая строки"""
+    chunks, current, size = [], [], 0
+    for line in lines:
+        if current and size + len(line) + 1 > limit:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def add_field_split(embeds: List[discord.Embed], name: str, value: str, continuation: Callable[[], discord.Embed]):
+    """Добавляет поле в последний embed, а если тот упёрся в лимиты Discord - в новый из continuation()"""
+    embed = embeds[-1]
+    if len(embed.fields) >= EMBED_MAX_FIELDS or len(embed) + len(name) + len(value) > EMBED_TOTAL_BUDGET:
+        embed = continuation()
+        embeds.append(embed)
+    embed.add_field(name=name, value=value, inline=False)
 
 async def create_vzp_embed(vzp_id: str, vzp_data: VZPData) -> discord.Embed:
     status_colors = {
@@ -267,18 +1465,16 @@ async def create_vzp_embed(vzp_id: str, vzp_data: VZPData) -> discord.Embed:
     
     embed = discord.Embed(description=description, color=color)
     
-    tier_lists = {1: [], 2: [], 3: []}
-    for user_id, tier in vzp_data.plus_users.items():
-        tier_lists[tier].append(user_id)
+    # В сообщении только счётчики и первые игроки тиров, полный состав - кнопкой СОСТАВ
+    index = get_roster_index(vzp_id)
+    tier_lists = index["tiers"]
+    truncated = False
     
     for tier_num in [1, 2, 3]:
-        members_list = []
-        for user_id in tier_lists[tier_num]:
-            member = bot.get_guild(interaction.guild.id).get_member(user_id) if 'interaction' in locals() else None
-            if member:
-                members_list.append(f"• {member.mention}")
-            else:
-                members_list.append(f"• <@{user_id}>")
+        members_list = [f"• {member_mention(vzp_data.guild_id, user_id)}" for user_id in tier_lists[tier_num][:ROSTER_PREVIEW]]
+        if len(tier_lists[tier_num]) > ROSTER_PREVIEW:
+            members_list.append(f"…и ещё {len(tier_lists[tier_num]) - ROSTER_PREVIEW}")
+            truncated = True
         
         tier_name = {1: "TIER 1", 2: "TIER 2", 3: "TIER 3"}[tier_num]
         embed.add_field(
@@ -287,22 +1483,22 @@ async def create_vzp_embed(vzp_id: str, vzp_data: VZPData) -> discord.Embed:
             inline=False
         )
     
-    vzp_swaps = swap_history.get(vzp_id, {})
+    vzp_swaps = index["swaps"]
     if vzp_swaps:
         swap_list = []
-        for old_user_id, new_user_id in vzp_swaps.items():
-            old_member = bot.get_guild(interaction.guild.id).get_member(old_user_id) if 'interaction' in locals() else None
-            new_member = bot.get_guild(interaction.guild.id).get_member(new_user_id) if 'interaction' in locals() else None
-            
-            old_name = old_member.mention if old_member else f"<@{old_user_id}>"
-            new_name = new_member.mention if new_member else f"<@{new_user_id}>"
-            swap_list.append(f"• {new_name} → {old_name}")
+        for old_user_id, new_user_id in vzp_swaps[:ROSTER_PREVIEW]:
+            swap_list.append(f"• {member_mention(vzp_data.guild_id, new_user_id)} → {member_mention(vzp_data.guild_id, old_user_id)}")
+        if len(vzp_swaps) > ROSTER_PREVIEW:
+            swap_list.append(f"…и ещё {len(vzp_swaps) - ROSTER_PREVIEW}")
+            truncated = True
         
         if swap_list:
-            embed.add_field(name="**SWAP**", value="\n".join(swap_list), inline=False)
+            embed.add_field(name=f"**SWAP** ({len(vzp_swaps)})", value="\n".join(swap_list), inline=False)
     
     embed.add_field(name="**STATUS**", value=f"```{vzp_data.status}```", inline=False)
     embed.add_field(name="**ID**", value=f"```{vzp_id}```", inline=False)
+    if truncated:
+        embed.set_footer(text="📋 Полный состав - кнопка СОСТАВ")
     
     return embed
 
@@ -311,6 +1507,7 @@ async def update_vzp_message(vzp_id: str):
         return
     
     vzp_data = active_vzp[vzp_id]
+    invalidate_roster(vzp_id)
     
     try:
         channel = bot.get_channel(vzp_data.channel_id)
@@ -320,16 +1517,19 @@ async def update_vzp_message(vzp_id: str):
         message = await channel.fetch_message(vzp_data.message_id)
         embed = await create_vzp_embed(vzp_id, vzp_data)
         
-        view = None
-        if vzp_data.status == 'OPEN':
-            view = VZPView(vzp_id)
-        
-        await message.edit(embed=embed, view=view)
+        # Кнопки меняются только со сменой статуса, обычное обновление состава редактирует один embed
+        buttons = vzp_buttons(vzp_data.status)
+        if buttons == vzp_data.buttons:
+            await message.edit(embed=embed)
+        else:
+            await message.edit(embed=embed, view=vzp_view(vzp_id, buttons))
+            vzp_data.buttons = buttons
     
     except discord.NotFound:
-        print(f"Сообщение VZP {vzp_id} не найдено")
+        vzp_messages_gone.add(vzp_id)
+        log.warning(f"Сообщение VZP {vzp_id} не найдено", extra={"vzp_id": vzp_id})
     except Exception as e:
-        print(f"Ошибка обновления VZP {vzp_id}: {e}")
+        log.exception(f"Ошибка обновления VZP {vzp_id}: {e}", extra={"vzp_id": vzp_id})
 
 async def update_position_message(pos_id: str):
     if pos_id not in position_messages:
@@ -392,9 +1592,9 @@ async def update_position_message(pos_id: str):
         embed.set_footer(text="Автоматическое обновление")
         
         await message.edit(embed=embed)
-        save_data()
+        save_data(msg_info.get("guild_id"))
     except Exception as e:
-        print(f"Ошибка обновления позиций: {e}")
+        log.exception(f"Ошибка обновления позиций: {e}", extra={"pos_id": pos_id})
 
 async def send_position_notification(channel: discord.TextChannel, message_id: int, user_id: int, content: str):
     """Отправляет уведомление о записи/отмене в канал, но только для указанного пользователя"""
@@ -406,8 +1606,8 @@ async def send_position_notification(channel: discord.TextChannel, message_id: i
                     old_msg_id = user_notification_messages[str(message_id)][user_id]
                     old_msg = await channel.fetch_message(old_msg_id)
                     await old_msg.delete()
-                except:
-                    pass
+                except discord.HTTPException as e:
+                    log.debug(f"Старое уведомление уже удалено: {e}", extra={"user_id": user_id})
         
         # Отправляем новое сообщение
         msg = await channel.send(content)
@@ -417,22 +1617,12 @@ async def send_position_notification(channel: discord.TextChannel, message_id: i
             user_notification_messages[str(message_id)] = {}
         user_notification_messages[str(message_id)][user_id] = msg.id
         
-        # Удаляем сообщение через 5 секунд
-        await asyncio.sleep(5)
-        try:
-            await msg.delete()
-        except:
-            pass
-        
-        # Удаляем из сохраненных данных
-        if str(message_id) in user_notification_messages and user_id in user_notification_messages[str(message_id)]:
-            del user_notification_messages[str(message_id)][user_id]
-            if not user_notification_messages[str(message_id)]:
-                del user_notification_messages[str(message_id)]
-        
-        save_data()
+        # Удаление через POSITION_NOTICE_SECONDS - задача планировщика, а не спящая корутина
+        # После перезапуска зависшие уведомления удалит очистка состояния, сохранять задачу незачем
+        schedule_job("position_notice_expire", time_module.time() + POSITION_NOTICE_SECONDS, channel.guild.id, persist=False,
+                     channel_id=channel.id, board_message_id=message_id, user_id=user_id, message_id=msg.id)
     except Exception as e:
-        print(f"Ошибка отправки уведомления: {e}")
+        log.exception(f"Ошибка отправки уведомления: {e}", extra={"user_id": user_id})
 
 async def handle_vzp_button(interaction: discord.Interaction, vzp_id: str):
     if vzp_id not in active_vzp:
@@ -468,9 +1658,10 @@ async def handle_vzp_button(interaction: discord.Interaction, vzp_id: str):
         )
         return
     
-    if len(vzp_data.plus_users) >= MAX_PARTICIPANTS_PER_VZP:
+    max_participants = get_guild_config(vzp_data.guild_id).max_participants
+    if len(vzp_data.plus_users) >= max_participants:
         await interaction.response.send_message(
-            f"Достигнут максимальный лимит участников ({MAX_PARTICIPANTS_PER_VZP})!",
+            f"Достигнут максимальный лимит участников ({max_participants})!",
             ephemeral=True
         )
         return
@@ -483,7 +1674,7 @@ async def handle_vzp_button(interaction: discord.Interaction, vzp_id: str):
         vzp_data.plus_users[user.id] = tier
 
     await update_vzp_message(vzp_id)
-    save_data()
+    save_data(vzp_data.guild_id)
     
     if is_in_list:
         await interaction.response.send_message("Вы удалились из списка VZP!", ephemeral=True)
@@ -498,22 +1689,16 @@ async def notify_users_ls(vzp_id: str, title: str, message: str, guild: discord.
     notified = 0
     
     target_ids = user_ids if user_ids else set(vzp_data.plus_users.keys())
+    members = await resolve_members(guild, target_ids)
     
-    for user_id in target_ids:
-        member = guild.get_member(user_id)
-        if member:
-            try:
-                embed = discord.Embed(title=title, description=message, color=discord.Color.blue())
-                embed.add_field(name="VZP ID", value=vzp_id, inline=False)
-                embed.add_field(name="Время", value=vzp_data.time, inline=True)
-                embed.set_footer(text="VZP Manager")
-                
-                await member.send(embed=embed)
-                notified += 1
-            except:
-                pass
-            
-            await asyncio.sleep(0.1)
+    for member in members.values():
+        embed = discord.Embed(title=title, description=message, color=discord.Color.blue())
+        embed.add_field(name="VZP ID", value=vzp_id, inline=False)
+        embed.add_field(name="Время", value=vzp_data.time, inline=True)
+        embed.set_footer(text="VZP Manager")
+        
+        if await send_dm(member, embed=embed):
+            notified += 1
     
     return notified
 
@@ -522,10 +1707,11 @@ async def post_vzp_result(vzp_id: str, result: str, amount: int, guild: discord.
         return
     
     vzp_data = active_vzp[vzp_id]
-    stats_channel = guild.get_channel(STATS_CHANNEL)
+    stats_channel_id = get_guild_config(guild.id).stats_channel
+    stats_channel = guild.get_channel(stats_channel_id)
     
     if not stats_channel or not isinstance(stats_channel, discord.TextChannel):
-        print(f"❌ Канал статистики {STATS_CHANNEL} не найден!")
+        log.error(f"❌ Канал статистики {stats_channel_id} не найден!", extra={"guild_id": guild.id})
         return
     
     all_players = set(vzp_data.plus_users.keys())
@@ -534,13 +1720,8 @@ async def post_vzp_result(vzp_id: str, result: str, amount: int, guild: discord.
     for new_user_id in vzp_swaps.values():
         all_players.add(new_user_id)
     
-    players_list = []
-    for i, user_id in enumerate(sorted(all_players), 1):
-        member = guild.get_member(user_id)
-        if member:
-            players_list.append(f"{i} - {member.mention}")
-        else:
-            players_list.append(f"{i} - <@{user_id}>")
+    await resolve_members(guild, all_players | set(vzp_swaps.keys()))
+    players_list = [f"{i} - {member_mention(guild.id, user_id)}" for i, user_id in enumerate(sorted(all_players), 1)]
     
     result_display = result.upper()
     result_info = {
@@ -571,52 +1752,1253 @@ async def post_vzp_result(vzp_id: str, result: str, amount: int, guild: discord.
         inline=False
     )
     
+    # Большой состав не влезает в один embed: поля переносятся в продолжения, каждое отдельным сообщением
+    embeds = [embed]
+    continuation = lambda: discord.Embed(
+        title=f"VZP РЕЗУЛЬТАТ: {result_info['title']} (продолжение)",
+        color=result_info['color']
+    )
+    
     if players_list:
-        players_text = "\n".join(players_list)
-        
-        if len(players_text) > 1024:
-            chunk_size = 20
-            chunks = [players_list[i:i + chunk_size] for i in range(0, len(players_list), chunk_size)]
-            
-            for i, chunk in enumerate(chunks, 1):
-                chunk_text = "\n".join(chunk)
-                embed.add_field(
-                    name=f"👥 УЧАСТНИКИ (часть {i})",
-                    value=chunk_text,
-                    inline=False
-                )
-        else:
-            embed.add_field(
-                name="👥 УЧАСТНИКИ",
-                value=players_text,
-                inline=False
-            )
+        chunks = chunk_lines(players_list)
+        for i, chunk in enumerate(chunks, 1):
+            add_field_split(embeds, f"👥 УЧАСТНИКИ (часть {i})" if len(chunks) > 1 else "👥 УЧАСТНИКИ", chunk, continuation)
     
     if vzp_swaps:
         swap_info = []
         for old_user_id, new_user_id in vzp_swaps.items():
-            old_member = guild.get_member(old_user_id)
-            new_member = guild.get_member(new_user_id)
-            
-            old_name = old_member.display_name if old_member else f"ID:{old_user_id}"
-            new_name = new_member.display_name if new_member else f"ID:{new_user_id}"
-            swap_info.append(f"• {new_name} заменил {old_name}")
+            swap_info.append(f"• {member_name(guild.id, new_user_id)} заменил {member_name(guild.id, old_user_id)}")
         
-        if swap_info:
-            embed.add_field(
-                name="🔄 ЗАМЕНЫ",
-                value="\n".join(swap_info),
-                inline=False
-            )
-    
-    embed.set_footer(text=f"VZP ID: {vzp_id} | {datetime.now().strftime('%d.%m.%Y %H:%M')}")
+        for chunk in chunk_lines(swap_info):
+            add_field_split(embeds, "🔄 ЗАМЕНЫ", chunk, continuation)
     
-    await stats_channel.send(embed=embed)
+    footer = f"VZP ID: {vzp_id} | {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+    for i, part in enumerate(embeds, 1):
+        part.set_footer(text=f"{footer} | {i}/{len(embeds)}" if len(embeds) > 1 else footer)
+        await stats_channel.send(embed=part)
     
     return len(all_players)
 
-# ===================== ОБРАБОТЧИК СООБЩЕНИЙ =====================
-@bot.event
+# ===================== ПУЛ КАТЕГОРИЙ VZP =====================
+# Свой замок на каждый сервер: подготовка категорий одного сервера не задерживает запуск VZP на другом
+category_pool_locks: Dict[int, asyncio.Lock] = {}
+
+# Категории, которые сейчас возвращаются в пул: у них уже резервное имя, но записи в пуле ещё нет
+recycling_categories: Set[int] = set()
+
+def category_pool_lock(guild_id: int) -> asyncio.Lock:
+    lock = category_pool_locks.get(guild_id)
+    if lock is None:
+        lock = category_pool_locks[guild_id] = asyncio.Lock()
+    return lock
+
+def pool_overwrites(guild: discord.Guild) -> Dict:
+    return {
+        guild.default_role: discord.PermissionOverwrite(view_channel=False),
+        guild.me: discord.PermissionOverwrite(view_channel=True)
+    }
+
+def guild_pool_entries(guild_id: int) -> List[int]:
+    return [cat_id for cat_id, entry in category_pool.items() if entry.get("guild_id") == guild_id]
+
+def find_vzp_channels(category: discord.CategoryChannel):
+    """Возвращает (voice, flood, call) каналы категории VZP или None, если какого-то не хватает"""
+    voice = next((ch for ch in category.voice_channels if ch.name == "vzp voice"), None)
+    flood = next((ch for ch in category.text_channels if ch.name == "vzp flood"), None)
+    call = next((ch for ch in category.text_channels if ch.name == "vzp call"), None)
+    if not voice or not flood or not call:
+        return None
+    return voice, flood, call
+
+async def delete_channel_with_retry(channel: discord.abc.GuildChannel) -> bool:
+    for attempt in range(TEARDOWN_RETRIES):
+        try:
+            await channel.delete()
+            return True
+        except discord.NotFound:
+            return True
+        except discord.HTTPException as e:
+            if attempt == TEARDOWN_RETRIES - 1:
+                log.warning(f"⚠️ Не удалось удалить канал {channel.id}: {e}")
+                return False
+            await asyncio.sleep(2 ** attempt)
+    return False
+
+async def delete_category_with_channels(category: discord.CategoryChannel) -> bool:
+    """Удаляет каналы категории параллельно, затем саму категорию. True - всё удалено"""
+    results = await asyncio.gather(*(delete_channel_with_retry(ch) for ch in category.channels))
+    if not all(results):
+        return False
+    return await delete_channel_with_retry(category)
+
+async def provision_pool_category(guild: discord.Guild):
+    category = await guild.create_category_channel(
+        name=POOL_CATEGORY_NAME,
+        overwrites=pool_overwrites(guild)
+    )
+    voice_channel = await category.create_voice_channel(name="vzp voice")
+    flood_channel = await category.create_text_channel(name="vzp flood")
+    call_channel = await category.create_text_channel(name="vzp call")
+    
+    category_pool[category.id] = {
+        "guild_id": guild.id,
+        "voice_id": voice_channel.id,
+        "flood_id": flood_channel.id,
+        "call_id": call_channel.id,
+        "created_at": datetime.now().isoformat()
+    }
+
+async def cleanup_category_pool(guild: discord.Guild) -> int:
+    """Удаляет устаревшие, повреждённые и лишние запасные категории под category_pool_lock сервера.
+    Вызывается при подготовке пула и периодически из очистки состояния"""
+    removed = 0
+    now = datetime.now()
+    kept = 0
+    
+    async with category_pool_lock(guild.id):
+        for cat_id in guild_pool_entries(guild.id):
+            entry = category_pool[cat_id]
+            category = guild.get_channel(cat_id)
+            age_hours = (now - datetime.fromisoformat(entry["created_at"])).total_seconds() / 3600
+            
+            broken = not isinstance(category, discord.CategoryChannel) or find_vzp_channels(category) is None
+            if broken or age_hours > CATEGORY_POOL_TTL_HOURS or kept >= CATEGORY_POOL_SIZE:
+                del category_pool[cat_id]
+                if category:
+                    await delete_category_with_channels(category)
+                removed += 1
+            else:
+                kept += 1
+        
+        # Резервные категории, о которых бот забыл (например, после потери файла пула)
+        for category in guild.categories:
+            if (category.name == POOL_CATEGORY_NAME and category.id not in category_pool
+                    and category.id not in recycling_categories):
+                await delete_category_with_channels(category)
+                removed += 1
+    
+    return removed
+
+async def warm_category_pool(guild: discord.Guild):
+    if CATEGORY_POOL_SIZE <= 0:
+        return
+    
+    try:
+        removed = await cleanup_category_pool(guild)
+        created = 0
+        async with category_pool_lock(guild.id):
+            while len(guild_pool_entries(guild.id)) < CATEGORY_POOL_SIZE:
+                await provision_pool_category(guild)
+                created += 1
+        
+        if removed or created:
+            save_data(guild.id)
+            log.info(f"♻️ Пул категорий: создано {created}, удалено устаревших {removed}")
+    except Exception as e:
+        log.exception(f"❌ Ошибка подготовки пула категорий: {e}")
+
+def schedule_pool_warmup(guild: discord.Guild):
+    if CATEGORY_POOL_SIZE > 0:
+        run_in_background(warm_category_pool(guild))
+
+async def acquire_pool_category(guild: discord.Guild, vzp_id: str, overwrites: Dict):
+    """Берёт готовую категорию из пула, переименовывает её и выдаёт доступ составу.
+    Возвращает (category, (voice, flood, call)) или None, если пул пуст"""
+    async with category_pool_lock(guild.id):
+        for cat_id in guild_pool_entries(guild.id):
+            del category_pool[cat_id]
+            category = guild.get_channel(cat_id)
+            if not isinstance(category, discord.CategoryChannel):
+                continue
+            
+            channels = find_vzp_channels(category)
+            if channels is None:
+                run_in_background(delete_category_with_channels(category))
+                continue
+            
+            try:
+                await category.edit(name=f"VZP ID - {vzp_id}", overwrites=overwrites)
+                # Права каналов копируем явно: кэш категории обновится только по событию шлюза
+                await asyncio.gather(*(ch.edit(overwrites=overwrites) for ch in category.channels))
+            except discord.HTTPException as e:
+                log.warning(f"⚠️ Не удалось подготовить категорию из пула: {e}")
+                run_in_background(delete_category_with_channels(category))
+                continue
+            
+            return category, channels
+    
+    return None
+
+async def recycle_vzp_category(guild: discord.Guild, category: discord.CategoryChannel) -> bool:
+    """Возвращает категорию закрытой VZP в пул вместо удаления. False - категорию нужно удалить.
+    Подготовка идёт без замка пула: под ним только проверка места и запись в пул, чтобы закрытие
+    VZP не задерживало /start_vzp на этом сервере"""
+    if CATEGORY_POOL_SIZE <= 0 or len(guild_pool_entries(guild.id)) >= CATEGORY_POOL_SIZE:
+        return False
+    
+    channels = find_vzp_channels(category)
+    if channels is None:
+        return False
+    voice_channel, flood_channel, call_channel = channels
+    
+    # Пока категория переделывается, очистка пула не должна принять её за забытую резервную
+    recycling_categories.add(category.id)
+    try:
+        try:
+            for member in list(voice_channel.members):
+                await disconnect_from_voice(member)
+            
+            # Каналы, созданные вручную во время VZP, в пул не берём
+            extra = [ch for ch in category.channels if ch not in channels]
+            await asyncio.gather(*(ch.delete() for ch in extra))
+            
+            overwrites = pool_overwrites(guild)
+            await category.edit(name=POOL_CATEGORY_NAME, overwrites=overwrites)
+            await voice_channel.edit(overwrites=overwrites)
+            # Текстовые каналы пересоздаём: purge большой истории удаляет старые сообщения по одному запросу
+            await asyncio.gather(flood_channel.delete(), call_channel.delete())
+            flood_channel = await category.create_text_channel(name="vzp flood", overwrites=overwrites)
+            call_channel = await category.create_text_channel(name="vzp call", overwrites=overwrites)
+        except discord.HTTPException as e:
+            log.warning(f"⚠️ Не удалось вернуть категорию {category.id} в пул: {e}")
+            return False
+        
+        async with category_pool_lock(guild.id):
+            if len(guild_pool_entries(guild.id)) >= CATEGORY_POOL_SIZE:
+                return False
+            
+            category_pool[category.id] = {
+                "guild_id": guild.id,
+                "voice_id": voice_channel.id,
+                "flood_id": flood_channel.id,
+                "call_id": call_channel.id,
+                "created_at": datetime.now().isoformat()
+            }
+    finally:
+        recycling_categories.discard(category.id)
+    
+    return True
+
+# ===================== ФОНОВОЕ УДАЛЕНИЕ КАТЕГОРИЙ =====================
+async def teardown_vzp_category(guild: discord.Guild, category_id: int, vzp_id: str):
+    category = guild.get_channel(category_id)
+    
+    if not isinstance(category, discord.CategoryChannel):
+        done = True
+    elif await recycle_vzp_category(guild, category):
+        log.info(f"♻️ Категория VZP {vzp_id} возвращена в пул")
+        done = True
+    else:
+        done = await delete_category_with_channels(category)
+    
+    if done:
+        if pending_category_cleanup.pop(category_id, None) is not None or category_id in category_pool:
+            save_data(guild.id)
+        return
+    
+    entry = pending_category_cleanup.setdefault(category_id, {
+        "guild_id": guild.id,
+        "vzp_id": vzp_id,
+        "attempts": 0
+    })
+    entry["attempts"] += 1
+    entry["failed_at"] = datetime.now().isoformat()
+    if entry["attempts"] < CLEANUP_MAX_ATTEMPTS:
+        schedule_job("category_cleanup", time_module.time() + CLEANUP_RETRY_MINUTES * 60, guild.id,
+                     category_id=category_id, vzp_id=vzp_id)
+    save_data(guild.id)
+    log.warning(f"⚠️ Категория VZP {vzp_id} не удалена, повтор через {CLEANUP_RETRY_MINUTES} мин")
+
+def schedule_category_teardown(guild: discord.Guild, category_id: int, vzp_id: str):
+    run_in_background(teardown_vzp_category(guild, category_id, vzp_id))
+
+def retry_pending_cleanup():
+    for category_id, entry in list(pending_category_cleanup.items()):
+        guild = bot.get_guild(entry["guild_id"])
+        if guild:
+            schedule_category_teardown(guild, category_id, entry["vzp_id"])
+
+# ===================== ВРЕМЕННЫЕ РОЛИ VZP =====================
+pending_role_changes: Dict[int, Dict[int, bool]] = {}
+
+async def grant_vzp_role(role: discord.Role, members: List[discord.Member]):
+    results = await asyncio.gather(
+        *(member.add_roles(role, reason="Участник VZP") for member in members),
+        return_exceptions=True
+    )
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    if failed:
+        log.warning(f"⚠️ Не удалось выдать роль {role.name} {failed} игрокам")
+
+def queue_role_change(guild: discord.Guild, role_id: int, member_id: int, add: bool):
+    """Ставит выдачу/снятие роли в пачку. Повторное изменение того же игрока перезаписывает предыдущее"""
+    batch = pending_role_changes.get(role_id)
+    if batch is None:
+        batch = pending_role_changes[role_id] = {}
+        run_in_background(flush_role_changes(guild, role_id))
+    batch[member_id] = add
+
+async def flush_role_changes(guild: discord.Guild, role_id: int):
+    await asyncio.sleep(ROLE_BATCH_DELAY)
+    batch = pending_role_changes.pop(role_id, {})
+    
+    role = guild.get_role(role_id)
+    if not role or not batch:
+        return
+    
+    calls = []
+    for member_id, add in batch.items():
+        member = guild.get_member(member_id)
+        if not member:
+            continue
+        if add and role not in member.roles:
+            calls.append(member.add_roles(role, reason="Изменение состава VZP"))
+        elif not add and role in member.roles:
+            calls.append(member.remove_roles(role, reason="Изменение состава VZP"))
+    
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    if failed:
+        log.warning(f"⚠️ Не удалось изменить роль {role.name} у {failed} игроков")
+
+async def delete_vzp_role(guild: discord.Guild, role_id: int):
+    pending_role_changes.pop(role_id, None)
+    role = guild.get_role(role_id)
+    if not role:
+        return
+    try:
+        await role.delete(reason="VZP закрыта")
+    except discord.HTTPException as e:
+        log.warning(f"⚠️ Не удалось удалить роль VZP {role_id}: {e}")
+
+# ===================== ТАБЛИЦЫ ЛИДЕРОВ =====================
+def format_leaderboard(guild_id: int, window: str, metric: str) -> str:
+    top = get_leaderboard_top(guild_id, window, metric)
+    if not top:
+        return "—"
+    return "\n".join(f"{i}. {member_mention(guild_id, user_id)} — **{value}**" for i, (user_id, value) in enumerate(top, 1))
+
+def create_leaderboard_embed(guild_id: int) -> discord.Embed:
+    embed = discord.Embed(
+        title="🏆 ТАБЛИЦА ЛИДЕРОВ VZP",
+        color=discord.Color.gold(),
+        timestamp=datetime.now()
+    )
+    for window in ('all', 'week'):
+        for metric, metric_name in LEADERBOARD_METRICS.items():
+            embed.add_field(
+                name=f"{metric_name} ({LEADERBOARD_WINDOWS[window].lower()})",
+                value=format_leaderboard(guild_id, window, metric),
+                inline=True
+            )
+    embed.set_footer(text="Обновляется автоматически после каждой VZP и в начале недели")
+    return embed
+
+async def refresh_leaderboard_message(guild: discord.Guild):
+    """Редактирует закреплённую таблицу лидеров в канале статистики, при необходимости создаёт её заново"""
+    stats_channel = guild.get_channel(get_guild_config(guild.id).stats_channel)
+    if not isinstance(stats_channel, discord.TextChannel):
+        return
+    
+    embed = create_leaderboard_embed(guild.id)
+    pinned = leaderboard_message.setdefault(guild.id, {})
+    message_id = pinned.get('message_id')
+    
+    if message_id and pinned.get('channel_id') == stats_channel.id:
+        try:
+            await stats_channel.get_partial_message(message_id).edit(embed=embed)
+            schedule_leaderboard_rollover(guild.id)
+            return
+        except discord.NotFound:
+            pass
+        except discord.HTTPException as e:
+            log.warning(f"⚠️ Ошибка обновления таблицы лидеров: {e}")
+            return
+    
+    try:
+        message = await stats_channel.send(embed=embed)
+        await message.pin()
+    except discord.HTTPException as e:
+        log.warning(f"⚠️ Ошибка публикации таблицы лидеров: {e}")
+        return
+    
+    pinned['channel_id'] = stats_channel.id
+    pinned['message_id'] = message.id
+    schedule_leaderboard_rollover(guild.id)
+    save_data(guild.id)
+
+# ===================== ВЫГРУЗКА ИСТОРИИ =====================
+def parse_export_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.strptime(value.strip(), '%d.%m.%Y')
+
+def load_closed_records(path: str = DATA_FILE) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('closed', {})
+
+def iter_export_rows(records, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                     enemy: Optional[str] = None, result: Optional[str] = None):
+    """Генератор строк выгрузки по закрытым VZP. records - итерируемые пары (vzp_id, запись)"""
+    enemy = enemy.lower() if enemy else None
+    
+    for vzp_id, record in records:
+        closed_at = record.get('closed_at')
+        if date_from or date_to:
+            if not closed_at:
+                continue
+            closed_date = datetime.fromisoformat(closed_at).date()
+            if date_from and closed_date < date_from.date():
+                continue
+            if date_to and closed_date > date_to.date():
+                continue
+        if enemy and enemy not in (record.get('enemy') or '').lower():
+            continue
+        if result and record.get('result') != result:
+            continue
+        
+        yield {
+            'vzp_id': vzp_id,
+            'closed_at': closed_at,
+            'time': record.get('time'),
+            'enemy': record.get('enemy'),
+            'result': record.get('result'),
+            'amount': record.get('amount'),
+            'members': record.get('members'),
+            'participants': record.get('participants'),
+            'all_participants': record.get('all_participants'),
+            'roster': {int(user_id): tier for user_id, tier in (record.get('roster') or {}).items()},
+            'swaps': {int(old_id): new_id for old_id, new_id in (record.get('swaps') or {}).items()}
+        }
+
+def write_export(rows, fmt: str, fileobj) -> int:
+    """Пишет строки по одной, не собирая выгрузку целиком. Возвращает количество VZP"""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(fileobj, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            row['roster'] = ' '.join(f"{user_id}:{tier}" for user_id, tier in row['roster'].items())
+            row['swaps'] = ' '.join(f"{old_id}>{new_id}" for old_id, new_id in row['swaps'].items())
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            fileobj.write(json.dumps(row, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+def export_to_file(rows, fmt: str, path: str, compress: bool = False) -> Tuple[str, int]:
+    """Выгружает в файл и сжимает его gzip, если попросили или файл слишком велик для вложения"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        count = write_export(rows, fmt, f)
+    
+    if compress or os.path.getsize(path) > EXPORT_COMPRESS_BYTES:
+        with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+        path += '.gz'
+    
+    return path, count
+
+# ===================== ГОЛОСОВАЯ ПОСЕЩАЕМОСТЬ =====================
+def vzp_id_for_category(category_id: Optional[int]) -> Optional[str]:
+    if category_id is None:
+        return None
+    for vzp_id, vzp_data in active_vzp.items():
+        if vzp_data.category_id == category_id and vzp_data.status == 'VZP IN PROCESS':
+            return vzp_id
+    return None
+
+def open_voice_interval(vzp_id: str, user_id: int, timestamp: float):
+    intervals = voice_sessions.setdefault(vzp_id, {}).setdefault(user_id, [])
+    if not intervals or intervals[-1][1] is not None:
+        intervals.append([timestamp, None])
+
+def close_voice_interval(vzp_id: str, user_id: int, timestamp: float):
+    intervals = voice_sessions.get(vzp_id, {}).get(user_id)
+    if intervals and intervals[-1][1] is None:
+        intervals[-1][1] = timestamp
+
+def voice_presence(vzp_id: str) -> Set[int]:
+    """Кто сейчас в голосовых каналах VZP - по журналу, без обхода каналов"""
+    return {
+        user_id for user_id, intervals in voice_sessions.get(vzp_id, {}).items()
+        if intervals and intervals[-1][1] is None
+    }
+
+def voice_seconds(vzp_id: str, until: Optional[float] = None) -> Dict[int, int]:
+    until = until or time_module.time()
+    return {
+        user_id: int(sum((leave or until) - join for join, leave in intervals))
+        for user_id, intervals in voice_sessions.get(vzp_id, {}).items()
+    }
+
+def finish_voice_sessions(vzp_id: str) -> Dict[int, int]:
+    """Закрывает журнал VZP и возвращает секунды в голосовом по каждому игроку"""
+    totals = voice_seconds(vzp_id)
+    voice_sessions.pop(vzp_id, None)
+    return totals
+
+def reconcile_voice_sessions():
+    """Сверяет журнал с фактическим составом голосовых каналов (после перезапуска события могли потеряться)"""
+    now = time_module.time()
+    for vzp_id, vzp_data in active_vzp.items():
+        if vzp_data.status != 'VZP IN PROCESS' or not vzp_data.category_id:
+            continue
+        category = bot.get_channel(vzp_data.category_id)
+        if not isinstance(category, discord.CategoryChannel):
+            continue
+        
+        in_voice = {member.id for channel in category.voice_channels for member in channel.members}
+        for user_id in voice_presence(vzp_id) - in_voice:
+            close_voice_interval(vzp_id, user_id, now)
+        for user_id in in_voice:
+            open_voice_interval(vzp_id, user_id, now)
+    
+    save_voice_sessions()
+
+@bot.event
+async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    before_category = before.channel.category_id if before.channel else None
+    after_category = after.channel.category_id if after.channel else None
+    if before_category == after_category:
+        return
+    
+    before_vzp = vzp_id_for_category(before_category)
+    after_vzp = vzp_id_for_category(after_category)
+    if not before_vzp and not after_vzp:
+        return
+    
+    now = time_module.time()
+    if before_vzp:
+        close_voice_interval(before_vzp, member.id, now)
+        schedule_voice_board_refresh(before_vzp, [member.id])
+    if after_vzp:
+        open_voice_interval(after_vzp, member.id, now)
+        schedule_voice_board_refresh(after_vzp, [member.id])
+    
+    schedule_voice_save(member.guild.id)
+
+# Серверы с несохранёнными голосовыми событиями: журнал пишется на диск раз в VOICE_SAVE_DELAY секунд
+voice_save_pending: Set[int] = set()
+
+def schedule_voice_save(guild_id: int):
+    if guild_id not in voice_save_pending:
+        voice_save_pending.add(guild_id)
+        run_in_background(flush_voice_save(guild_id))
+
+async def flush_voice_save(guild_id: int):
+    await asyncio.sleep(VOICE_SAVE_DELAY)
+    if guild_id not in voice_save_pending:
+        return  # Журнал уже записан вместе с save_data
+    try:
+        save_voice_sessions(guild_id)
+    except Exception as e:
+        log.error(f"❌ Ошибка сохранения голосового журнала: {e}", extra={"guild_id": guild_id})
+
+def flush_voice_saves():
+    for guild_id in list(voice_save_pending):
+        try:
+            save_voice_sessions(guild_id)
+        except Exception as e:
+            log.error(f"❌ Ошибка сохранения голосового журнала: {e}", extra={"guild_id": guild_id})
+
+# ===================== ПАНЕЛЬ ГОЛОСОВОЙ АКТИВНОСТИ =====================
+# vzp_id -> user_id -> готовая строка панели; пересчитываются только строки изменившихся игроков
+voice_board_lines: Dict[str, Dict[int, str]] = {}
+voice_board_dirty: Dict[str, Set[int]] = {}
+
+def render_voice_board_line(vzp_id: str, user_id: int) -> str:
+    mention = member_mention(active_vzp[vzp_id].guild_id, user_id)
+    intervals = voice_sessions.get(vzp_id, {}).get(user_id, [])
+    if intervals and intervals[-1][1] is None:
+        # Относительное время Discord рисует сам, строку не нужно переписывать каждую минуту
+        return f"{mention} 🟢 с <t:{int(intervals[-1][0])}:R>"
+    minutes = int(sum(leave - join for join, leave in intervals)) // 60
+    return f"{mention} 🔴 {minutes} мин"
+
+def create_voice_board_embed(vzp_id: str) -> discord.Embed:
+    vzp_data = active_vzp[vzp_id]
+    vzp_swaps = swap_history.get(vzp_id, {})
+    all_players = set(vzp_data.plus_users.keys()) | set(vzp_swaps.values())
+    
+    lines = voice_board_lines.setdefault(vzp_id, {})
+    dirty = voice_board_dirty.pop(vzp_id, set())
+    for user_id in list(lines):
+        if user_id not in all_players:
+            del lines[user_id]
+    for user_id in all_players:
+        if user_id in dirty or user_id not in lines:
+            lines[user_id] = render_voice_board_line(vzp_id, user_id)
+    
+    players_in_voice = voice_presence(vzp_id)
+    
+    embed = discord.Embed(
+        title=f"ГОЛОСОВАЯ АКТИВНОСТЬ VZP {vzp_id}",
+        description="▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n\n",
+        color=discord.Color.purple(),
+        timestamp=datetime.now()
+    )
+    
+    embed.add_field(
+        name="ИНФОРМАЦИЯ",
+        value=f"**Участников:** {len(all_players)}\n"
+              f"**В голосовом:** {len(players_in_voice & all_players)}/{len(all_players)}",
+        inline=False
+    )
+    
+    swap_list = []
+    for old_user_id, new_user_id in vzp_swaps.items():
+        status_circle = "🟢" if new_user_id in players_in_voice else "🔴"
+        swap_list.append(f"• {member_mention(vzp_data.guild_id, new_user_id)} {status_circle} → {member_mention(vzp_data.guild_id, old_user_id)}")
+    swap_chunks = chunk_lines(swap_list)
+    swap_text = swap_chunks[0] if swap_chunks else ""
+    
+    # Панель - одно редактируемое сообщение: игроки, не влезшие в лимиты Discord, только считаются
+    players_list = [f"{i} - {lines[user_id]}" for i, user_id in enumerate(sorted(all_players), 1)]
+    chunks = chunk_lines(players_list)
+    reserved = len(swap_text) + 200
+    shown = 0
+    for i, chunk in enumerate(chunks, 1):
+        if len(embed.fields) >= EMBED_MAX_FIELDS - 2 or len(embed) + len(chunk) + reserved > EMBED_TOTAL_BUDGET:
+            break
+        embed.add_field(
+            name=f"👥 УЧАСТНИКИ (часть {i})" if len(chunks) > 1 else "👥 УЧАСТНИКИ",
+            value=chunk,
+            inline=False
+        )
+        shown += chunk.count("\n") + 1
+    if shown < len(players_list):
+        embed.add_field(name="👥 ...", value=f"и ещё {len(players_list) - shown} - полный состав кнопкой СОСТАВ", inline=False)
+    
+    if swap_text:
+        embed.add_field(name="**🔄 ЗАМЕНЫ**", value=swap_text, inline=False)
+    
+    embed.set_footer(text="Обновляется автоматически")
+    return embed
+
+async def post_voice_board(vzp_id: str):
+    vzp_data = active_vzp.get(vzp_id)
+    if not vzp_data or not vzp_data.call_channel_id:
+        return
+    
+    channel = bot.get_channel(vzp_data.call_channel_id)
+    if not channel:
+        return
+    
+    try:
+        message = await channel.send(embed=create_voice_board_embed(vzp_id))
+        vzp_data.voice_board_message_id = message.id
+    except discord.HTTPException as e:
+        log.warning(f"⚠️ Не удалось опубликовать панель голосовой активности VZP {vzp_id}: {e}")
+
+def schedule_voice_board_refresh(vzp_id: str, user_ids=()):
+    """Помечает игроков изменившимися; панель редактируется не чаще раза в VOICE_BOARD_DEBOUNCE секунд"""
+    if vzp_id not in active_vzp or not active_vzp[vzp_id].voice_board_message_id:
+        return
+    
+    pending = vzp_id in voice_board_dirty
+    voice_board_dirty.setdefault(vzp_id, set()).update(user_ids)
+    if not pending:
+        run_in_background(flush_voice_board(vzp_id))
+
+async def flush_voice_board(vzp_id: str):
+    await asyncio.sleep(VOICE_BOARD_DEBOUNCE)
+    
+    vzp_data = active_vzp.get(vzp_id)
+    if not vzp_data or vzp_data.status != 'VZP IN PROCESS':
+        voice_board_dirty.pop(vzp_id, None)
+        voice_board_lines.pop(vzp_id, None)
+        return
+    
+    channel = bot.get_channel(vzp_data.call_channel_id)
+    if not channel:
+        return
+    
+    try:
+        await channel.get_partial_message(vzp_data.voice_board_message_id).edit(embed=create_voice_board_embed(vzp_id))
+    except discord.NotFound:
+        await post_voice_board(vzp_id)
+        save_data(vzp_data.guild_id)
+    except discord.HTTPException as e:
+        log.warning(f"⚠️ Ошибка обновления панели голосовой активности VZP {vzp_id}: {e}")
+
+# ===================== ПЛАНИРОВЩИК =====================
+# Все отложенные действия - задачи в одной куче по времени запуска. Один таймер спит до ближайшей задачи
+# и просыпается раньше, если в очередь встала более ранняя; пустая очередь - таймер завершается.
+# Задачи сохраняются в schedule.json сервера и после перезапуска продолжаются с того же места:
+# опоздавшие дольше grace своего вида пропускаются (напоминание после начала VZP бесполезно).
+# Короткие задачи, которым перезапуск не важен (удаление уведомления через секунды, автопинг), ставятся
+# с persist=False и живут только в памяти - файл не переписывается ради них
+# Файл пишет тот, кто ставит задачу (save_data/save_schedule), и планировщик - один раз, когда её снимает
+schedule_handlers: Dict[str, Tuple[Callable, Optional[float]]] = {}
+scheduler_task: Optional[asyncio.Task] = None
+scheduler_wakeup = asyncio.Event()
+schedule_timezone = ZoneInfo(VZP_TIMEZONE) if VZP_TIMEZONE else None
+
+def scheduled(kind: str, grace: Optional[float] = None):
+    """Регистрирует обработчик задач вида kind; grace - сколько секунд опоздания допустимо, None - без предела"""
+    def register(handler):
+        schedule_handlers[kind] = (handler, grace)
+        return handler
+    return register
+
+def restore_job(job_id: str, job: dict):
+    scheduled_jobs[job_id] = job
+    heapq.heappush(schedule_heap, (job["at"], job_id))
+
+def schedule_job(kind: str, at: float, guild_id: int, persist: bool = True, **args) -> str:
+    job_id = uuid.uuid4().hex[:12]
+    job = {"kind": kind, "at": at, "guild_id": guild_id, "args": args}
+    if not persist:
+        job["persist"] = False
+    restore_job(job_id, job)
+    wake_scheduler()
+    return job_id
+
+def cancel_vzp_jobs(vzp_id: str):
+    for job_id in [job_id for job_id, job in scheduled_jobs.items() if job["args"].get("vzp_id") == vzp_id]:
+        del scheduled_jobs[job_id]
+
+def next_job_delay() -> Optional[float]:
+    """Через сколько секунд наступит ближайшая задача (None - очередь пуста)"""
+    while schedule_heap and schedule_heap[0][1] not in scheduled_jobs:
+        heapq.heappop(schedule_heap)
+    return max(0.0, schedule_heap[0][0] - time_module.time()) if schedule_heap else None
+
+def wake_scheduler():
+    global scheduler_task
+    if scheduler_task is None or scheduler_task.done():
+        scheduler_task = run_in_background(run_scheduler())
+    else:
+        scheduler_wakeup.set()
+
+async def run_scheduler():
+    while True:
+        delay = next_job_delay()
+        if delay is None:
+            return
+        if delay > 0:
+            scheduler_wakeup.clear()
+            try:
+                await asyncio.wait_for(scheduler_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        _, job_id = heapq.heappop(schedule_heap)
+        job = scheduled_jobs.pop(job_id)
+        if job.get("persist", True):
+            save_schedule(job["guild_id"])
+        run_in_background(run_job(job_id, job))
+
+async def run_job(job_id: str, job: dict):
+    kind = job["kind"]
+    handler, grace = schedule_handlers.get(kind, (None, None))
+    if handler is None:
+        log.warning(f"⚠️ Неизвестный вид задачи планировщика: {kind}", extra={"job_id": job_id})
+        return
+    late = time_module.time() - job["at"]
+    if grace is not None and late > grace:
+        SCHEDULED_JOBS.inc(kind, "missed")
+        log.info(f"⏭️ Задача {kind} пропущена: опоздание {late:.0f} с", extra={"job_id": job_id, **job["args"]})
+        return
+    try:
+        with span("scheduled_job", kind=kind, job_id=job_id):
+            await handler(job["guild_id"], **job["args"])
+        SCHEDULED_JOBS.inc(kind, "ok")
+    except Exception as e:
+        SCHEDULED_JOBS.inc(kind, "failed")
+        log.exception(f"❌ Ошибка задачи {kind}: {e}", extra={"job_id": job_id})
+
+def parse_vzp_time(text: str, now: datetime) -> Optional[datetime]:
+    """Время начала VZP из свободного текста ("20:00", "в 20.30"): ближайшее такое время, начиная с часа назад"""
+    match = re.search(r"(\d{1,2})[:.](\d{2})", text)
+    if not match or int(match[1]) > 23 or int(match[2]) > 59:
+        return None
+    start = now.replace(hour=int(match[1]), minute=int(match[2]), second=0, microsecond=0)
+    if start < now - timedelta(hours=1):
+        start += timedelta(days=1)
+    return start
+
+def schedule_vzp_jobs(vzp_id: str, auto_stop: bool, auto_start: bool):
+    vzp_data = active_vzp[vzp_id]
+    now = datetime.now(schedule_timezone)
+    start = parse_vzp_time(vzp_data.time, now)
+    if start is None:
+        log.info(f"⏰ Время VZP {vzp_id} \"{vzp_data.time}\" не распознано, напоминание не запланировано", extra={"vzp_id": vzp_id})
+        return
+    
+    jobs = [("vzp_reminder", start - timedelta(minutes=REMINDER_MINUTES))]
+    if auto_stop:
+        jobs.append(("vzp_auto_stop", start - timedelta(minutes=AUTO_STOP_LEAD_MINUTES)))
+    if auto_start:
+        jobs.append(("vzp_auto_start", start))
+    for kind, at in jobs:
+        if at > now:
+            schedule_job(kind, at.timestamp(), vzp_data.guild_id, vzp_id=vzp_id)
+
+async def announce(vzp_data: VZPData, text: str):
+    channel = bot.get_channel(vzp_data.channel_id)
+    if channel:
+        try:
+            await channel.send(text)
+        except discord.HTTPException as e:
+            log.warning(f"⚠️ Не удалось отправить объявление VZP: {e}")
+
+@scheduled("vzp_reminder", grace=REMINDER_MINUTES * 60)
+async def remind_vzp(guild_id: int, vzp_id: str):
+    vzp_data = active_vzp.get(vzp_id)
+    guild = bot.get_guild(guild_id)
+    if not vzp_data or not guild or vzp_data.status == 'VZP IN PROCESS':
+        return
+    notified = await notify_users_ls(
+        vzp_id,
+        f"⏰ VZP ЧЕРЕЗ {REMINDER_MINUTES} МИНУТ",
+        f"VZP в **{vzp_data.time}** скоро начнётся. Будьте в игре и в голосовом канале!",
+        guild
+    )
+    log.info(f"⏰ Напоминание о VZP {vzp_id} отправлено: {notified}", extra={"vzp_id": vzp_id})
+
+@scheduled("vzp_auto_stop", grace=AUTO_START_GRACE_MINUTES * 60)
+async def auto_stop_reactions(guild_id: int, vzp_id: str):
+    vzp_data = active_vzp.get(vzp_id)
+    if not vzp_data or vzp_data.status != 'OPEN':
+        return
+    vzp_data.status = 'LIST IN PROCESS'
+    await update_vzp_message(vzp_id)
+    save_data(guild_id)
+    await announce(vzp_data, f"🔒 Приём заявок на VZP `{vzp_id}` закрыт автоматически: {len(vzp_data.plus_users)}/{vzp_data.members}")
+
+@scheduled("vzp_auto_start", grace=AUTO_START_GRACE_MINUTES * 60)
+async def auto_start_vzp(guild_id: int, vzp_id: str):
+    vzp_data = active_vzp.get(vzp_id)
+    guild = bot.get_guild(guild_id)
+    if not vzp_data or not guild or vzp_data.status not in ('OPEN', 'LIST IN PROCESS'):
+        return
+    moved_count, total, notified = await launch_vzp(guild, vzp_id)
+    await announce(vzp_data, f"▶️ VZP `{vzp_id}` запущена автоматически. "
+                             f"Перемещено в голосовой: {moved_count}/{total}, уведомлений: {notified}")
+
+@scheduled("autoping", grace=60)
+async def autoping(guild_id: int, channel_id: int, vzp_id: str, count: int):
+    channel = bot.get_channel(channel_id)
+    if not channel:
+        return
+    try:
+        await send_pings(channel, count)
+    except discord.HTTPException as e:
+        log.error(f"❌ Ошибка автопинга: {e}", extra={"vzp_id": vzp_id})
+        return
+    log.info(f"✅ Автопинг отправлен для VZP {vzp_id}", extra={"vzp_id": vzp_id})
+
+@scheduled("position_notice_expire")
+async def expire_position_notice(guild_id: int, channel_id: int, board_message_id: int, user_id: int, message_id: int):
+    channel = bot.get_channel(channel_id)
+    if channel:
+        try:
+            await channel.get_partial_message(message_id).delete()
+        except discord.HTTPException as e:
+            log.debug(f"Уведомление уже удалено: {e}", extra={"user_id": user_id})
+    
+    # Запись могла смениться более новым уведомлением того же игрока - его удалит своя задача
+    users = user_notification_messages.get(str(board_message_id))
+    if users and users.get(user_id) == message_id:
+        del users[user_id]
+        if not users:
+            del user_notification_messages[str(board_message_id)]
+    save_data(guild_id)
+
+@scheduled("category_cleanup")
+async def retry_category_cleanup(guild_id: int, category_id: int, vzp_id: str):
+    guild = bot.get_guild(guild_id)
+    if guild and category_id in pending_category_cleanup:
+        await teardown_vzp_category(guild, category_id, vzp_id)
+
+def next_leaderboard_rollover(now: datetime) -> datetime:
+    """Начало следующей недели (время сервера бота, как у окон таблиц лидеров)"""
+    week_start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    return week_start + timedelta(days=7)
+
+def schedule_leaderboard_rollover(guild_id: int):
+    """Закреплённая таблица показывает недельный топ: на границе недели её нужно обновить, даже если VZP не закрывались"""
+    if any(job["kind"] == "leaderboard_rollover" and job["guild_id"] == guild_id for job in scheduled_jobs.values()):
+        return
+    schedule_job("leaderboard_rollover", next_leaderboard_rollover(datetime.now()).timestamp() + 1, guild_id)
+    save_schedule(guild_id)
+
+@scheduled("leaderboard_rollover")
+async def rollover_leaderboard(guild_id: int):
+    guild = bot.get_guild(guild_id)
+    if guild and leaderboard_message.get(guild_id, {}).get('message_id'):
+        await refresh_leaderboard_message(guild)
+
+# ===================== ОЧИСТКА СОСТОЯНИЯ =====================
+# Сроки жизни записей, которые никто больше не удаляет:
+#   закрытое распределение позиций      - CLOSED_BOARD_TTL_HOURS после /close_positions
+#   распределение без канала, сироты    - сразу
+#   уведомление о позиции               - NOTIFICATION_TTL секунд с отправки (время берётся из ID сообщения)
+#   VZP, чьё сообщение или канал удалён - сразу, категория и роль удаляются как при закрытии
+#   кэши панелей и составов по VZP      - сразу после того, как VZP перестала быть активной
+last_sweep: Dict[str, object] = {"at": None, "freed": {}, "duration_ms": 0.0}
+
+# VZP, чьё сообщение или канал удалены, узнаём по событиям шлюза. Запросом сообщения проверяются
+# только на первом проходе после запуска (события за время простоя потеряны) и раз в SWEEP_MESSAGE_CHECK_INTERVAL
+vzp_messages_gone: Set[str] = set()
+last_message_check = 0.0
+
+def mark_vzp_messages_gone(gone: Callable[[VZPData], bool]):
+    for vzp_id, vzp_data in active_vzp.items():
+        if gone(vzp_data):
+            vzp_messages_gone.add(vzp_id)
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    mark_vzp_messages_gone(lambda vzp_data: vzp_data.message_id == payload.message_id)
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    mark_vzp_messages_gone(lambda vzp_data: vzp_data.message_id in payload.message_ids)
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    mark_vzp_messages_gone(lambda vzp_data: vzp_data.channel_id == channel.id)
+
+def reachable_guild(guild_id: Optional[int]) -> Optional[discord.Guild]:
+    """Сервер в кэше и доступен - только тогда пропавший канал действительно удалён"""
+    guild = bot.get_guild(guild_id) if guild_id else None
+    return guild if guild and not guild.unavailable else None
+
+def drop_position_board(pos_id: str):
+    position_assignments.pop(pos_id, None)
+    info = position_messages.pop(pos_id, None)
+    if info:
+        user_notification_messages.pop(str(info.get("message_id")), None)
+
+def evict_vzp(guild: discord.Guild, vzp_id: str):
+    vzp_data = active_vzp.pop(vzp_id)
+    invalidate_roster(vzp_id)
+    invalidate_vzp_index()
+    cancel_vzp_jobs(vzp_id)
+    swap_history.pop(vzp_id, None)
+    voice_sessions.pop(vzp_id, None)
+    voice_board_lines.pop(vzp_id, None)
+    voice_board_dirty.pop(vzp_id, None)
+    if vzp_data.category_id:
+        schedule_category_teardown(guild, vzp_data.category_id, vzp_id)
+    if vzp_data.role_id:
+        run_in_background(delete_vzp_role(guild, vzp_data.role_id))
+    log.warning(f"🧹 VZP {vzp_id} удалена очисткой: её сообщение удалено", extra={"vzp_id": vzp_id, "guild_id": guild.id})
+
+async def delete_stale_notification(channel_id: int, message_id: int):
+    channel = bot.get_channel(channel_id)
+    if not channel:
+        return
+    try:
+        await channel.get_partial_message(message_id).delete()
+    except discord.HTTPException as e:
+        log.debug(f"Зависшее уведомление уже удалено: {e}")
+
+async def sweep_state() -> Dict[str, int]:
+    """Один проход очистки: возвращает, сколько записей каждого вида удалено"""
+    global last_message_check
+    freed: Dict[str, int] = {}
+    touched: Set[int] = set()
+    now = time_module.time()
+    
+    def evict(kind: str, guild_id: Optional[int]):
+        freed[kind] = freed.get(kind, 0) + 1
+        if guild_id:
+            touched.add(guild_id)
+    
+    # Распределения позиций: канал удалён - набор закрыт и удаляется вместе с ним
+    for channel_id, call in list(active_position_calls.items()):
+        guild = reachable_guild(call.get("guild_id"))
+        channel_gone = guild is not None and not guild.get_channel_or_thread(channel_id)
+        if call["pos_id"] not in position_assignments or channel_gone:
+            del active_position_calls[channel_id]
+            evict("position_calls", call.get("guild_id"))
+            if channel_gone and call["pos_id"] in position_assignments:
+                drop_position_board(call["pos_id"])
+                evict("position_boards", call.get("guild_id"))
+    
+    live_boards = {call["pos_id"] for call in active_position_calls.values()}
+    for pos_id in set(position_assignments) | set(position_messages):
+        if pos_id in live_boards or pos_id in active_vzp:
+            continue
+        info = position_messages.get(pos_id)
+        if info is None:
+            drop_position_board(pos_id)
+            evict("position_boards", None)
+            continue
+        closed_at = info.get("closed_at")
+        if closed_at is None:
+            # Закрыто до появления очистки: срок считается от создания сообщения распределения
+            closed_at = info["closed_at"] = discord.utils.snowflake_time(info["message_id"]).timestamp() if info.get("message_id") else now
+            touched.add(info.get("guild_id"))
+        if now - closed_at >= CLOSED_BOARD_TTL_HOURS * 3600:
+            drop_position_board(pos_id)
+            evict("position_boards", info.get("guild_id"))
+    
+    # Уведомления: задача, удаляющая их через 5 секунд, могла умереть вместе с процессом
+    boards_by_message = {str(info.get("message_id")): info for info in position_messages.values()}
+    for board_message_id, users in list(user_notification_messages.items()):
+        info = boards_by_message.get(board_message_id)
+        for user_id, notice_id in list(users.items()):
+            age = (discord.utils.utcnow() - discord.utils.snowflake_time(notice_id)).total_seconds()
+            if info is not None and age < NOTIFICATION_TTL:
+                continue
+            del users[user_id]
+            evict("notifications", info.get("guild_id") if info else None)
+            if info:
+                run_in_background(delete_stale_notification(info["channel_id"], notice_id))
+        if not users:
+            del user_notification_messages[board_message_id]
+    
+    # VZP с удалённым сообщением: записаться на неё уже нельзя, закрыть командой - незачем
+    check_messages = now - last_message_check >= SWEEP_MESSAGE_CHECK_INTERVAL
+    if check_messages:
+        last_message_check = now
+    for vzp_id, vzp_data in list(active_vzp.items()):
+        guild = reachable_guild(vzp_data.guild_id)
+        if not guild:
+            continue
+        channel = guild.get_channel_or_thread(vzp_data.channel_id)
+        if channel is not None and vzp_id not in vzp_messages_gone:
+            if not check_messages:
+                continue
+            try:
+                await channel.fetch_message(vzp_data.message_id)
+                continue
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                log.warning(f"⚠️ Очистка не смогла проверить сообщение VZP {vzp_id}: {e}", extra={"vzp_id": vzp_id})
+                continue
+        vzp_messages_gone.discard(vzp_id)
+        if vzp_id in active_vzp:
+            evict_vzp(guild, vzp_id)
+            evict("vzp", guild.id)
+    vzp_messages_gone.intersection_update(active_vzp)
+    
+    for kind, store in (("swap_history", swap_history), ("voice_sessions", voice_sessions),
+                        ("voice_boards", voice_board_lines), ("voice_board_dirty", voice_board_dirty),
+                        ("roster_index", roster_index)):
+        for vzp_id in [vzp_id for vzp_id in store if vzp_id not in active_vzp]:
+            del store[vzp_id]
+            evict(kind, None)
+    
+    for job_id, job in list(scheduled_jobs.items()):
+        vzp_id = job["args"].get("vzp_id")
+        if vzp_id and vzp_id not in active_vzp and job["kind"] != "category_cleanup":
+            del scheduled_jobs[job_id]
+            evict("scheduled_jobs", job["guild_id"])
+    
+    # Запасные категории стареют и без запуска VZP: пул проверяется и на серверах, где VZP давно не было
+    if CATEGORY_POOL_SIZE > 0:
+        for guild in bot.guilds:
+            if guild.unavailable or not is_configured_guild(guild):
+                continue
+            removed = await cleanup_category_pool(guild)
+            if removed:
+                freed["category_pool"] = freed.get("category_pool", 0) + removed
+                touched.add(guild.id)
+                schedule_pool_warmup(guild)
+    
+    for guild_id in touched:
+        save_data(guild_id)
+    return freed
+
+async def lifecycle_sweeper():
+    await bot.wait_until_ready()
+    while True:
+        started = time_module.perf_counter()
+        try:
+            with span("sweep_state"):
+                freed = await sweep_state()
+        except Exception as e:
+            log.exception(f"❌ Ошибка очистки состояния: {e}")
+            freed = {}
+        for kind, count in freed.items():
+            SWEEP_EVICTED.inc(kind, amount=count)
+        last_sweep.update(at=datetime.now(), freed=freed, duration_ms=(time_module.perf_counter() - started) * 1000)
+        if freed:
+            log.info("🧹 Очистка состояния: " + ", ".join(f"{kind} {count}" for kind, count in sorted(freed.items())),
+                     extra={"freed": freed})
+        await asyncio.sleep(SWEEP_INTERVAL)
+
+# ===================== ПРОФИЛИРОВАНИЕ =====================
+profiling_active = False
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def format_cprofile_top(profiler: cProfile.Profile, limit: int = PROFILE_TOP) -> List[str]:
+    stats = pstats.Stats(profiler).sort_stats('cumulative')
+    lines = []
+    for func in stats.fcn_list[:limit]:
+        _, calls, _, cumulative, _ = stats.stats[func]
+        filename, line, name = func
+        lines.append(f"{cumulative:8.3f}s {calls:>8} {name} ({os.path.basename(filename)}:{line})")
+    return lines
+
+class StackSampler:
+    """Раз в PROFILE_SAMPLE_INTERVAL процессорного времени снимает стек по SIGPROF.
+    Простой в select не тратит процессор и в выборку не попадает"""
+    def __init__(self):
+        self.samples = 0
+        self.cumulative: Dict[str, int] = {}
+        self.stacks: Dict[str, int] = {}
+        self.previous_handler = None
+    
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame_label(frame.f_code))
+            frame = frame.f_back
+        self.samples += 1
+        for label in set(stack):
+            self.cumulative[label] = self.cumulative.get(label, 0) + 1
+        folded = ";".join(reversed(stack))
+        self.stacks[folded] = self.stacks.get(folded, 0) + 1
+    
+    def start(self):
+        self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, PROFILE_SAMPLE_INTERVAL, PROFILE_SAMPLE_INTERVAL)
+    
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+    
+    def top(self, limit: int = PROFILE_TOP) -> List[str]:
+        ranked = sorted(self.cumulative.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [f"{count * 100 / self.samples:7.1f}% {label}" for label, count in ranked]
+    
+    def dump(self, path: str):
+        # Формат collapsed stacks - открывается flamegraph.pl и speedscope
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{stack} {count}\n")
+
+async def run_profiler(mode: str, seconds: int) -> Tuple[str, List[str]]:
+    """Профилирует процесс seconds секунд, пишет результат в PROFILE_DIR и возвращает (путь, топ функций)"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    
+    # SIGPROF есть только на Unix - в остальных случаях откатываемся на cProfile
+    if mode == 'sampling' and hasattr(signal, 'setitimer'):
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+        path = os.path.join(PROFILE_DIR, f"profile_{stamp}.folded")
+        sampler.dump(path)
+        return path, sampler.top() if sampler.samples else []
+    
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+    path = os.path.join(PROFILE_DIR, f"profile_{stamp}.prof")
+    profiler.dump_stats(path)
+    return path, format_cprofile_top(profiler)
+
+# ===================== ЗАПИСЬ ТРАФИКА =====================
+# Компактная запись входящих событий для replay.py: время, тип, ID и тиры, без текста сообщений
+trace_file = None
+trace_started = 0.0
+
+def write_trace(entry: dict):
+    trace_file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n")
+
+def open_trace():
+    """Открывает файл записи и пишет снимок состояния, с которого начнётся воспроизведение"""
+    global trace_file, trace_started
+    if not TRACE_FILE or trace_file is not None:
+        return
+    
+    trace_file = open(TRACE_FILE, 'a', encoding='utf-8', buffering=1)
+    trace_started = time_module.time()
+    
+    vzps = {}
+    for vzp_id, vzp_data in active_vzp.items():
+        vzps[vzp_id] = {
+            "guild_id": vzp_data.guild_id,
+            "status": vzp_data.status,
+            "members": vzp_data.members,
+            "attack_def_name": vzp_data.attack_def_name,
+            "conditions_display": vzp_data.conditions_display,
+            "caliber_names": vzp_data.caliber_names,
+            "channel_id": vzp_data.channel_id,
+            "message_id": vzp_data.message_id,
+            "plus_users": vzp_data.plus_users,
+            "swaps": swap_history.get(vzp_id, {})
+        }
+    
+    boards = {}
+    for channel_id, call_data in active_position_calls.items():
+        pos_id = call_data["pos_id"]
+        positions = position_assignments.get(pos_id, {})
+        boards[channel_id] = {
+            "guild_id": call_data.get("guild_id"),
+            "pos_id": pos_id,
+            "vzp_id": call_data.get("vzp_id"),
+            "message_id": position_messages.get(pos_id, {}).get("message_id"),
+            "positions": len(positions),
+            "taken": {pos: member.id for pos, member in positions.items() if member}
+        }
+    
+    write_trace({"t": 0, "type": "snapshot", "ts": trace_started, "vzp": vzps, "boards": boards})
+    log.info(f"⏺️ Запись трафика в {TRACE_FILE}")
+
+def trace_event(kind: str, **fields):
+    if trace_file is None:
+        return
+    write_trace({"t": round(time_module.time() - trace_started, 3), "type": kind, **fields})
+
+def trace_user(member) -> dict:
+    tier, is_admin = get_member_eligibility(member)
+    return {"user": member.id, "tier": tier, "admin": is_admin}
+
+def trace_options(interaction: discord.Interaction) -> dict:
+    """Параметры команды без свободного текста: ID, числа и значения из списков выбора"""
+    options = {}
+    for name, value in interaction.namespace:
+        if isinstance(value, (bool, int, float)):
+            options[name] = value
+        elif isinstance(value, str):
+            parameter = interaction.command.get_parameter(name)
+            if name == 'vzp_id' or (parameter and parameter.choices):
+                options[name] = value
+        elif hasattr(value, 'id'):
+            options[name] = {"id": value.id}
+    return options
+
+def trace_interaction(interaction: discord.Interaction, kind: str, name: str, options: dict):
+    if trace_file is None:
+        return
+    trace_event(kind, name=name, interaction=interaction.id, channel=interaction.channel_id,
+                options=options, **trace_user(interaction.user))
+
+def trace_message(message: discord.Message, content: str):
+    if trace_file is None:
+        return
+    if content in CANCEL_WORDS:
+        action = {"action": "cancel"}
+    elif content.isdigit():
+        action = {"action": "claim", "position": int(content)}
+    else:
+        action = {"action": "other"}
+    trace_event("message", channel=message.channel.id, **action, **trace_user(message.author))
+
+# ===================== ОБРАБОТЧИК СООБЩЕНИЙ =====================
+@bot.event
 async def on_message(message):
     if message.author.bot:
         return
@@ -633,8 +3015,9 @@ async def on_message(message):
         return
     
     content = message.content.lower().strip()
+    trace_message(message, content)
     
-    if content in ["отмена", "cancel", "удалить", "delete", "освободить"]:
+    if content in CANCEL_WORDS:
         user_positions = []
         for pos, member in positions.items():
             if member and member.id == message.author.id:
@@ -648,10 +3031,7 @@ async def on_message(message):
                 message.author.id,
                 f"{message.author.mention} ❌ Вы не занимаете ни одной позиции!"
             )
-            try:
-                await message.delete()
-            except:
-                pass
+            await delete_message_quietly(message)
             return
         
         for pos in user_positions:
@@ -670,10 +3050,7 @@ async def on_message(message):
             message.author.id,
             reply
         )
-        try:
-            await message.delete()
-        except:
-            pass
+        await delete_message_quietly(message)
         return
     
     try:
@@ -688,10 +3065,7 @@ async def on_message(message):
             message.author.id,
             f"{message.author.mention} ❌ Позиция {requested_pos} не существует! Доступные позиции: 1-{len(positions)}"
         )
-        try:
-            await message.delete()
-        except:
-            pass
+        await delete_message_quietly(message)
         return
     
     current_holder = positions[requested_pos]
@@ -710,10 +3084,7 @@ async def on_message(message):
                 message.author.id,
                 f"{message.author.mention} ❌ Позиция {requested_pos} уже занята {current_holder.mention}!"
             )
-        try:
-            await message.delete()
-        except:
-            pass
+        await delete_message_quietly(message)
         return
     
     # Проверяем, не занимает ли пользователь уже другую позицию
@@ -732,10 +3103,7 @@ async def on_message(message):
             message.author.id,
             f"{message.author.mention} ❌ Вы уже занимаете позицию {user_current_position}! Используйте `отмена` чтобы освободить её, прежде чем занять новую."
         )
-        try:
-            await message.delete()
-        except:
-            pass
+        await delete_message_quietly(message)
         return
     
     positions[requested_pos] = message.author
@@ -747,10 +3115,64 @@ async def on_message(message):
         message.author.id,
         f"{message.author.mention} ✅ Вы успешно заняли позицию {requested_pos}!"
     )
-    try:
-        await message.delete()
-    except:
-        pass
+    await delete_message_quietly(message)
+
+# ===================== АВТОДОПОЛНЕНИЕ VZP =====================
+AUTOCOMPLETE_LIMIT = 25  # Больше вариантов Discord не принимает
+CHOICE_NAME_LIMIT = 100
+VZP_STATUS_EMOJI = {'OPEN': '🟢', 'LIST IN PROCESS': '🟡', 'VZP IN PROCESS': '🔵', 'CLOSED': '🔴'}
+VZP_STATUS_RANK = {'OPEN': 0, 'LIST IN PROCESS': 1, 'VZP IN PROCESS': 2}
+
+# guild_id -> отсортированные id активных VZP сервера, префикс ищется двоичным поиском.
+# Сбрасывается при появлении и удалении VZP, статус и состав читаются из active_vzp в момент запроса
+vzp_prefix_index: Dict[Optional[int], List[str]] = {}
+
+def get_vzp_prefix_index(guild_id: Optional[int]) -> List[str]:
+    index = vzp_prefix_index.get(guild_id)
+    if index is None:
+        index = vzp_prefix_index[guild_id] = sorted(guild_active_vzp(guild_id))
+    return index
+
+def invalidate_vzp_index():
+    vzp_prefix_index.clear()
+
+def find_vzp(guild_id: Optional[int], query: str) -> List[str]:
+    """id VZP сервера, начинающиеся с query. Если таких нет - те, где query есть в остальной подписи варианта"""
+    index = get_vzp_prefix_index(guild_id)
+    found = []
+    for i in range(bisect.bisect_left(index, query), len(index)):
+        if not index[i].startswith(query):
+            break
+        found.append(index[i])
+    if not found and query:
+        found = [vzp_id for vzp_id in index if query in vzp_choice_label(active_vzp[vzp_id]).lower()]
+    return found
+
+def vzp_rank(vzp_id: str, now: datetime) -> tuple:
+    """Сначала открытые, потом со списком, потом идущие; внутри - по времени начала, нераспознанное в конце"""
+    vzp_data = active_vzp[vzp_id]
+    start = parse_vzp_time(vzp_data.time, now)
+    return (VZP_STATUS_RANK.get(vzp_data.status, len(VZP_STATUS_RANK)), start is None,
+            start.timestamp() if start else 0, vzp_data.created_at)
+
+def vzp_choice_label(vzp_data: VZPData) -> str:
+    # Соперник известен только после закрытия, до этого на его месте тип VZP
+    return f"{vzp_data.time} • {vzp_data.enemy or vzp_data.attack_def_name.strip()}"
+
+def vzp_choice_name(vzp_id: str) -> str:
+    vzp_data = active_vzp[vzp_id]
+    name = (f"{vzp_id} {VZP_STATUS_EMOJI.get(vzp_data.status, '⚪')} {vzp_choice_label(vzp_data)} • "
+            f"{len(vzp_data.plus_users)}/{vzp_data.members}")
+    return name if len(name) <= CHOICE_NAME_LIMIT else name[:CHOICE_NAME_LIMIT - 1] + "…"
+
+async def vzp_id_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    started = time_module.perf_counter()
+    found = find_vzp(interaction.guild_id, current.strip().lower())
+    now = datetime.now(schedule_timezone)
+    best = heapq.nsmallest(AUTOCOMPLETE_LIMIT, found, key=lambda vzp_id: vzp_rank(vzp_id, now))
+    choices = [app_commands.Choice(name=vzp_choice_name(vzp_id), value=vzp_id) for vzp_id in best]
+    AUTOCOMPLETE_LATENCY.observe(time_module.perf_counter() - started, "vzp_id")
+    return choices
 
 # ===================== КОМАНДЫ =====================
 
@@ -764,7 +3186,9 @@ async def on_message(message):
     caliber2="Выберите второй калибр",
     caliber3="Выберите третий калибр",
     condition2="Выберите второе условие забива (не обязательно)",
-    condition3="Выберите третье условие забива (не обязательно)"
+    condition3="Выберите третье условие забива (не обязательно)",
+    auto_stop=f"Закрыть приём заявок за {AUTO_STOP_LEAD_MINUTES} мин до времени VZP",
+    auto_start="Запустить VZP автоматически во время VZP"
 )
 @app_commands.choices(
     attack_def=[
@@ -821,11 +3245,13 @@ async def vzp_start(
     caliber2: app_commands.Choice[str],
     caliber3: app_commands.Choice[str],
     condition2: app_commands.Choice[str] = None,
-    condition3: app_commands.Choice[str] = None
+    condition3: app_commands.Choice[str] = None,
+    auto_stop: bool = False,
+    auto_start: bool = False
 ):
     if not await is_allowed_channel(interaction):
         await interaction.response.send_message(
-            f"❌ Эту команду можно использовать только в канале <#{ALLOWED_CHANNEL}>!",
+            f"❌ Эту команду можно использовать только в канале <#{get_guild_config(interaction.guild_id).allowed_channel}>!",
             ephemeral=True
         )
         return
@@ -837,24 +3263,25 @@ async def vzp_start(
         )
         return
     
-    if len(active_vzp) >= MAX_ACTIVE_VZP:
+    config = get_guild_config(interaction.guild_id)
+    if len(guild_active_vzp(interaction.guild_id)) >= config.max_active_vzp:
         await interaction.response.send_message(
-            f"❌ Достигнут лимит активных VZP ({MAX_ACTIVE_VZP})! "
+            f"❌ Достигнут лимит активных VZP ({config.max_active_vzp})! "
             f"Закройте некоторые VZP командой `/close_vzp`",
             ephemeral=True
         )
         return
     
-    if members > MAX_PARTICIPANTS_PER_VZP:
+    if members > config.max_participants:
         await interaction.response.send_message(
-            f"❌ Максимальное количество участников: {MAX_PARTICIPANTS_PER_VZP}",
+            f"❌ Максимальное количество участников: {config.max_participants}",
             ephemeral=True
         )
         return
     
-    if members < MIN_PARTICIPANTS_PER_VZP:
+    if members < config.min_participants:
         await interaction.response.send_message(
-            f"❌ Минимальное количество участников: {MIN_PARTICIPANTS_PER_VZP}",
+            f"❌ Минимальное количество участников: {config.min_participants}",
             ephemeral=True
         )
         return
@@ -901,7 +3328,7 @@ async def vzp_start(
     embed.add_field(name="**STATUS**", value=f"```OPEN```", inline=False)
     embed.add_field(name="**ID**", value=f"```{vzp_id}```", inline=False)
     
-    view = VZPView(vzp_id)
+    view = vzp_view(vzp_id, 'plus')
     
     await interaction.response.send_message(embed=embed, view=view)
     message = await interaction.original_response()
@@ -922,28 +3349,27 @@ async def vzp_start(
         'status': 'OPEN',
         'created_at': datetime.now().isoformat(),
         'result': None,
-        'amount': None
+        'amount': None,
+        'guild_id': interaction.guild_id
     })
+    vzp_data.buttons = 'plus'
     
     active_vzp[vzp_id] = vzp_data
+    invalidate_vzp_index()
     swap_history[vzp_id] = {}
-    save_data()
-    
-    try:
-        await asyncio.sleep(1)
-        for i in range(5):
-            await interaction.channel.send("@everyone")
-            await asyncio.sleep(0.2)
-        print(f"✅ Автопинг отправлен для VZP {vzp_id}")
-    except Exception as e:
-        print(f"❌ Ошибка автопинга: {e}")
+    schedule_vzp_jobs(vzp_id, auto_stop, auto_start)
+    schedule_job("autoping", time_module.time() + 1, interaction.guild_id, persist=False,
+                 channel_id=interaction.channel_id, vzp_id=vzp_id, count=AUTOPING_COUNT)
+    save_data(interaction.guild_id)
+    trace_event("vzp_created", interaction=interaction.id, vzp_id=vzp_id)
 
 @bot.tree.command(name="start_vzp", description="Запустить VZP (создать категорию и каналы)")
 @app_commands.describe(vzp_id="ID VZP")
+@app_commands.autocomplete(vzp_id=vzp_id_autocomplete)
 async def start_vzp(interaction: discord.Interaction, vzp_id: str):
     if not await is_allowed_channel(interaction):
         await interaction.response.send_message(
-            f"❌ Эту команду можно использовать только в канале <#{ALLOWED_CHANNEL}>!",
+            f"❌ Эту команду можно использовать только в канале <#{get_guild_config(interaction.guild_id).allowed_channel}>!",
             ephemeral=True
         )
         return
@@ -955,7 +3381,7 @@ async def start_vzp(interaction: discord.Interaction, vzp_id: str):
         )
         return
     
-    if vzp_id not in active_vzp:
+    if not vzp_in_guild(vzp_id, interaction.guild_id):
         await interaction.response.send_message(
             f"❌ VZP с ID `{vzp_id}` не найдена!",
             ephemeral=True
@@ -965,74 +3391,93 @@ async def start_vzp(interaction: discord.Interaction, vzp_id: str):
     # Отвечаем сразу, чтобы Discord знал, что бот обрабатывает команду
     await interaction.response.defer(thinking=True, ephemeral=True)
     
+    moved_count, total, notified = await launch_vzp(interaction.guild, vzp_id)
+    
+    # Отправляем финальный ответ
+    await interaction.followup.send(
+        f"VZP `{vzp_id}` запущена! Создана категория с каналами.\n"
+        f"Перемещено в голосовой: {moved_count}/{total} игроков\n"
+        f"Отправлено уведомлений: {notified}",
+        ephemeral=True
+    )
+
+async def launch_vzp(guild: discord.Guild, vzp_id: str) -> Tuple[int, int, int]:
+    """Запуск VZP: категория с каналами, перемещение и ЛС состава. Возвращает (перемещено, всего, уведомлено)"""
     vzp_data = active_vzp[vzp_id]
     vzp_data.status = 'VZP IN PROCESS'
     
-    await update_vzp_message(vzp_id)
+    with span("update_vzp_message", vzp_id=vzp_id):
+        await update_vzp_message(vzp_id)
     
-    guild = interaction.guild
     overwrites = {
         guild.default_role: discord.PermissionOverwrite(view_channel=False),
         guild.me: discord.PermissionOverwrite(view_channel=True)
     }
     
-    members_to_move = []
-    for user_id in vzp_data.plus_users:
-        member = guild.get_member(user_id)
-        if member:
-            overwrites[member] = discord.PermissionOverwrite(view_channel=True)
-            members_to_move.append(member)
-    
     vzp_swaps = swap_history.get(vzp_id, {})
-    for new_user_id in vzp_swaps.values():
-        member = guild.get_member(new_user_id)
-        if member:
+    members_to_move = list((await resolve_members(guild, list(vzp_data.plus_users) + list(vzp_swaps.values()))).values())
+    
+    if VZP_ROLE_MODE:
+        # Одна запись в правах категории вместо записи на каждого игрока
+        with span("grant_vzp_role", vzp_id=vzp_id, members=len(members_to_move)):
+            role = await guild.create_role(name=f"VZP {vzp_id}", reason=f"Временная роль VZP {vzp_id}")
+            vzp_data.role_id = role.id
+            overwrites[role] = discord.PermissionOverwrite(view_channel=True)
+            await grant_vzp_role(role, members_to_move)
+    else:
+        for member in members_to_move:
             overwrites[member] = discord.PermissionOverwrite(view_channel=True)
-            members_to_move.append(member)
     
-    category = await guild.create_category_channel(
-        name=f"VZP ID - {vzp_id}",
-        overwrites=overwrites
-    )
-    
-    vzp_data.category_id = category.id
-    voice_channel = await category.create_voice_channel(name="vzp voice")
-    await category.create_text_channel(name="vzp flood")
-    await category.create_text_channel(name="vzp call")
+    with span("prepare_category", vzp_id=vzp_id):
+        acquired = await acquire_pool_category(guild, vzp_id, overwrites)
+        if acquired:
+            category, (voice_channel, _, call_channel) = acquired
+            vzp_data.category_id = category.id
+        else:
+            category = await guild.create_category_channel(
+                name=f"VZP ID - {vzp_id}",
+                overwrites=overwrites
+            )
+            
+            vzp_data.category_id = category.id
+            voice_channel = await category.create_voice_channel(name="vzp voice")
+            await category.create_text_channel(name="vzp flood")
+            call_channel = await category.create_text_channel(name="vzp call")
     
-    moved_count = 0
-    for member in members_to_move:
-        if member.voice and member.voice.channel:
-            try:
-                await member.move_to(voice_channel)
-                moved_count += 1
-            except:
-                pass
-        await asyncio.sleep(0.1)
+    vzp_data.call_channel_id = call_channel.id
+    with span("post_voice_board", vzp_id=vzp_id):
+        await post_voice_board(vzp_id)
     
-    notified = await notify_users_ls(
-        vzp_id,
-        "🎮 VZP НАЧАЛАСЬ!",
-        f"VZP началась! Присоединяйтесь к голосовому каналу:\n{voice_channel.mention}",
-        guild
-    )
+    schedule_pool_warmup(guild)
     
-    save_data()
+    moved_count = 0
+    with span("move_members", vzp_id=vzp_id, members=len(members_to_move)):
+        for member in members_to_move:
+            if member.voice and member.voice.channel:
+                try:
+                    await member.move_to(voice_channel)
+                    moved_count += 1
+                except discord.HTTPException as e:
+                    log.warning(f"Не удалось переместить игрока: {e}", extra={"vzp_id": vzp_id, "user_id": member.id})
+    
+    with span("notify_users", vzp_id=vzp_id):
+        notified = await notify_users_ls(
+            vzp_id,
+            "🎮 VZP НАЧАЛАСЬ!",
+            f"VZP началась! Присоединяйтесь к голосовому каналу:\n{voice_channel.mention}",
+            guild
+        )
     
-    # Отправляем финальный ответ
-    await interaction.followup.send(
-        f"VZP `{vzp_id}` запущена! Создана категория с каналами.\n"
-        f"Перемещено в голосовой: {moved_count}/{len(members_to_move)} игроков\n"
-        f"Отправлено уведомлений: {notified}",
-        ephemeral=True
-    )
+    save_data(guild.id)
+    return moved_count, len(members_to_move), notified
 
 @bot.tree.command(name="stop_reactions", description="Остановить приём заявок на VZP")
 @app_commands.describe(vzp_id="ID VZP")
+@app_commands.autocomplete(vzp_id=vzp_id_autocomplete)
 async def stop_reactions(interaction: discord.Interaction, vzp_id: str):
     if not await is_allowed_channel(interaction):
         await interaction.response.send_message(
-            f"❌ Эту команду можно использовать только в канале <#{ALLOWED_CHANNEL}>!",
+            f"❌ Эту команду можно использовать только в канале <#{get_guild_config(interaction.guild_id).allowed_channel}>!",
             ephemeral=True
         )
         return
@@ -1044,7 +3489,7 @@ async def stop_reactions(interaction: discord.Interaction, vzp_id: str):
         )
         return
     
-    if vzp_id not in active_vzp:
+    if not vzp_in_guild(vzp_id, interaction.guild_id):
         await interaction.response.send_message(
             f"❌ VZP с ID `{vzp_id}` не найдена!",
             ephemeral=True
@@ -1062,14 +3507,15 @@ async def stop_reactions(interaction: discord.Interaction, vzp_id: str):
     
     vzp_data.status = 'LIST IN PROCESS'
     await update_vzp_message(vzp_id)
-    save_data()
+    save_data(interaction.guild_id)
 
 @bot.tree.command(name="return_reactions", description="Возобновить приём заявок на VZP")
 @app_commands.describe(vzp_id="ID VZP")
+@app_commands.autocomplete(vzp_id=vzp_id_autocomplete)
 async def return_reactions(interaction: discord.Interaction, vzp_id: str):
     if not await is_allowed_channel(interaction):
         await interaction.response.send_message(
-            f"❌ Эту команду можно использовать только в канале <#{ALLOWED_CHANNEL}>!",
+            f"❌ Эту команду можно использовать только в канале <#{get_guild_config(interaction.guild_id).allowed_channel}>!",
             ephemeral=True
         )
         return
@@ -1081,7 +3527,7 @@ async def return_reactions(interaction: discord.Interaction, vzp_id: str):
         )
         return
     
-    if vzp_id not in active_vzp:
+    if not vzp_in_guild(vzp_id, interaction.guild_id):
         await interaction.response.send_message(
             f"❌ VZP с ID `{vzp_id}` не найдена!",
             ephemeral=True
@@ -1106,7 +3552,7 @@ async def return_reactions(interaction: discord.Interaction, vzp_id: str):
     
     vzp_data.status = 'OPEN'
     await update_vzp_message(vzp_id)
-    save_data()
+    save_data(interaction.guild_id)
 
 @bot.tree.command(name="swap_player", description="Заменить игрока в VZP")
 @app_commands.describe(
@@ -1114,6 +3560,7 @@ async def return_reactions(interaction: discord.Interaction, vzp_id: str):
     old_player="Игрок, которого нужно заменить",
     new_player="Игрок, который заменит"
 )
+@app_commands.autocomplete(vzp_id=vzp_id_autocomplete)
 async def swap_player(interaction: discord.Interaction, vzp_id: str, old_player: discord.Member, new_player: discord.Member):
     if not await has_high_role(interaction):
         await interaction.response.send_message(
@@ -1122,7 +3569,7 @@ async def swap_player(interaction: discord.Interaction, vzp_id: str, old_player:
         )
         return
     
-    if vzp_id not in active_vzp:
+    if not vzp_in_guild(vzp_id, interaction.guild_id):
         await interaction.response.send_message(
             f"❌ VZП с ID `{vzp_id}` не найдена!",
             ephemeral=True
@@ -1162,7 +3609,12 @@ async def swap_player(interaction: discord.Interaction, vzp_id: str, old_player:
         swap_history[vzp_id] = {}
     swap_history[vzp_id][old_player.id] = new_player.id
     
-    if vzp_data.category_id and vzp_data.status == 'VZP IN PROCESS':
+    if vzp_data.role_id and vzp_data.status == 'VZP IN PROCESS':
+        queue_role_change(interaction.guild, vzp_data.role_id, old_player.id, False)
+        queue_role_change(interaction.guild, vzp_data.role_id, new_player.id, True)
+        if old_player.voice and old_player.voice.channel and old_player.voice.channel.category_id == vzp_data.category_id:
+            await disconnect_from_voice(old_player)
+    elif vzp_data.category_id and vzp_data.status == 'VZP IN PROCESS':
         category = interaction.guild.get_channel(vzp_data.category_id)
         if category:
             try:
@@ -1177,14 +3629,12 @@ async def swap_player(interaction: discord.Interaction, vzp_id: str, old_player:
                 voice_channels = [ch for ch in category.voice_channels if isinstance(ch, discord.VoiceChannel)]
                 for voice_channel in voice_channels:
                     if old_player in voice_channel.members:
-                        try:
-                            await old_player.move_to(None)
-                        except:
-                            pass
+                        await disconnect_from_voice(old_player)
             except Exception as e:
-                print(f"⚠️ Ошибка обновления прав: {e}")
+                log.warning(f"⚠️ Ошибка обновления прав: {e}")
     
     await update_vzp_message(vzp_id)
+    schedule_voice_board_refresh(vzp_id, [old_player.id, new_player.id])
     
     success_embed = discord.Embed(
         title="ЗАМЕНА ИГРОКА ВЫПОЛНЕНА",
@@ -1203,37 +3653,31 @@ async def swap_player(interaction: discord.Interaction, vzp_id: str, old_player:
     
     await interaction.followup.send(embed=success_embed, ephemeral=True)
     
-    try:
-        old_embed = discord.Embed(
-            title="ВЫ ЗАМЕНЕНЫ В VZП",
-            color=0xFFA500,
-            timestamp=datetime.now()
-        )
-        old_embed.add_field(name="ID VZП", value=vzp_id, inline=False)
-        old_embed.add_field(name="Время", value=vzp_data.time, inline=True)
-        old_embed.add_field(name="Ваша замена", value=new_player.display_name, inline=False)
-        old_embed.add_field(name="Статус", value="Заменили", inline=True)
-        old_embed.set_footer(text=f"VZП Manager | {datetime.now().strftime('%d.%m.%Y %H:%M')}")
-        await old_player.send(embed=old_embed)
-    except:
-        pass
-    
-    try:
-        new_embed = discord.Embed(
-            title="ВЫ ЗАМЕНИЛИ ИГРОКА В VZП",
-            color=0x00FF00,
-            timestamp=datetime.now()
-        )
-        new_embed.add_field(name="ID VZП", value=vzp_id, inline=False)
-        new_embed.add_field(name="Время", value=vzp_data.time, inline=True)
-        new_embed.add_field(name="Вы заменили", value=old_player.display_name, inline=False)
-        new_embed.add_field(name="Статус", value="Вы в списке", inline=True)
-        new_embed.set_footer(text=f"VZП Manager | {datetime.now().strftime('%d.%m.%Y %H:%M')}")
-        await new_player.send(embed=new_embed)
-    except:
-        pass
-    
-    save_data()
+    old_embed = discord.Embed(
+        title="ВЫ ЗАМЕНЕНЫ В VZП",
+        color=0xFFA500,
+        timestamp=datetime.now()
+    )
+    old_embed.add_field(name="ID VZП", value=vzp_id, inline=False)
+    old_embed.add_field(name="Время", value=vzp_data.time, inline=True)
+    old_embed.add_field(name="Ваша замена", value=new_player.display_name, inline=False)
+    old_embed.add_field(name="Статус", value="Заменили", inline=True)
+    old_embed.set_footer(text=f"VZП Manager | {datetime.now().strftime('%d.%m.%Y %H:%M')}")
+    await send_dm(old_player, embed=old_embed)
+    
+    new_embed = discord.Embed(
+        title="ВЫ ЗАМЕНИЛИ ИГРОКА В VZП",
+        color=0x00FF00,
+        timestamp=datetime.now()
+    )
+    new_embed.add_field(name="ID VZП", value=vzp_id, inline=False)
+    new_embed.add_field(name="Время", value=vzp_data.time, inline=True)
+    new_embed.add_field(name="Вы заменили", value=old_player.display_name, inline=False)
+    new_embed.add_field(name="Статус", value="Вы в списке", inline=True)
+    new_embed.set_footer(text=f"VZП Manager | {datetime.now().strftime('%d.%m.%Y %H:%M')}")
+    await send_dm(new_player, embed=new_embed)
+    
+    save_data(interaction.guild_id)
 
 @bot.tree.command(name="close_vzp", description="Закрыть VZP (удалить категорию, уведомить и записать результат)")
 @app_commands.describe(
@@ -1248,10 +3692,11 @@ async def swap_player(interaction: discord.Interaction, vzp_id: str, old_player:
         app_commands.Choice(name="LOSE", value="lose"),
     ]
 )
+@app_commands.autocomplete(vzp_id=vzp_id_autocomplete)
 async def close_vzp(interaction: discord.Interaction, vzp_id: str, enemy: str, result: app_commands.Choice[str], amount: int):
     if not await is_allowed_channel(interaction):
         await interaction.response.send_message(
-            f"❌ Эту команду можно использовать только в канале <#{ALLOWED_CHANNEL}>!",
+            f"❌ Эту команду можно использовать только в канале <#{get_guild_config(interaction.guild_id).allowed_channel}>!",
             ephemeral=True
         )
         return
@@ -1263,7 +3708,7 @@ async def close_vzp(interaction: discord.Interaction, vzp_id: str, enemy: str, r
         )
         return
     
-    if vzp_id not in active_vzp:
+    if not vzp_in_guild(vzp_id, interaction.guild_id):
         await interaction.response.send_message(
             f"❌ VZP с ID `{vzp_id}` не найдена!",
             ephemeral=True
@@ -1280,34 +3725,17 @@ async def close_vzp(interaction: discord.Interaction, vzp_id: str, enemy: str, r
     vzp_data.result = result.value
     vzp_data.amount = amount
     
-    await update_vzp_message(vzp_id)
+    with span("update_vzp_message", vzp_id=vzp_id):
+        await update_vzp_message(vzp_id)
     
     guild = interaction.guild
-    deleted_count = 0
+    category_id = vzp_data.category_id
+    role_id = vzp_data.role_id
     
-    if vzp_data.category_id:
-        try:
-            category = guild.get_channel(vzp_data.category_id)
-            if category:
-                for channel in category.channels:
-                    try:
-                        await channel.delete()
-                        deleted_count += 1
-                        await asyncio.sleep(0.1)
-                    except:
-                        pass
-                
-                try:
-                    await category.delete()
-                    deleted_count += 1
-                except:
-                    pass
-        except:
-            pass
-    
-    participants_count = await post_vzp_result(vzp_id, result.value, amount, guild)
+    with span("post_vzp_result", vzp_id=vzp_id):
+        participants_count = await post_vzp_result(vzp_id, result.value, amount, guild)
     
-    closed_vzp[vzp_id] = {
+    record = closed_vzp.setdefault(guild.id, {})[vzp_id] = {
         'time': vzp_data.time,
         'enemy': vzp_data.enemy,
         'members': vzp_data.members,
@@ -1315,10 +3743,20 @@ async def close_vzp(interaction: discord.Interaction, vzp_id: str, enemy: str, r
         'amount': amount,
         'participants': len(vzp_data.plus_users),
         'all_participants': participants_count,
-        'closed_at': datetime.now().isoformat()
+        'closed_at': datetime.now().isoformat(),
+        'roster': {str(user_id): tier for user_id, tier in vzp_data.plus_users.items()},
+        'swaps': {str(old_id): new_id for old_id, new_id in swap_history.get(vzp_id, {}).items()}
     }
+    voice_totals = finish_voice_sessions(vzp_id)
+    if voice_totals:
+        record['voice_seconds'] = {str(user_id): seconds for user_id, seconds in voice_totals.items()}
+    index_closed_vzp(guild.id, record)
+    leaderboard_changed = update_leaderboards(guild.id, record)
     
     del active_vzp[vzp_id]
+    invalidate_roster(vzp_id)
+    invalidate_vzp_index()
+    cancel_vzp_jobs(vzp_id)
     
     if vzp_id in swap_history:
         del swap_history[vzp_id]
@@ -1329,26 +3767,35 @@ async def close_vzp(interaction: discord.Interaction, vzp_id: str, enemy: str, r
     if vzp_id in position_messages:
         del position_messages[vzp_id]
     
-    save_data()
+    save_data(interaction.guild_id)
     
     # Отправляем финальный ответ
     await interaction.followup.send(
         f"VZP `{vzp_id}` успешно закрыта!\n"
         f"Результат: **{result.name}**\n"
         f"Противник: **{enemy}**\n"
-        f"Точки: **{amount}**\n"
+        f"Точки: **{amount}**\n",
         ephemeral=True
     )
+    
+    # Каналы удаляются в фоне, админ уже получил ответ
+    if category_id:
+        schedule_category_teardown(guild, category_id, vzp_id)
+    if role_id:
+        run_in_background(delete_vzp_role(guild, role_id))
+    if leaderboard_changed:
+        run_in_background(refresh_leaderboard_message(guild))
 
 @bot.tree.command(name="del_list", description="Удалить пользователя(ей) из списка VZP")
 @app_commands.describe(
     members="Пользователи (можно выбрать нескольких)",
     vzp_id="ID VZP"
 )
+@app_commands.autocomplete(vzp_id=vzp_id_autocomplete)
 async def del_list(interaction: discord.Interaction, members: str, vzp_id: str):
     if not await is_allowed_channel(interaction):
         await interaction.response.send_message(
-            f"❌ Эту команду можно использовать только в канале <#{ALLOWED_CHANNEL}>!",
+            f"❌ Эту команду можно использовать только в канале <#{get_guild_config(interaction.guild_id).allowed_channel}>!",
             ephemeral=True
         )
         return
@@ -1360,7 +3807,7 @@ async def del_list(interaction: discord.Interaction, members: str, vzp_id: str):
         )
         return
     
-    if vzp_id not in active_vzp:
+    if not vzp_in_guild(vzp_id, interaction.guild_id):
         await interaction.response.send_message(
             f"❌ VZP с ID `{vzp_id}` не найдена!",
             ephemeral=True
@@ -1375,8 +3822,8 @@ async def del_list(interaction: discord.Interaction, members: str, vzp_id: str):
             try:
                 member_id = int(part.strip('<@!>'))
                 member_ids.append(member_id)
-            except:
-                pass
+            except ValueError:
+                pass  # Упоминание роли или канала, а не участника
     
     if not member_ids:
         await interaction.response.send_message(
@@ -1408,18 +3855,18 @@ async def del_list(interaction: discord.Interaction, members: str, vzp_id: str):
         
         deleted_members.append(member_id)
         
-        try:
-            member = interaction.guild.get_member(member_id)
-            if member:
-                notify_embed = discord.Embed(
-                    title="❌ ВАС УДАЛИЛИ ИЗ СПИСКА VZP",
-                    color=discord.Color.red()
-                )
-                notify_embed.add_field(name="ID VZP", value=vzp_id, inline=False)
-                notify_embed.add_field(name="Причина", value="Удалён администратором", inline=False)
-                await member.send(embed=notify_embed)
-        except:
-            pass
+        if vzp_data.role_id:
+            queue_role_change(interaction.guild, vzp_data.role_id, member_id, False)
+        
+        member = interaction.guild.get_member(member_id)
+        if member:
+            notify_embed = discord.Embed(
+                title="❌ ВАС УДАЛИЛИ ИЗ СПИСКА VZP",
+                color=discord.Color.red()
+            )
+            notify_embed.add_field(name="ID VZP", value=vzp_id, inline=False)
+            notify_embed.add_field(name="Причина", value="Удалён администратором", inline=False)
+            await send_dm(member, embed=notify_embed)
     
     if not deleted_members:
         await interaction.response.send_message(
@@ -1429,7 +3876,8 @@ async def del_list(interaction: discord.Interaction, members: str, vzp_id: str):
         return
     
     await update_vzp_message(vzp_id)
-    save_data()
+    schedule_voice_board_refresh(vzp_id, deleted_members)
+    save_data(interaction.guild_id)
     
     members_text = ", ".join([f"<@{id}>" for id in deleted_members])
     await interaction.response.send_message(
@@ -1442,10 +3890,11 @@ async def del_list(interaction: discord.Interaction, members: str, vzp_id: str):
     vzp_id="ID VZP",
     member="Пользователь"
 )
+@app_commands.autocomplete(vzp_id=vzp_id_autocomplete)
 async def add_vzp(interaction: discord.Interaction, vzp_id: str, member: discord.Member):
     if not await is_allowed_channel(interaction):
         await interaction.response.send_message(
-            f"❌ Эту команду можно использовать только в канале <#{ALLOWED_CHANNEL}>!",
+            f"❌ Эту команду можно использовать только в канале <#{get_guild_config(interaction.guild_id).allowed_channel}>!",
             ephemeral=True
         )
         return
@@ -1457,7 +3906,7 @@ async def add_vzp(interaction: discord.Interaction, vzp_id: str, member: discord
         )
         return
     
-    if vzp_id not in active_vzp:
+    if not vzp_in_guild(vzp_id, interaction.guild_id):
         await interaction.response.send_message(
             f"❌ VZP с ID `{vzp_id}` не найдена!",
             ephemeral=True
@@ -1491,7 +3940,9 @@ async def add_vzp(interaction: discord.Interaction, vzp_id: str, member: discord
     vzp_data.plus_users[member.id] = tier
     
     # Выдача прав категории, если VZP запущена
-    if vzp_data.category_id and vzp_data.status == 'VZP IN PROCESS':
+    if vzp_data.role_id and vzp_data.status == 'VZP IN PROCESS':
+        queue_role_change(interaction.guild, vzp_data.role_id, member.id, True)
+    elif vzp_data.category_id and vzp_data.status == 'VZP IN PROCESS':
         category = interaction.guild.get_channel(vzp_data.category_id)
         if category:
             try:
@@ -1502,23 +3953,21 @@ async def add_vzp(interaction: discord.Interaction, vzp_id: str, member: discord
                     speak=True
                 )
             except Exception as e:
-                print(f"⚠️ Ошибка выдачи прав категории: {e}")
+                log.warning(f"⚠️ Ошибка выдачи прав категории: {e}")
     
     await update_vzp_message(vzp_id)
-    save_data()
+    schedule_voice_board_refresh(vzp_id, [member.id])
+    save_data(interaction.guild_id)
     
-    try:
-        notify_embed = discord.Embed(
-            title="✅ ВАС ДОБАВИЛИ В VZP",
-            color=discord.Color.green()
-        )
-        notify_embed.add_field(name="ID VZP", value=vzp_id, inline=False)
-        notify_embed.add_field(name="Время", value=vzp_data.time, inline=False)
-        notify_embed.add_field(name="Добавил", value=interaction.user.display_name, inline=False)
-        notify_embed.add_field(name="Статус", value=vzp_data.status, inline=False)
-        await member.send(embed=notify_embed)
-    except:
-        pass
+    notify_embed = discord.Embed(
+        title="✅ ВАС ДОБАВИЛИ В VZP",
+        color=discord.Color.green()
+    )
+    notify_embed.add_field(name="ID VZP", value=vzp_id, inline=False)
+    notify_embed.add_field(name="Время", value=vzp_data.time, inline=False)
+    notify_embed.add_field(name="Добавил", value=interaction.user.display_name, inline=False)
+    notify_embed.add_field(name="Статус", value=vzp_data.status, inline=False)
+    await send_dm(member, embed=notify_embed)
     
     await interaction.response.send_message(
         f"✅ {member.mention} добавлен в VZP `{vzp_id}`!",
@@ -1530,6 +3979,7 @@ async def add_vzp(interaction: discord.Interaction, vzp_id: str, member: discord
     positions="Количество позиций (от 1 до 100)",
     vzp_id="ID VZP (не обязательно)"
 )
+@app_commands.autocomplete(vzp_id=vzp_id_autocomplete)
 async def call_vzp(interaction: discord.Interaction, positions: int, vzp_id: str = None):
     if not await has_high_role(interaction):
         await interaction.response.send_message(
@@ -1545,7 +3995,7 @@ async def call_vzp(interaction: discord.Interaction, positions: int, vzp_id: str
         )
         return
     
-    if vzp_id and vzp_id not in active_vzp:
+    if vzp_id and not vzp_in_guild(vzp_id, interaction.guild_id):
         await interaction.response.send_message(
             f"❌ VZP с ID `{vzp_id}` не найдена!",
             ephemeral=True
@@ -1560,12 +4010,14 @@ async def call_vzp(interaction: discord.Interaction, positions: int, vzp_id: str
         "pos_id": pos_id,
         "vzp_id": vzp_id,
         "created_by": interaction.user.id,
-        "created_at": datetime.now().isoformat()
+        "created_at": datetime.now().isoformat(),
+        "guild_id": interaction.guild_id
     }
     
     position_messages[pos_id] = {
         "message_id": 0,
-        "channel_id": interaction.channel_id
+        "channel_id": interaction.channel_id,
+        "guild_id": interaction.guild_id
     }
     
     lines = []
@@ -1603,7 +4055,7 @@ async def call_vzp(interaction: discord.Interaction, positions: int, vzp_id: str
     
     position_messages[pos_id]["message_id"] = message.id
     
-    save_data()
+    save_data(interaction.guild_id)
 
 @bot.tree.command(name="clear_positions", description="Очистить все позиции в текущем канале")
 async def clear_positions(interaction: discord.Interaction):
@@ -1650,6 +4102,9 @@ async def close_positions(interaction: discord.Interaction):
     pos_id = pos_info["pos_id"]
     
     del active_position_calls[interaction.channel_id]
+    if pos_id in position_messages:
+        # Закрытое распределение удалит очистка через CLOSED_BOARD_TTL_HOURS
+        position_messages[pos_id]["closed_at"] = time_module.time()
     
     positions = position_assignments.get(pos_id, {})
     occupied = [pos for pos, member in positions.items() if member]
@@ -1690,23 +4145,354 @@ async def close_positions(interaction: discord.Interaction):
     embed.set_footer(text=f"Завершил: {interaction.user.display_name}")
     
     await interaction.response.send_message(embed=embed)
+    save_data(interaction.guild_id)
+
+@bot.tree.command(name="stats", description="Статистика игрока по закрытым VZP")
+@app_commands.describe(member="Игрок (по умолчанию - вы)")
+async def stats(interaction: discord.Interaction, member: discord.Member = None):
+    target = member or interaction.user
+    player = player_stats.get(interaction.guild_id, {}).get(target.id)
+    
+    if not player:
+        await interaction.response.send_message(
+            f"📭 У {target.mention} ещё нет сыгранных VZP",
+            ephemeral=True
+        )
+        return
+    
+    decided = player['wins'] + player['losses']
+    winrate = f"{player['wins'] * 100 // decided}%" if decided else "—"
+    
+    embed = discord.Embed(
+        title=f"📊 СТАТИСТИКА {target.display_name}",
+        color=discord.Color.blue()
+    )
+    embed.add_field(
+        name="VZP",
+        value=f"**Сыграно:** {player['played']}\n"
+              f"**Побед:** {player['wins']}\n"
+              f"**Поражений:** {player['losses']}\n"
+              f"**Винрейт:** {winrate}",
+        inline=True
+    )
+    embed.add_field(
+        name="ОЧКИ",
+        value=f"**Точек:** {player['points']}\n"
+              f"**Заменён:** {player['swapped_out']} раз",
+        inline=True
+    )
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="leaderboard", description="Таблица лидеров VZP")
+@app_commands.describe(
+    metric="По какому показателю",
+    window="За какой период"
+)
+@app_commands.choices(
+    metric=[app_commands.Choice(name=name, value=value) for value, name in LEADERBOARD_METRICS.items()],
+    window=[app_commands.Choice(name=name, value=value) for value, name in LEADERBOARD_WINDOWS.items()]
+)
+async def leaderboard(interaction: discord.Interaction, metric: app_commands.Choice[str], window: app_commands.Choice[str] = None):
+    window_value = window.value if window else 'all'
+    
+    embed = discord.Embed(
+        title=f"🏆 {LEADERBOARD_METRICS[metric.value]} — {LEADERBOARD_WINDOWS[window_value]}",
+        description=format_leaderboard(interaction.guild_id, window_value, metric.value),
+        color=discord.Color.gold()
+    )
+    embed.set_footer(text=f"Топ-{LEADERBOARD_SIZE}")
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="export_vzp", description="Выгрузить историю VZP в CSV/JSONL")
+@app_commands.describe(
+    format="Формат файла",
+    date_from="С даты (ДД.ММ.ГГГГ)",
+    date_to="По дату (ДД.ММ.ГГГГ)",
+    enemy="Противник (часть имени)",
+    result="Результат"
+)
+@app_commands.choices(
+    format=[
+        app_commands.Choice(name="CSV", value="csv"),
+        app_commands.Choice(name="JSONL", value="jsonl")
+    ],
+    result=[
+        app_commands.Choice(name="WIN", value="win"),
+        app_commands.Choice(name="LOSE", value="lose"),
+    ]
+)
+async def export_vzp(
+    interaction: discord.Interaction,
+    format: app_commands.Choice[str],
+    date_from: str = None,
+    date_to: str = None,
+    enemy: str = None,
+    result: app_commands.Choice[str] = None
+):
+    if not await has_high_role(interaction):
+        await interaction.response.send_message(
+            "❌ У вас нет прав для этой команды!",
+            ephemeral=True
+        )
+        return
+    
+    try:
+        parsed_from = parse_export_date(date_from)
+        parsed_to = parse_export_date(date_to)
+    except ValueError:
+        await interaction.response.send_message(
+            "❌ Даты указываются в формате ДД.ММ.ГГГГ!",
+            ephemeral=True
+        )
+        return
+    
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    
+    # Снимок ссылок на записи: закрытие VZP во время выгрузки не сломает итерацию
+    rows = iter_export_rows(list(closed_vzp.get(interaction.guild_id, {}).items()), parsed_from, parsed_to, enemy, result.value if result else None)
+    export_dir = tempfile.mkdtemp(prefix="vzp_export_")
+    filename = f"vzp_history_{datetime.now().strftime('%Y%m%d_%H%M')}.{format.value}"
+    
+    try:
+        path, count = await asyncio.to_thread(export_to_file, rows, format.value, os.path.join(export_dir, filename))
+        
+        if not count:
+            await interaction.followup.send("📭 Нет VZP, подходящих под фильтры", ephemeral=True)
+            return
+        
+        await interaction.followup.send(
+            f"📤 Выгружено VZP: **{count}**",
+            file=discord.File(path),
+            ephemeral=True
+        )
+    except Exception as e:
+        log.exception(f"❌ Ошибка выгрузки истории: {e}")
+        await interaction.followup.send(f"❌ Ошибка выгрузки: {e}", ephemeral=True)
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+
+@bot.tree.command(name="profile", description="Профилировать бота N секунд (для админов)")
+@app_commands.describe(
+    seconds="Длительность профилирования в секундах",
+    mode="cProfile - точные вызовы, sampling - выборка стека без замедления"
+)
+@app_commands.choices(
+    mode=[
+        app_commands.Choice(name="cProfile", value="cprofile"),
+        app_commands.Choice(name="sampling", value="sampling")
+    ]
+)
+async def profile(interaction: discord.Interaction, seconds: app_commands.Range[int, 1, 300] = 30, mode: app_commands.Choice[str] = None):
+    global profiling_active
+    
+    if not await has_high_role(interaction):
+        await interaction.response.send_message(
+            "❌ У вас нет прав для этой команды!",
+            ephemeral=True
+        )
+        return
+    
+    if profiling_active:
+        await interaction.response.send_message(
+            "❌ Профилирование уже идёт, дождитесь его окончания!",
+            ephemeral=True
+        )
+        return
+    
+    mode_value = mode.value if mode else 'cprofile'
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    
+    profiling_active = True
+    try:
+        path, top = await run_profiler(mode_value, seconds)
+    finally:
+        profiling_active = False
+    
+    log.info(f"Профиль сохранён: {path}", extra={"mode": mode_value, "seconds": seconds})
+    
+    report = "\n".join(top) if top else "нет данных"
+    if len(report) > 1800:
+        report = report[:1800] + "\n..."
+    await interaction.followup.send(
+        f"⏱️ Профиль за {seconds} с (`{mode_value}`) сохранён в `{path}`\n"
+        f"```\n{report}\n```",
+        ephemeral=True
+    )
+
+@bot.tree.command(name="bot_stats", description="Состояние бота: задержка цикла событий и зависания (для админов)")
+async def bot_stats(interaction: discord.Interaction):
+    if not await has_high_role(interaction):
+        await interaction.response.send_message(
+            "❌ У вас нет прав для этой команды!",
+            ephemeral=True
+        )
+        return
+    
+    embed = discord.Embed(title="🩺 Состояние бота", color=discord.Color.blurple())
+    
+    lag = loop_watchdog.percentiles()
+    if lag:
+        embed.add_field(
+            name=f"⏳ Задержка цикла ({len(loop_watchdog.samples)} замеров)",
+            value=(
+                f"p50: **{lag['0.5'] * 1000:.1f}** мс\n"
+                f"p95: **{lag['0.95'] * 1000:.1f}** мс\n"
+                f"p99: **{lag['0.99'] * 1000:.1f}** мс\n"
+                f"max: **{lag['1'] * 1000:.1f}** мс"
+            ),
+            inline=True
+        )
+    
+    embed.add_field(
+        name="🧊 Зависания",
+        value=f"Дольше {LOOP_BLOCK_THRESHOLD * 1000:.0f} мс: **{loop_watchdog.stalls}**",
+        inline=True
+    )
+    embed.add_field(
+        name="📡 Discord API",
+        value=(
+            f"Запросов: **{sum(REST_REQUESTS.values.values()):.0f}**\n"
+            f"429: **{sum(REST_RATE_LIMITED.values.values()):.0f}**\n"
+            f"Пинг шлюза: **{bot.latency * 1000:.0f}** мс"
+        ),
+        inline=True
+    )
+    
+    if SHARD_MODE != 'single':
+        lines = []
+        for shard_id, health in sorted(shard_health().items()):
+            latency = f"{health['latency_ms']:.0f} мс" if health['latency_ms'] is not None else "—"
+            lines.append(f"{'🟢' if health['connected'] else '🔴'} #{shard_id}: {latency}, серверов {health['guilds']}, "
+                         f"VZP {health['active_vzp']}, отключений {health['disconnects']}")
+        embed.add_field(name=f"🧩 Шарды ({SHARD_MODE})", value="\n".join(lines), inline=False)
+    
+    if last_sweep["at"]:
+        freed = last_sweep["freed"]
+        embed.add_field(
+            name=f"🧹 Очистка ({last_sweep['at'].strftime('%H:%M:%S')}, {last_sweep['duration_ms']:.0f} мс)",
+            value=", ".join(f"{kind}: **{count}**" for kind, count in sorted(freed.items())) if freed else "Нечего удалять",
+            inline=False
+        )
+    
+    stall = loop_watchdog.last_stall
+    if stall:
+        where = "\n".join(stall['where'])
+        embed.add_field(
+            name=f"🔍 Последнее зависание ({stall['at'].strftime('%d.%m %H:%M:%S')}, {stall['blocked_ms']} мс)",
+            value=f"Задача: `{stall['task'] or '-'}`\n```\n{where}\n```",
+            inline=False
+        )
+    
+    embed.set_footer(text=f"Серверов: {len(bot.guilds)} | Активных VZP: {len(active_vzp)} | Распределений позиций: {len(active_position_calls)}")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="vzp_config", description="Настройки VZP для этого сервера")
+@app_commands.describe(
+    allowed_channel="Канал для команд VZP",
+    stats_channel="Канал для результатов и таблицы лидеров",
+    admin_role="Добавить или убрать админскую роль VZP",
+    tier1_role="Роль TIER 1",
+    tier2_role="Роль TIER 2",
+    tier3_role="Роль TIER 3",
+    max_active="Лимит одновременно активных VZP",
+    max_participants="Лимит участников одной VZP"
+)
+async def vzp_config(
+    interaction: discord.Interaction,
+    allowed_channel: discord.TextChannel = None,
+    stats_channel: discord.TextChannel = None,
+    admin_role: discord.Role = None,
+    tier1_role: discord.Role = None,
+    tier2_role: discord.Role = None,
+    tier3_role: discord.Role = None,
+    max_active: app_commands.Range[int, 1, 50] = None,
+    max_participants: app_commands.Range[int, 1, MAX_PARTICIPANTS_LIMIT] = None
+):
+    if interaction.guild is None:
+        await interaction.response.send_message("❌ Эта команда работает только на сервере!", ephemeral=True)
+        return
+    
+    # На новом сервере админских ролей VZP ещё нет - настраивать может и управляющий сервером
+    if not await has_high_role(interaction) and not interaction.user.guild_permissions.manage_guild:
+        await interaction.response.send_message(
+            "❌ У вас нет прав для этой команды!",
+            ephemeral=True
+        )
+        return
+    
+    guild_id = interaction.guild_id
+    config = get_guild_config(guild_id)
+    changes = []
+    
+    if allowed_channel:
+        config.allowed_channel = allowed_channel.id
+        changes.append(f"канал команд → {allowed_channel.mention}")
+    if stats_channel:
+        config.stats_channel = stats_channel.id
+        changes.append(f"канал статистики → {stats_channel.mention}")
+    if admin_role:
+        if admin_role.id in config.high_roles:
+            config.high_roles.remove(admin_role.id)
+            changes.append(f"убрана админская роль {admin_role.mention}")
+        else:
+            config.high_roles.append(admin_role.id)
+            changes.append(f"добавлена админская роль {admin_role.mention}")
+    for tier_num, role in ((1, tier1_role), (2, tier2_role), (3, tier3_role)):
+        if role:
+            config.tier_roles[tier_num] = role.id
+            changes.append(f"TIER {tier_num} → {role.mention}")
+    if max_active:
+        config.max_active_vzp = max_active
+        changes.append(f"лимит активных VZP → {max_active}")
+    if max_participants:
+        config.max_participants = max_participants
+        config.min_participants = min(config.min_participants, max_participants)
+        changes.append(f"лимит участников → {max_participants}")
+    
+    if changes:
+        config.reindex()
+        forget_guild_eligibility(guild_id)
+        save_guild_config(guild_id)
+        log.info(f"⚙️ Настройки сервера изменены: {'; '.join(changes)}", extra={"guild_id": guild_id, "user_id": interaction.user.id})
+    
+    embed = discord.Embed(title="⚙️ НАСТРОЙКИ VZP СЕРВЕРА", color=discord.Color.blurple())
+    embed.add_field(
+        name="КАНАЛЫ",
+        value=f"**Команды:** <#{config.allowed_channel}>\n"
+              f"**Статистика:** <#{config.stats_channel}>",
+        inline=False
+    )
+    embed.add_field(
+        name="РОЛИ",
+        value=f"**Админы:** {', '.join(f'<@&{role_id}>' for role_id in config.high_roles) or '—'}\n" +
+              "\n".join(f"**TIER {tier_num}:** <@&{role_id}>" for tier_num, role_id in sorted(config.tier_roles.items())),
+        inline=False
+    )
+    embed.add_field(
+        name="ЛИМИТЫ",
+        value=f"**Активных VZP:** {len(guild_active_vzp(guild_id))}/{config.max_active_vzp}\n"
+              f"**Участников VZP:** {config.min_participants}-{config.max_participants}",
+        inline=False
+    )
+    if changes:
+        embed.add_field(name="ИЗМЕНЕНО", value="\n".join(f"• {change}" for change in changes), inline=False)
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="list_vzp", description="Показать активные VZP")
 async def list_vzp(interaction: discord.Interaction):
-    if not active_vzp:
+    guild_vzp = guild_active_vzp(interaction.guild_id)
+    if not guild_vzp:
         await interaction.response.send_message("📭 Нет активных VZP", ephemeral=True)
         return
     
     embed = discord.Embed(title="📋 АКТИВНЫЕ VZP", color=discord.Color.blue())
     
-    for vzp_id, vzp_data in active_vzp.items():
+    for vzp_id, vzp_data in guild_vzp.items():
         status = vzp_data.status
-        status_emoji = {
-            'OPEN': '🟢',
-            'LIST IN PROCESS': '🟡',
-            'VZP IN PROCESS': '🔵',
-            'CLOSED': '🔴'
-        }.get(status, '⚪')
+        status_emoji = VZP_STATUS_EMOJI.get(status, '⚪')
         
         created_date = datetime.fromisoformat(vzp_data.created_at).strftime("%d.%m %H:%M")
         
@@ -1723,7 +4509,7 @@ async def list_vzp(interaction: discord.Interaction):
         inline=False
     )
     
-    embed.set_footer(text=f"Всего активных VZP: {len(active_vzp)}")
+    embed.set_footer(text=f"Всего активных VZP: {len(guild_vzp)}")
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="ping", description="Пингануть всех участников")
@@ -1738,10 +4524,8 @@ async def ping(interaction: discord.Interaction):
     await interaction.response.defer(ephemeral=True)
     
     try:
-        for i in range(5):
-            await interaction.channel.send("@everyone")
-            await asyncio.sleep(0.2)
-    except Exception as e:
+        await send_pings(interaction.channel)
+    except discord.HTTPException as e:
         await interaction.followup.send(
             f"❌ Ошибка отправки: {e}",
             ephemeral=True
@@ -1772,7 +4556,7 @@ async def voice_status(interaction: discord.Interaction):
     
     try:
         vzp_id = category.name.split("VZP ID - ")[1].strip()
-    except:
+    except IndexError:
         await interaction.response.send_message(
             "❌ Не удалось определить VZP ID из названия категории!",
             ephemeral=True
@@ -1802,91 +4586,30 @@ async def voice_status(interaction: discord.Interaction):
         )
         return
     
-    all_players = set(vzp_data.plus_users.keys())
-    
-    vzp_swaps = swap_history.get(vzp_id, {})
-    for new_user_id in vzp_swaps.values():
-        all_players.add(new_user_id)
-    
-    players_in_voice = set()
+    # Панель живёт в канале vzp call и обновляется по голосовым событиям, здесь только ссылка на неё
+    if not vzp_data.call_channel_id:
+        call_channel = discord.utils.get(category.text_channels, name="vzp call")
+        vzp_data.call_channel_id = call_channel.id if call_channel else channel.id
     
-    voice_channels = [ch for ch in category.channels if isinstance(ch, discord.VoiceChannel)]
-    for voice_channel in voice_channels:
-        for member in voice_channel.members:
-            players_in_voice.add(member.id)
-    
-    embed = discord.Embed(
-        title=f"ГОЛОСОВАЯ АКТИВНОСТЬ VZP {vzp_id}",
-        color=discord.Color.purple(),
-        timestamp=datetime.now()
-    )
+    if vzp_data.voice_board_message_id:
+        schedule_voice_board_refresh(vzp_id)
+    else:
+        await post_voice_board(vzp_id)
+        save_data(interaction.guild_id)
     
-    attack_def_display = vzp_data.attack_def_name.split(' ')[1] if ' ' in vzp_data.attack_def_name else vzp_data.attack_def_name
+    board_channel = bot.get_channel(vzp_data.call_channel_id)
+    if not vzp_data.voice_board_message_id or not board_channel:
+        await interaction.response.send_message(
+            "❌ Не удалось опубликовать панель голосовой активности!",
+            ephemeral=True
+        )
+        return
     
-    embed.add_field(
-        name="ИНФОРМАЦИЯ",
-        value=f"**Участников:** {len(all_players)}\n"
-              f"**В голосовом:** {len(players_in_voice)}/{len(all_players)}",
-        inline=False
+    board_url = board_channel.get_partial_message(vzp_data.voice_board_message_id).jump_url
+    await interaction.response.send_message(
+        f"📋 Голосовая активность VZP `{vzp_id}` обновляется автоматически: {board_url}",
+        ephemeral=True
     )
-    
-    players_list = []
-    sorted_players = sorted(all_players)
-    
-    for i, user_id in enumerate(sorted_players, 1):
-        member = interaction.guild.get_member(user_id)
-        if member:
-            status_circle = "🟢" if user_id in players_in_voice else "🔴"
-            players_list.append(f"{i} - {member.mention} {status_circle}")
-        else:
-            players_list.append(f"{i} - <@{user_id}> 🔴")
-    
-    if players_list:
-        players_text = "\n".join(players_list)
-        
-        if len(players_text) > 1024:
-            chunk_size = 20
-            chunks = [players_list[i:i + chunk_size] for i in range(0, len(players_list), chunk_size)]
-            
-            for i, chunk in enumerate(chunks, 1):
-                chunk_text = "\n".join(chunk)
-                embed.add_field(
-                    name=f"👥 УЧАСТНИКИ (часть {i})" if len(chunks) > 1 else "👥 УЧАСТНИКИ",
-                    value=chunk_text,
-                    inline=False
-                )
-        else:
-            embed.add_field(
-                name="👥 УЧАСТНИКИ",
-                value=players_text,
-                inline=False
-            )
-    
-    vzp_swaps = swap_history.get(vzp_id, {})
-    if vzp_swaps:
-        swap_list = []  # Переименовано с swap_info на swap_list для согласованности
-        for old_user_id, new_user_id in vzp_swaps.items():
-            old_member = interaction.guild.get_member(old_user_id)
-            new_member = interaction.guild.get_member(new_user_id)
-            
-            old_name = old_member.mention if old_member else f"<@{old_user_id}>"
-            new_name = new_member.mention if new_member else f"<@{new_user_id}>"
-            
-            status_circle = "🟢" if new_user_id in players_in_voice else "🔴"
-            swap_list.append(f"• {new_name} {status_circle} → {old_name}")
-        
-        if swap_list:  # Исправлено с swap_info на swap_list
-            embed.add_field(
-                name="**🔄 ЗАМЕНЫ**",
-                value="\n".join(swap_list),
-                inline=False
-            )
-    
-    embed.description = "▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬▬\n\n"
-    
-    embed.set_footer(text=f"Категория: {category.name} | Обновлено: {datetime.now().strftime('%H:%M:%S')}")
-    
-    await interaction.response.send_message(embed=embed)
 
 @bot.tree.command(name="help_vzp", description="Помощь по командам VZP бота")
 async def help_vzp(interaction: discord.Interaction):
@@ -1895,20 +4618,28 @@ async def help_vzp(interaction: discord.Interaction):
         color=discord.Color.purple()
     )
     
+    allowed_channel = get_guild_config(interaction.guild_id).allowed_channel
     commands_list = [
-        ("`/vzp_start`", "Создать новую VZP с условиями забива", f"Только в <#{ALLOWED_CHANNEL}>"),
-        ("`/start_vzp`", "Запустить VZP (создать категорию)", f"Только в <#{ALLOWED_CHANNEL}>"),
-        ("`/close_vzp`", "Закрыть VZP (удалить категорию и записать результат)", f"Только в <#{ALLOWED_CHANNEL}>"),
-        ("`/stop_reactions`", "Остановить приём заявок", f"Только в <#{ALLOWED_CHANNEL}>"),
-        ("`/return_reactions`", "Возобновить приём заявок", f"Только в <#{ALLOWED_CHANNEL}>"),
-        ("`/swap_player`", "Заменить игрока в VZP", f"Только в <#{ALLOWED_CHANNEL}>"),
-        ("`/del_list`", "Удалить пользователя(ей) из списка", f"Только в <#{ALLOWED_CHANNEL}>"),
-        ("`/add_vzp`", "Добавить пользователя в VZP (работает даже во время VZP)", f"Только в <#{ALLOWED_CHANNEL}>"),
+        ("`/vzp_start`", f"Создать новую VZP с условиями забива. Напоминание в ЛС за {REMINDER_MINUTES} мин, "
+                         "auto_stop/auto_start - закрыть заявки и запустить VZP по времени", f"Только в <#{allowed_channel}>"),
+        ("`/start_vzp`", "Запустить VZP (создать категорию)", f"Только в <#{allowed_channel}>"),
+        ("`/close_vzp`", "Закрыть VZP (удалить категорию и записать результат)", f"Только в <#{allowed_channel}>"),
+        ("`/stop_reactions`", "Остановить приём заявок", f"Только в <#{allowed_channel}>"),
+        ("`/return_reactions`", "Возобновить приём заявок", f"Только в <#{allowed_channel}>"),
+        ("`/swap_player`", "Заменить игрока в VZP", f"Только в <#{allowed_channel}>"),
+        ("`/del_list`", "Удалить пользователя(ей) из списка", f"Только в <#{allowed_channel}>"),
+        ("`/add_vzp`", "Добавить пользователя в VZP (работает даже во время VZP)", f"Только в <#{allowed_channel}>"),
         ("`/call_vzp`", "Создать распределение позиций", "✅ РАБОТАЕТ ВЕЗДЕ"),
         ("`/clear_positions`", "Очистить все позиции в канале", "✅ РАБОТАЕТ ВЕЗДЕ"),
         ("`/close_positions`", "Завершить набор позиций", "✅ РАБОТАЕТ ВЕЗДЕ"),
         ("`/ping`", "Пингануть всех участников VZP", "✅ РАБОТАЕТ ВЕЗДЕ (отправляет 5 раз @everyone)"),
         ("`/list_vzp`", "Показать активные VZP", "✅ РАБОТАЕТ ВЕЗДЕ"),
+        ("`/stats`", "Статистика игрока по закрытым VZP", "✅ РАБОТАЕТ ВЕЗДЕ"),
+        ("`/leaderboard`", "Таблица лидеров: посещаемость, победы, точки", "✅ РАБОТАЕТ ВЕЗДЕ"),
+        ("`/profile`", "Профилировать бота N секунд (для админов)", "✅ РАБОТАЕТ ВЕЗДЕ"),
+        ("`/bot_stats`", "Задержка цикла событий и зависания (для админов)", "✅ РАБОТАЕТ ВЕЗДЕ"),
+        ("`/vzp_config`", "Настройки VZP этого сервера: каналы, роли, лимиты", "✅ Для админов VZP и управляющих сервером"),
+        ("`/export_vzp`", "Выгрузить историю VZP в CSV/JSONL", "✅ РАБОТАЕТ ВЕЗДЕ (офлайн: `python stealzbot2.py export`)"),
         ("`/voice_status`", "Показать статус игроков в голосовом канале VZP", "✅ Определяет VZP ID автоматически по категории канала"),
         ("`/help_vzp`", "Эта справка", "✅ РАБОТАЕТ ВЕЗДЕ")
     ]
@@ -1964,10 +4695,30 @@ async def on_ready():
     print('   /close_positions - завершить набор позиций (работает везде)')
     print('   /ping - пингануть всех (работает везде, отправляет 5 раз @everyone)')
     print('   /list_vzp - список VZP (работает везде)')
+    print('   /stats - статистика игрока (работает везде)')
+    print('   /leaderboard - таблица лидеров (работает везде)')
+    print('   /export_vzp - выгрузка истории VZP (работает везде)')
+    print('   /profile - профилирование бота (работает везде, только админы)')
+    print('   /bot_stats - состояние бота (работает везде, только админы)')
+    print('   /vzp_config - настройки сервера (админы VZP и управляющие сервером)')
     print('   /voice_status - статус голосовой активности (работает везде)')
     print('   /help_vzp - помощь (работает везде)')
     print('=' * 50)
     
+    adopt_legacy_data()
+    fill_member_cache()
+    reconcile_voice_sessions()
+    
+    for guild in bot.guilds:
+        if is_configured_guild(guild):
+            schedule_pool_warmup(guild)
+    
+    retry_pending_cleanup()
+    for guild_id, pinned in leaderboard_message.items():
+        if pinned.get('message_id'):
+            schedule_leaderboard_rollover(guild_id)
+    wake_scheduler()
+    
     await bot.change_presence(
         activity=discord.Activity(
             type=discord.ActivityType.watching,
@@ -1975,12 +4726,56 @@ async def on_ready():
         )
     )
 
+def run_export_cli(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="stealzbot2.py export", description="Выгрузка истории VZP без запуска бота")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('--output', '-o', default='-', help="Файл выгрузки, '-' - stdout")
+    parser.add_argument('--guild', type=int, help="ID сервера, чья история выгружается")
+    parser.add_argument('--data', help="Файл данных бота (по умолчанию - файл сервера из --guild)")
+    parser.add_argument('--from', dest='date_from', help="Дата начала, ДД.ММ.ГГГГ")
+    parser.add_argument('--to', dest='date_to', help="Дата конца, ДД.ММ.ГГГГ")
+    parser.add_argument('--enemy', help="Часть имени противника")
+    parser.add_argument('--result', choices=['win', 'lose'])
+    parser.add_argument('--gzip', action='store_true', help="Сжать выгрузку")
+    args = parser.parse_args(argv)
+    
+    try:
+        date_from = parse_export_date(args.date_from)
+        date_to = parse_export_date(args.date_to)
+    except ValueError:
+        parser.error("даты указываются в формате ДД.ММ.ГГГГ")
+    
+    if not args.data and not args.guild:
+        parser.error("укажите --guild или --data")
+    records = load_closed_records(args.data or guild_file(args.guild, DATA_FILE))
+    rows = iter_export_rows(records.items(), date_from, date_to, args.enemy, args.result)
+    
+    if args.output == '-':
+        count = write_export(rows, args.format, sys.stdout)
+        print(f"📤 Выгружено VZP: {count}", file=sys.stderr)
+        return
+    
+    path, count = export_to_file(rows, args.format, args.output, compress=args.gzip)
+    print(f"📤 Выгружено VZP: {count} → {path}", file=sys.stderr)
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'export':
+        run_export_cli(sys.argv[2:])
+        sys.exit(0)
+    if '--force-sync' in sys.argv[1:]:
+        SYNC_FORCE = True
+    
+    if not TOKEN:
+        print("❌ ОШИБКА: DISCORD_TOKEN не найден в .env файле!")
+        exit(1)
+    
     print("🚀 Запуск бота VZP Manager...")
     print("📂 Загрузка сохраненных данных...")
     
+    setup_logging()
+    
     try:
-        bot.run(TOKEN)
+        bot.run(TOKEN, log_handler=None)
     except KeyboardInterrupt:
         print("\n🛑 Бот остановлен пользователем")
         save_data()